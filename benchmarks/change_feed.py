@@ -0,0 +1,122 @@
+"""
+Change Feed Benchmark
+
+Polls for the changes of a sync job two ways: by listing every wishlist
+through GET /api/wishlists, and by reading GET /api/wishlists/changes from
+the cursor of the last poll. Between polls a few wishlists are renamed and
+get a product. Reports the latency of a poll and the bytes it returns for
+tables of growing size.
+
+Usage:
+  DATABASE_URI=postgresql+psycopg://postgres:@localhost/postgres python benchmarks/change_feed.py --sizes 1000,10000
+  python benchmarks/change_feed.py --changes 50
+
+The tables are dropped and recreated, never point this at real data.
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from sqlalchemy import insert  # noqa: E402
+from service import app  # noqa: E402
+from service.common.job_runner import runner  # noqa: E402
+from service.models import Product, Wishlist, db  # noqa: E402
+
+BASE_URL = "/api/wishlists"
+
+
+def populate(count, products):
+    """Inserts count wishlists with products each"""
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    db.session.execute(
+        insert(Wishlist),
+        [
+            {"name": f"wishlist {number}", "owner": f"owner {number % 100}",
+             "date_joined": date(2023, 1 + number % 12, 1 + number % 28)}
+            for number in range(count)
+        ],
+    )
+    ids = db.session.scalars(db.select(Wishlist.id)).all()
+    db.session.execute(
+        insert(Product),
+        [{"wishlist_id": key, "name": f"item {number}", "quantity": number} for key in ids for number in range(products)],
+    )
+    db.session.commit()
+    db.session.remove()
+    return ids
+
+
+def change(client, headers, ids, count, round_number):
+    """Renames count wishlists and adds a product to each"""
+    for number in range(count):
+        key = ids[(round_number * count + number) % len(ids)]
+        client.patch(f"{BASE_URL}/{key}", json={"name": f"renamed {round_number} {number}"}, headers=headers)
+        client.post(
+            f"{BASE_URL}/{key}/products",
+            json={"name": f"new {round_number} {number}", "wishlist_id": key, "quantity": 1},
+            headers=headers,
+        )
+
+
+def timed(client, url):
+    """Returns the response of a GET and its milliseconds"""
+    began = time.perf_counter()
+    resp = client.get(url, headers={"Accept-Encoding": "identity"})
+    elapsed = (time.perf_counter() - began) * 1000
+    assert resp.status_code == 200
+    return resp, elapsed
+
+
+def run(size, products, changes, rounds):
+    """Returns the best latency and the bytes of each way of polling a table"""
+    client = app.test_client()
+    headers = {"X-Api-Key": app.config["API_KEY"]}
+    ids = populate(size, products)
+    link = timed(client, f"{BASE_URL}/changes?limit=1000")[0].headers["Link"]
+    # skip the changes of the initial load, a sync job would list the table once
+    while True:
+        resp = client.get(link[1:link.index(">")])
+        link = resp.headers["Link"]
+        if len(resp.get_json()) < 1000:
+            break
+    best = {}
+    for round_number in range(rounds):
+        change(client, headers, ids, changes, round_number)
+        for name, url in (("full listing", BASE_URL), ("change feed", link[1:link.index(">")])):
+            resp, elapsed = timed(client, url)
+            if name == "change feed":
+                link = resp.headers["Link"]
+            best[name] = min(best.get(name, (elapsed, 0))[0], elapsed), len(resp.data)
+    return best
+
+
+def main():
+    """Prints a markdown table of the cost of a poll per table size"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="1000,10000")
+    parser.add_argument("--products", type=int, default=3)
+    parser.add_argument("--changes", type=int, default=10)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    runner.stop()
+    app.config["ADMISSION_CONTROL"] = False
+    app.config["API_KEY"] = "benchmark"
+    logging.getLogger("service").setLevel(logging.WARNING)
+    print("| wishlists | poll | ms per poll | KiB per poll |")
+    print("|---:|---|---:|---:|")
+    for size in (int(size) for size in args.sizes.split(",")):
+        for name, (elapsed, length) in run(size, args.products, args.changes, args.rounds).items():
+            print(f"| {size} | {name} | {elapsed:.1f} | {length / 1024:.1f} |")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Response Compression Benchmark
+
+Builds the JSON body of a wishlist listing with embedded products and
+measures the bytes on the wire and the CPU time spent compressing it at
+every gzip level, every listed brotli quality when brotli is installed,
+and for a stream flushed after every wishlist.
+
+Usage:
+  python benchmarks/compression_levels.py --wishlists 2000 --products 10
+
+No database is needed, the body has the same shape as GET /api/wishlists.
+"""
+import argparse
+import json
+import random
+import time
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+GZIP_WBITS = 31
+WORDS = ["coffee", "tea", "mug", "pot", "kettle", "grinder", "filter", "beans", "cup", "saucer",
+         "red", "blue", "green", "large", "small", "steel", "glass", "ceramic", "gift", "book"]
+
+
+def build_wishlists(count, products):
+    """Returns wishlists as serialized by the service"""
+    rng = random.Random(7)
+    wishlists = []
+    product_id = 1
+    for wishlist_id in range(1, count + 1):
+        items = []
+        for _ in range(products):
+            items.append({
+                "id": product_id,
+                "wishlist_id": wishlist_id,
+                "name": " ".join(rng.sample(WORDS, 3)),
+                "quantity": rng.randint(1, 9),
+            })
+            product_id += 1
+        wishlists.append({
+            "id": wishlist_id,
+            "name": f"{rng.choice(WORDS)} list {wishlist_id}",
+            "owner": f"user{rng.randint(1, count // 10 + 1)}",
+            "date_joined": f"2023-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "products": items,
+            "product_count": products,
+            "total_quantity": sum(item["quantity"] for item in items),
+        })
+    return wishlists
+
+
+def gzip_body(body, level):
+    """Compresses a whole body"""
+    stream = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    return stream.compress(body) + stream.flush()
+
+
+def gzip_stream(chunks, level):
+    """Compresses chunk by chunk with a sync flush after each, like a stream"""
+    stream = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    parts = [stream.compress(chunk) + stream.flush(zlib.Z_SYNC_FLUSH) for chunk in chunks]
+    parts.append(stream.flush())
+    return b"".join(parts)
+
+
+def measure(function, repeat):
+    """Returns the output of function and its median CPU time in ms"""
+    timings = []
+    for _ in range(repeat):
+        began = time.process_time()
+        output = function()
+        timings.append((time.process_time() - began) * 1000)
+    timings.sort()
+    return output, timings[len(timings) // 2]
+
+
+def main():
+    """Prints a markdown table of sizes and CPU costs"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--wishlists", type=int, default=2000)
+    parser.add_argument("--products", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    wishlists = build_wishlists(args.wishlists, args.products)
+    body = json.dumps(wishlists).encode()
+    chunks = [b"["] + [json.dumps(item).encode() + b"," for item in wishlists] + [b"]"]
+    print(f"identity body {len(body) / 1024:.0f} KiB, {args.wishlists} wishlists x {args.products} products")
+
+    cases = [(f"gzip -{level}", lambda level=level: gzip_body(body, level)) for level in range(1, 10)]
+    cases.append(("gzip -6 streamed", lambda: gzip_stream(chunks, 6)))
+    if brotli:
+        for quality in (1, 4, 6, 9, 11):
+            cases.append((f"br q{quality}", lambda quality=quality: brotli.compress(body, quality=quality)))
+    else:
+        print("brotli is not installed, skipping it")
+
+    print("| encoding | KiB on the wire | ratio | CPU ms | MiB/s |")
+    print("|---|---:|---:|---:|---:|")
+    for label, function in cases:
+        output, cpu_ms = measure(function, args.repeat)
+        speed = len(body) / (1 << 20) / (cpu_ms / 1000) if cpu_ms else float("inf")
+        print(f"| {label} | {len(output) / 1024:.0f} | {len(body) / len(output):.1f} | {cpu_ms:.1f} | {speed:.0f} |")
+
+
+if __name__ == "__main__":
+    main()
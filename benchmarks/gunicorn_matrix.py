@@ -0,0 +1,147 @@
+"""
+Gunicorn Worker Model Benchmark
+
+Starts the service under each worker model in gunicorn.conf.py and measures
+the throughput of the existing endpoints with a pool of client threads.
+
+Usage:
+  python benchmarks/gunicorn_matrix.py --duration 10 --concurrency 16
+
+The DATABASE_URI environment variable selects the database, exactly as it
+does for the service.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from urllib.error import URLError
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (label, environment for gunicorn.conf.py)
+MATRIX = [
+    ("sync x1", {"GUNICORN_WORKER_CLASS": "sync", "GUNICORN_WORKERS": "1"}),
+    ("sync x2", {"GUNICORN_WORKER_CLASS": "sync", "GUNICORN_WORKERS": "2"}),
+    ("gthread x1 t4", {"GUNICORN_WORKER_CLASS": "gthread", "GUNICORN_WORKERS": "1", "GUNICORN_THREADS": "4"}),
+    ("gthread x2 t4", {"GUNICORN_WORKER_CLASS": "gthread", "GUNICORN_WORKERS": "2", "GUNICORN_THREADS": "4"}),
+    (
+        "gthread x2 t4 preload",
+        {"GUNICORN_WORKER_CLASS": "gthread", "GUNICORN_WORKERS": "2", "GUNICORN_THREADS": "4", "GUNICORN_PRELOAD": "true"},
+    ),
+    ("gevent x1", {"GUNICORN_WORKER_CLASS": "gevent", "GUNICORN_WORKERS": "1"}),
+]
+
+
+def request(url, method="GET", body=None):
+    """Sends one request and returns the status code and body"""
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, method=method)
+    req.add_header("Content-Type", "application/json")
+    with urllib.request.urlopen(req, timeout=30) as resp:
+        return resp.status, resp.read()
+
+
+def wait_for(url, timeout=30):
+    """Waits until the service answers its health check"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            request(f"{url}/health")
+            return
+        except (URLError, ConnectionError):
+            time.sleep(0.2)
+    raise RuntimeError("service did not start")
+
+
+def seed(url, count=50):
+    """Creates wishlists with products once and returns the last id"""
+    _, body = request(f"{url}/api/wishlists?name=bench-{count - 1}")
+    existing = json.loads(body)
+    if existing:
+        return existing[0]["id"]
+    wishlist_id = None
+    for i in range(count):
+        _, body = request(
+            f"{url}/api/wishlists",
+            "POST",
+            {"name": f"bench-{i}", "owner": f"owner-{i % 5}", "date_joined": "2023-01-01", "products": []},
+        )
+        wishlist_id = json.loads(body)["id"]
+        for j in range(3):
+            request(
+                f"{url}/api/wishlists/{wishlist_id}/products",
+                "POST",
+                {"name": f"item-{j}", "wishlist_id": wishlist_id, "quantity": j + 1},
+            )
+    return wishlist_id
+
+
+def hammer(url, duration, concurrency):
+    """Runs concurrent clients against url and returns requests per second"""
+    done = []
+    errors = []
+    stop = time.monotonic() + duration
+
+    def client():
+        count = 0
+        while time.monotonic() < stop:
+            try:
+                request(url)
+                count += 1
+            except (URLError, ConnectionError):
+                errors.append(1)
+        done.append(count)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(done) / duration, len(errors)
+
+
+def main():
+    """Runs the benchmark matrix and prints a markdown table"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--port", type=int, default=8090)
+    args = parser.parse_args()
+
+    url = f"http://127.0.0.1:{args.port}"
+    print("| worker model | endpoint | req/s | errors |")
+    print("|---|---|---:|---:|")
+    for label, settings in MATRIX:
+        if settings["GUNICORN_WORKER_CLASS"] == "gevent" and not importlib.util.find_spec("gevent"):
+            print(f"| {label} | skipped, gevent is not installed | | |")
+            continue
+        env = dict(os.environ, PORT=str(args.port), GUNICORN_LOG_LEVEL="warning", **settings)
+        with subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "--config", "gunicorn.conf.py", "service:app"],
+            cwd=ROOT,
+            env=env,
+        ) as server:
+            try:
+                wait_for(url)
+                wishlist_id = seed(url)
+                endpoints = {
+                    "/health": f"{url}/health",
+                    "list wishlists": f"{url}/api/wishlists?owner=owner-1",
+                    "get wishlist": f"{url}/api/wishlists/{wishlist_id}",
+                    "list products": f"{url}/api/wishlists/{wishlist_id}/products",
+                }
+                for name, endpoint in endpoints.items():
+                    rate, errors = hammer(endpoint, args.duration, args.concurrency)
+                    print(f"| {label} | {name} | {rate:.0f} | {errors} |")
+            finally:
+                server.terminate()
+                server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Listing Memory Benchmark
+
+Lists every wishlist with its products through GET /api/wishlists, and
+through the repository alone, once with ORM instances and once with the
+read-only rows of the fast path, and once more streamed with stream=true,
+reading the body a chunk at a time like a server writing it out. Reports
+the peak memory traced by tracemalloc per 10k wishlists, and the time per
+listing.
+
+Usage:
+  DATABASE_URI=postgresql+psycopg://postgres:@localhost/postgres python benchmarks/listing_memory.py --wishlists 10000
+
+The tables are dropped and recreated, never point this at real data.
+"""
+import argparse
+import gc
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from datetime import date
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from sqlalchemy import insert  # noqa: E402
+from service import app, routes  # noqa: E402
+from service.common.job_runner import runner  # noqa: E402
+from service.models import Product, Wishlist, db  # noqa: E402
+from service.repository import SqlRepository  # noqa: E402
+
+MODES = {"instances": SqlRepository.list_wishlists, "rows": SqlRepository.read_wishlists}
+
+
+def populate(count, products):
+    """Inserts count wishlists with products each"""
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    db.session.execute(
+        insert(Wishlist),
+        [
+            {"name": f"wishlist {number}", "owner": f"owner {number % 100}",
+             "date_joined": date(2023, 1 + number % 12, 1 + number % 28)}
+            for number in range(count)
+        ],
+    )
+    ids = db.session.scalars(db.select(Wishlist.id)).all()
+    db.session.execute(
+        insert(Product),
+        [{"wishlist_id": key, "name": f"item {number}", "quantity": number} for key in ids for number in range(products)],
+    )
+    db.session.commit()
+
+
+def traced(action):
+    """Returns the peak of the memory traced while action runs, in MiB, and its seconds"""
+    db.session.remove()
+    gc.collect()
+    tracemalloc.start()
+    began = time.perf_counter()
+    action()
+    elapsed = time.perf_counter() - began
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    db.session.remove()
+    return peak / 2**20, elapsed
+
+
+def main():
+    """Prints a markdown table of the peak memory of each mode"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--wishlists", type=int, default=10000)
+    parser.add_argument("--products", type=int, default=3)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    runner.stop()
+    app.config["ADMISSION_CONTROL"] = False
+    logging.getLogger("service").setLevel(logging.WARNING)
+    populate(args.wishlists, args.products)
+    client = app.test_client()
+    repository = SqlRepository()
+
+    def endpoint():
+        assert client.get("/api/wishlists", headers={"Accept-Encoding": "identity"}).status_code == 200
+
+    def streamed():
+        resp = client.get("/api/wishlists?stream=true", headers={"Accept-Encoding": "identity"}, buffered=False)
+        for _ in resp.response:
+            pass
+        resp.close()
+
+    def serialized(fetch):
+        return lambda: [record.serialize() for record in fetch(repository, {})]
+
+    # the best of a few interleaved rounds, so a noisy moment hits every mode
+    best = {}
+    for _ in range(args.rounds):
+        for mode, fetch in MODES.items():
+            with patch.object(routes, "repository", repository), patch.object(SqlRepository, "read_wishlists", fetch):
+                for name, action in (("GET /api/wishlists", endpoint), ("repository + serialize", serialized(fetch))):
+                    result = traced(action)
+                    best[name, mode] = min(best.get((name, mode), result), result)
+        with patch.object(routes, "repository", repository):
+            result = traced(streamed)
+        key = ("GET /api/wishlists?stream=true", "rows")
+        best[key] = min(best.get(key, result), result)
+    scale = 10000 / args.wishlists
+    print("| listing | records | peak MiB per 10k | seconds per 10k |")
+    print("|---|---|---:|---:|")
+    for (name, mode), (peak, elapsed) in best.items():
+        print(f"| {name} | {mode} | {peak * scale:.1f} | {elapsed * scale:.2f} |")
+
+
+if __name__ == "__main__":
+    main()
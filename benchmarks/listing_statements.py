@@ -0,0 +1,143 @@
+"""
+Listing Statements Benchmark
+
+Repeats the queries of a wishlist listing filtered by owner and by a date
+range, the page of rows and its count, the way they were built before (a
+select built for every call) and as the routes run them now (the statement
+of each shape built once and reused with bind parameters), with server-side
+prepared statements off and on when the database is PostgreSQL. Reports the latency and the client CPU per listing, and the CPU
+of the PostgreSQL processes when they run on this host.
+
+Usage:
+  DATABASE_URI=postgresql+psycopg://postgres:@localhost/postgres python benchmarks/listing_statements.py --listings 5000
+
+The tables are dropped and recreated, never point this at real data.
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position, not-callable
+from sqlalchemy import event, func, select  # noqa: E402
+from service import app  # noqa: E402
+from service.common.job_runner import runner  # noqa: E402
+from service.models import Product, Wishlist, WishlistRow, db  # noqa: E402
+
+# two wishlists per owner and a few per day, the listings return a handful of rows
+OWNERS = 1000
+PAGE = 20
+
+
+def server_cpu():
+    """Returns the CPU seconds used by the postgres processes of this host"""
+    ticks = os.sysconf("SC_CLK_TCK")
+    total = 0
+    for pid in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            with open(f"/proc/{pid}/stat", encoding="utf-8") as stat:
+                fields = stat.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{pid}/comm", encoding="utf-8") as comm:
+                name = comm.read().strip()
+        except OSError:
+            continue
+        if name.startswith("postgres"):
+            total += int(fields[11]) + int(fields[12])
+    return total / ticks
+
+
+def select_listing(owner, start, end):
+    """The listing as it was: a select built on every call"""
+    criteria = {"owner": owner, "start": start, "end": end}
+    conditions = Wishlist._criteria_conditions(criteria)  # pylint: disable=protected-access
+    statement = select(*WishlistRow.columns()).where(*conditions).order_by(*Wishlist.sort_order([]))
+    rows = db.session.execute(statement.limit(PAGE), execution_options={"single_flight": True}).all()
+    products = Product.rows_by_wishlist([row.id for row in rows])
+    [WishlistRow(*row, products.get(row.id, [])) for row in rows]  # pylint: disable=expression-not-assigned
+    db.session.execute(select(func.count()).select_from(Wishlist).where(*conditions)).scalar_one()
+
+
+def cached_listing(owner, start, end):
+    """The listing as the routes run it"""
+    criteria = {"owner": owner, "start": start, "end": end}
+    Wishlist.find_rows(criteria, limit=PAGE)
+    Wishlist.count_matching(criteria)
+
+
+def run(listing, count, threshold):
+    """Returns latency, client CPU and server CPU per listing, in µs"""
+
+    def prepare(dbapi_connection, connection_record):  # pylint: disable=unused-argument
+        dbapi_connection.prepare_threshold = threshold
+
+    postgres = db.engine.dialect.name == "postgresql"
+    if postgres:
+        event.listen(db.engine, "connect", prepare)
+        db.session.remove()
+        db.engine.dispose()
+    try:
+        for number in range(count // 10):  # warm up the connections and caches
+            listing(f"owner {number % OWNERS}", date(2023, 1, 1), date(2023, 1, 1))
+        served = server_cpu() if postgres else 0
+        wall, cpu = time.perf_counter(), time.process_time()
+        for number in range(count):
+            day = date(2023, number % 12 + 1, number % 28 + 1)
+            listing(f"owner {number % OWNERS}", day, day)
+            db.session.rollback()
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        served = server_cpu() - served if postgres else None
+    finally:
+        if postgres:
+            event.remove(db.engine, "connect", prepare)
+    per_listing = 1e6 / count
+    return wall * per_listing, cpu * per_listing, None if served is None else served * per_listing
+
+
+def main():
+    """Prints a markdown table of the cost per listing"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--listings", type=int, default=5000)
+    parser.add_argument("--wishlists", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    runner.stop()
+    app.config["ADMISSION_CONTROL"] = False
+    logging.getLogger("service").setLevel(logging.WARNING)
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    db.session.add_all(
+        Wishlist(  # pylint: disable=unexpected-keyword-arg
+            name=f"wishlist {number}",
+            owner=f"owner {number % OWNERS}",
+            date_joined=date(2023, 1 + number % 12, 1 + number % 28),
+        )
+        for number in range(args.wishlists)
+    )
+    db.session.commit()
+
+    thresholds = [None, app.config["DB_PREPARE_THRESHOLD"]] if db.engine.dialect.name == "postgresql" else [None]
+    modes = [(name, listing, threshold) for threshold in thresholds
+             for name, listing in (("select", select_listing), ("cached", cached_listing))]
+    # the best of a few interleaved rounds, so a noisy moment hits every mode
+    best = {}
+    for _ in range(args.rounds):
+        for name, listing, threshold in modes:
+            result = run(listing, args.listings, threshold)
+            best[name, threshold] = min(best.get((name, threshold), result), result)
+    print("| statements | prepared | latency µs | client CPU µs | server CPU µs |")
+    print("|---|---|---:|---:|---:|")
+    for name, _, threshold in modes:
+        latency, cpu, served = best[name, threshold]
+        prepared = "off" if threshold is None else f"after {threshold}"
+        served = "n/a" if served is None else f"{served:.0f}"
+        print(f"| {name} | {prepared} | {latency:.0f} | {cpu:.0f} | {served} |")
+
+
+if __name__ == "__main__":
+    main()
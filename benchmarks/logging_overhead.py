@@ -0,0 +1,132 @@
+"""
+Logging Overhead Benchmark
+
+Sends the same read requests through the Flask test client with the logs
+written in the request thread as plain text (how the service logged before
+the queue), through the queue as JSON, and through the queue with the model
+calls sampled. A run with the level at WARNING gives the cost of a request
+without logging, the overhead is the difference to it. The records go to a
+file, as they would to the pipe of a container; --sink-delay makes every
+write wait as long as a stalled pipe or a remote log driver would.
+
+Usage:
+  DATABASE_URI=sqlite:////tmp/bench.db python benchmarks/logging_overhead.py --requests 2000
+
+The tables are dropped and recreated, never point this at real data.
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from service import app  # noqa: E402
+from service.common import log_handlers  # noqa: E402
+from service.common.job_runner import runner  # noqa: E402
+from service.models import db  # noqa: E402
+
+BASE_URL = "/api/wishlists"
+
+
+class SlowFileHandler(logging.FileHandler):
+    """A log file whose every write waits a while"""
+
+    def __init__(self, path, delay):
+        super().__init__(path)
+        self.delay = delay
+
+    def emit(self, record):
+        time.sleep(self.delay)
+        super().emit(record)
+
+
+MODES = [
+    ("off", {"LOG_LEVEL": "WARNING", "LOG_FORMAT": "text", "LOG_ASYNC": False, "LOG_SAMPLING": ""}),
+    ("sync text", {"LOG_LEVEL": "INFO", "LOG_FORMAT": "text", "LOG_ASYNC": False, "LOG_SAMPLING": ""}),
+    ("async json", {"LOG_LEVEL": "INFO", "LOG_FORMAT": "json", "LOG_ASYNC": True, "LOG_SAMPLING": ""}),
+    (
+        "async json, models sampled 0.1",
+        {"LOG_LEVEL": "INFO", "LOG_FORMAT": "json", "LOG_ASYNC": True, "LOG_SAMPLING": "service.models=0.1"},
+    ),
+]
+
+
+def seed(client, headers, wishlists):
+    """Creates wishlists with a few products, returns the URLs to read"""
+    urls = []
+    for number in range(wishlists):
+        wishlist = client.post(
+            BASE_URL,
+            json={"name": f"bench {number}", "owner": "bench", "date_joined": "2023-01-01", "products": []},
+            headers=headers,
+        ).get_json()
+        for item in range(3):
+            client.post(
+                f"{BASE_URL}/{wishlist['id']}/products",
+                json={"name": f"item {item}", "wishlist_id": wishlist["id"], "quantity": 1},
+                headers=headers,
+            )
+        urls += [f"{BASE_URL}/{wishlist['id']}", f"{BASE_URL}/{wishlist['id']}/products"]
+    return urls
+
+
+def run(settings, client, urls, count, path, delay):
+    """Returns the ms per request and the records written per request"""
+    # pylint: disable=too-many-arguments
+    with open(path, "w", encoding="utf-8"):
+        pass
+    logging.getLogger("bench.gunicorn").handlers = [SlowFileHandler(path, delay)]
+    app.config.update(settings)
+    log_handlers.init_logging(app, "bench.gunicorn")
+    began = time.perf_counter()
+    for number in range(count):
+        client.get(urls[number % len(urls)])
+    elapsed = time.perf_counter() - began
+    if log_handlers.pipeline:
+        log_handlers.pipeline.stop()
+        log_handlers.pipeline = None
+    with open(path, encoding="utf-8") as log:
+        records = sum(1 for _ in log)
+    return elapsed / count * 1000, records / count
+
+
+def main():
+    """Prints a markdown table of the logging cost per request"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--wishlists", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--sink-delay", type=float, default=0, help="seconds every log write waits")
+    args = parser.parse_args()
+
+    runner.stop()
+    app.config["ADMISSION_CONTROL"] = False
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    client = app.test_client()
+    headers = {"X-Api-Key": app.config["API_KEY"]}
+    app.logger.setLevel(logging.WARNING)
+    urls = seed(client, headers, args.wishlists)
+
+    path = os.path.join(tempfile.mkdtemp(), "service.log")
+    # the best of a few interleaved rounds, so a noisy moment hits every mode
+    best = {}
+    for _ in range(args.rounds):
+        for name, settings in MODES:
+            latency, records = run(settings, client, urls, args.requests, path, args.sink_delay)
+            best[name] = min(best.get(name, (latency, records)), (latency, records))
+    floor = best["off"][0]
+    print("| logging | records/request | ms/request | overhead µs/request |")
+    print("|---|---:|---:|---:|")
+    for name, _ in MODES:
+        latency, records = best[name]
+        print(f"| {name} | {records:.1f} | {latency:.3f} | {(latency - floor) * 1000:.0f} |")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Product Search Benchmark
+
+Loads a large number of products and measures the latency of substring and
+fuzzy searches through Product.search, using pg_trgm when the database has it
+and the in-process trigram index otherwise.
+
+Usage:
+  DATABASE_URI=sqlite:////tmp/search.db python benchmarks/product_search.py --products 1000000
+
+The tables are dropped and recreated, never point this at real data.
+"""
+import argparse
+import os
+import random
+import resource
+import statistics
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from service import app  # noqa: E402
+from service.models import db, Product, Wishlist, trigram_search_enabled  # noqa: E402
+
+WORDS = [
+    "coffee", "tea", "mug", "pot", "kettle", "grinder", "filter", "beans", "cup", "saucer",
+    "spoon", "fork", "knife", "plate", "bowl", "pan", "skillet", "wok", "lid", "tray",
+    "red", "blue", "green", "black", "white", "large", "small", "steel", "glass", "ceramic",
+]
+
+QUERIES = [
+    ("substring, common", "coffee", False),
+    ("substring, rare", "grinder steel", False),
+    ("substring, short", "wo", False),
+    ("fuzzy, typo", "cofee mugg", True),
+    ("fuzzy, partial", "ceramik kettle", True),
+]
+
+
+def load(products, per_wishlist=10, batch=10000):
+    """Recreates the tables and inserts products in batches"""
+    db.drop_all()
+    db.create_all()
+    rng = random.Random(42)
+    wishlists = products // per_wishlist
+    db.session.execute(
+        Wishlist.__table__.insert(),
+        [{"id": i + 1, "name": f"list {i}", "owner": f"owner {i % 1000}", "date_joined": date(2023, 1, 1)}
+         for i in range(wishlists)],
+    )
+    for start in range(0, products, batch):
+        rows = []
+        for first in range(start, min(start + batch, products), per_wishlist):
+            # names are unique within a wishlist
+            names = set()
+            while len(names) < min(per_wishlist, products - first):
+                names.add(" ".join(rng.sample(WORDS, 3)))
+            rows.extend(
+                {"wishlist_id": first // per_wishlist + 1, "name": name, "quantity": rng.randint(1, 5)}
+                for name in sorted(names)
+            )
+        db.session.execute(Product.__table__.insert(), rows)
+    db.session.commit()
+
+
+def measure(term, fuzzy, repeat):
+    """Returns the latencies in milliseconds of repeated searches"""
+    timings = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        Product.search(term, fuzzy=fuzzy, limit=20)
+        timings.append((time.perf_counter() - began) * 1000)
+        db.session.rollback()
+    return timings
+
+
+def main():
+    """Loads the data and prints a markdown table of latencies"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--products", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with app.app_context():
+        began = time.perf_counter()
+        load(args.products)
+        print(f"loaded {args.products} products in {time.perf_counter() - began:.1f}s")
+        backend = "pg_trgm" if trigram_search_enabled() else "in-process trigram index"
+
+        began = time.perf_counter()
+        Product.search("warm up")
+        print(f"first search ({backend}) took {(time.perf_counter() - began) * 1000:.0f} ms")
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+        print(f"peak RSS {rss} MiB")
+
+        print("| query | p50 ms | p95 ms |")
+        print("|---|---:|---:|")
+        for label, term, fuzzy in QUERIES:
+            timings = sorted(measure(term, fuzzy, args.repeat))
+            p95 = timings[int(len(timings) * 0.95) - 1]
+            print(f"| {label} | {statistics.median(timings):.1f} | {p95:.1f} |")
+
+
+if __name__ == "__main__":
+    main()
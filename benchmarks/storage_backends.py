@@ -0,0 +1,128 @@
+"""
+Storage Backends Benchmark
+
+Sends the same requests through the Flask test client with each storage
+backend behind the routes: creating wishlists, adding products, reading a
+wishlist, listing by owner and by date range, searching product names and
+summarizing an owner. Reports the latency per request of each operation.
+The sql backend reads a wishlist from a row plus a row per product, the
+document backend from one JSON document.
+
+Usage:
+  DATABASE_URI=postgresql+psycopg://postgres:@localhost/postgres python benchmarks/storage_backends.py --wishlists 500
+  python benchmarks/storage_backends.py --backends sql,document --products 20
+
+The tables are dropped and recreated, never point this at real data.
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from service import app, jobs, routes  # noqa: E402
+from service.common.job_runner import runner  # noqa: E402
+from service.models import db  # noqa: E402
+from service.repository import create_repository  # noqa: E402
+
+BASE_URL = "/api/wishlists"
+OWNERS = 50
+
+
+def operations(client, headers, count, products):
+    """Yields (name, requests) pairs, each request a function sending one"""
+    ids = []
+
+    def create(number):
+        resp = client.post(
+            BASE_URL,
+            json={
+                "name": f"wishlist {number}",
+                "owner": f"owner {number % OWNERS}",
+                "date_joined": f"2023-{number % 12 + 1:02}-{number % 28 + 1:02}",
+                "products": [],
+            },
+            headers=headers,
+        )
+        ids.append(resp.get_json()["id"])
+
+    yield "create wishlist", [lambda number=number: create(number) for number in range(count)]
+    yield "add product", [
+        lambda key=key, number=number: client.post(
+            f"{BASE_URL}/{key}/products",
+            json={"name": f"item {number}", "wishlist_id": key, "quantity": 1},
+            headers=headers,
+        )
+        for number in range(products) for key in ids
+    ]
+    yield "get wishlist", [lambda key=key: client.get(f"{BASE_URL}/{key}") for key in ids]
+    yield "list by owner", [
+        lambda number=number: client.get(BASE_URL, query_string={"owner": f"owner {number % OWNERS}"})
+        for number in range(count)
+    ]
+    yield "list date range", [
+        lambda number=number: client.get(BASE_URL, query_string={
+            "start": f"2023-{number % 12 + 1:02}-01", "end": f"2023-{number % 12 + 1:02}-07", "limit": 20
+        })
+        for number in range(count)
+    ]
+    yield "search products", [
+        lambda number=number: client.get("/api/products/search", query_string={"q": f"item {number % products}"})
+        for number in range(count)
+    ]
+    yield "summarize owner", [
+        lambda number=number: client.get(f"{BASE_URL}/summary", query_string={"owner": f"owner {number % OWNERS}"})
+        for number in range(count)
+    ]
+
+
+def run(backend, count, products):
+    """Returns the milliseconds per request of each operation on a backend"""
+    repository = create_repository(backend)
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    client = app.test_client()
+    headers = {"X-Api-Key": app.config["API_KEY"]}
+    results = {}
+    with patch.object(routes, "repository", repository), patch.object(jobs, "repository", repository):
+        for name, requests in operations(client, headers, count, products):
+            began = time.perf_counter()
+            for send in requests:
+                send()
+            results[name] = (time.perf_counter() - began) / len(requests) * 1000
+    return results
+
+
+def main():
+    """Prints a markdown table of the latency of each backend"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--wishlists", type=int, default=500)
+    parser.add_argument("--products", type=int, default=3)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--backends", default="sql,document,memory")
+    args = parser.parse_args()
+
+    runner.stop()
+    app.config["ADMISSION_CONTROL"] = False
+    logging.getLogger("service").setLevel(logging.WARNING)
+    backends = args.backends.split(",")
+    # the best of a few interleaved rounds, so a noisy moment hits every backend
+    best = {}
+    for _ in range(args.rounds):
+        for backend in backends:
+            for name, latency in run(backend, args.wishlists, args.products).items():
+                best[name, backend] = min(best.get((name, backend), latency), latency)
+    names = list(dict.fromkeys(name for name, _ in best))
+    print("| request | " + " | ".join(f"{backend} ms" for backend in backends) + " |")
+    print("|---|" + "---:|" * len(backends))
+    for name in names:
+        print(f"| {name} | " + " | ".join(f"{best[name, backend]:.3f}" for backend in backends) + " |")
+
+
+if __name__ == "__main__":
+    main()
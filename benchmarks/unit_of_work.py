@@ -0,0 +1,113 @@
+"""
+Unit of Work Benchmark
+
+Sends the same write requests through the Flask test client with the unit
+of work turned off (a commit in every model call) and on (one commit per
+request), and counts the commits per request. On PostgreSQL it also reports
+the WAL flushes from pg_stat_wal, the fsyncs a commit waits for.
+
+Usage:
+  DATABASE_URI=postgresql+psycopg://postgres:@localhost/postgres python benchmarks/unit_of_work.py --requests 200
+
+The tables are dropped and recreated, never point this at real data.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from sqlalchemy import event, text  # noqa: E402
+from service import app  # noqa: E402
+from service.common.job_runner import runner  # noqa: E402
+from service.models import db  # noqa: E402
+
+BASE_URL = "/api/wishlists"
+
+
+def wal_syncs():
+    """Returns the WAL flushes of the server so far, None when unknown"""
+    if db.engine.dialect.name != "postgresql":
+        return None
+    with db.engine.connect() as connection:
+        return connection.execute(text("SELECT wal_sync FROM pg_stat_wal")).scalar()
+
+
+def scenarios(client, headers, products):
+    """Yields (name, function) pairs, each function sends one request"""
+    wishlist = client.post(
+        BASE_URL,
+        json={"name": "source", "owner": "bench", "date_joined": "2023-01-01", "products": []},
+        headers=headers,
+    ).get_json()
+    for number in range(products):
+        client.post(
+            f"{BASE_URL}/{wishlist['id']}/products",
+            json={"name": f"item {number}", "wishlist_id": wishlist["id"], "quantity": 1},
+            headers=headers,
+        )
+    yield f"copy wishlist of {products}", lambda: client.post(f"{BASE_URL}/{wishlist['id']}/copy")
+    counter = iter(range(10**9))
+    yield "create product", lambda: client.post(
+        f"{BASE_URL}/{wishlist['id']}/products",
+        json={"name": f"extra {next(counter)}", "wishlist_id": wishlist["id"], "quantity": 1},
+        headers=headers,
+    )
+
+
+def run(enabled, count, products):
+    """Returns a row of results per scenario"""
+    app.config["UNIT_OF_WORK"] = enabled
+    db.session.remove()  # ends the read transaction left by the last run
+    db.drop_all()
+    db.create_all()
+    client = app.test_client()
+    headers = {"X-Api-Key": app.config["API_KEY"]}
+    commits = []
+
+    def record(conn):
+        commits.append(conn)
+
+    rows = []
+    for name, send in scenarios(client, headers, products):
+        requests = count if name == "create product" else max(1, count // 10)
+        event.listen(db.engine, "commit", record)
+        commits.clear()
+        syncs = wal_syncs()
+        began = time.perf_counter()
+        for _ in range(requests):
+            send()
+        elapsed = time.perf_counter() - began
+        event.remove(db.engine, "commit", record)
+        after = wal_syncs()
+        rows.append((
+            "on" if enabled else "off",
+            name,
+            len(commits) / requests,
+            None if syncs is None else (after - syncs) / requests,
+            elapsed / requests * 1000,
+        ))
+    return rows
+
+
+def main():
+    """Prints a markdown table of commits and latency per request"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--products", type=int, default=20)
+    args = parser.parse_args()
+
+    runner.stop()
+    app.config["ADMISSION_CONTROL"] = False
+    print("| unit of work | request | commits/request | WAL syncs/request | ms/request |")
+    print("|---|---|---:|---:|---:|")
+    for enabled in (False, True):
+        for mode, name, commits, syncs, latency in run(enabled, args.requests, args.products):
+            syncs = "n/a" if syncs is None else f"{syncs:.1f}"
+            print(f"| {mode} | {name} | {commits:.1f} | {syncs} | {latency:.1f} |")
+
+
+if __name__ == "__main__":
+    main()
@@ -30,17 +30,15 @@ from compare import expect
 @given("the following wishlists")
 def step_impl(context):
     """Delete all Wishlists and load new ones"""
-    # List all of the wishlists and delete them one by one
+    # Delete all of the wishlists in a single request
     headers = {"X-Api-Key": context.API_KEY}
     rest_endpoint = f"{context.BASE_URL}/api/wishlists"
-    context.resp = requests.get(rest_endpoint)
+    context.resp = requests.delete(
+        rest_endpoint,
+        params={"all": "true"},
+        headers=headers,
+    )
     expect(context.resp.status_code).to_equal(200)
-    for wishlist in context.resp.json():
-        context.resp = requests.delete(
-            f"{rest_endpoint}/{wishlist['id']}",
-            headers=headers,
-        )
-        expect(context.resp.status_code).to_equal(204)
 
     # load the database with new wishlists
     for row in context.table:
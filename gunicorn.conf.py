@@ -0,0 +1,88 @@
+"""
+Gunicorn Configuration
+
+Every setting can be overridden with an environment variable so the same
+image can be tuned per deployment. gunicorn loads this file automatically
+from the working directory.
+
+Worker models:
+  sync     - one request per process, the gunicorn default
+  gthread  - a thread pool per process, good for I/O bound pods with little CPU
+  gevent   - green threads, requires the gevent package to be installed
+"""
+import os
+
+
+def _int(name: str, default: int) -> int:
+    return int(os.getenv(name, str(default)))
+
+
+def _bool(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes", "on")
+
+
+# Server socket
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '8080')}")
+backlog = _int("GUNICORN_BACKLOG", 2048)
+
+# Worker processes
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = _int("GUNICORN_WORKERS", 1)
+threads = _int("GUNICORN_THREADS", 4) if worker_class == "gthread" else 1
+worker_connections = _int("GUNICORN_WORKER_CONNECTIONS", 100)
+timeout = _int("GUNICORN_TIMEOUT", 30)
+graceful_timeout = _int("GUNICORN_GRACEFUL_TIMEOUT", 30)
+keepalive = _int("GUNICORN_KEEPALIVE", 5)
+
+# Recycle workers to keep memory bounded, the jitter avoids restarting
+# every worker at the same moment
+max_requests = _int("GUNICORN_MAX_REQUESTS", 1000)
+max_requests_jitter = _int("GUNICORN_MAX_REQUESTS_JITTER", 100)
+
+# Load the application in the master so workers share its memory
+preload_app = _bool("GUNICORN_PRELOAD", False)
+
+# Heartbeat files on tmpfs so a slow disk never kills a worker
+worker_tmp_dir = os.getenv("GUNICORN_WORKER_TMP_DIR", "/dev/shm" if os.path.isdir("/dev/shm") else None)
+
+# Logging
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+accesslog = os.getenv("GUNICORN_ACCESS_LOG")
+errorlog = os.getenv("GUNICORN_ERROR_LOG", "-")
+
+
+def when_ready(server):
+    """Stops the job runner of the master, only the workers run jobs"""
+    if not preload_app:
+        return
+    from service.common.job_runner import runner  # pylint: disable=import-outside-toplevel
+
+    runner.stop()
+    server.log.info("Master stopped its job runner")
+
+
+def post_fork(server, worker):  # pylint: disable=unused-argument
+    """Drops database connections inherited from the master
+
+    With preload_app the master has already opened connections while
+    creating the tables. Sharing those sockets between processes corrupts
+    the protocol stream, so every worker starts with an empty pool. The
+    threads of the job runner, the log listener and the cache warm up do
+    not survive the fork either, so every worker starts its own.
+    """
+    if not preload_app:
+        return
+    # pylint: disable=import-outside-toplevel
+    from service import app
+    from service.common import log_handlers
+    from service.common.readiness import probe
+    from service.common.job_runner import runner
+    from service.models import db
+
+    if log_handlers.pipeline:
+        log_handlers.pipeline.start()
+    with app.app_context():
+        db.engine.dispose(close=False)
+    server.log.info("Worker %s disposed the inherited connection pool", worker.pid)
+    runner.start()
+    probe.start_warmup()
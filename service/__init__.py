@@ -37,10 +37,11 @@ app.config.from_object(config)
 
 # Dependencies require we import the routes AFTER the Flask app is created
 # pylint: disable=wrong-import-position, wrong-import-order, cyclic-import
-from service import routes, models  # noqa: E402, E261
+from service import routes, models, jobs  # noqa: E402, E261
 
 # pylint: disable=wrong-import-position
-from service.common import error_handlers, cli_commands  # noqa: F401, E402
+from service.common import error_handlers, cli_commands, asset_cache  # noqa: F401, E402
+from service.common import admission, compression, readiness, unit_of_work  # noqa: F401, E402
 
 # Set up logging for production
 log_handlers.init_logging(app, "gunicorn.error")
@@ -61,4 +62,8 @@ except Exception as error:  # pylint: disable=broad-except
     # gunicorn requires exit code 4 to stop spawning workers when they die
     sys.exit(4)
 
+# Run background jobs in this process, gunicorn restarts the runner after a fork
+jobs.runner.start()
+readiness.probe.start_warmup()
+
 app.logger.info("Service initialized!")
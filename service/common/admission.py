@@ -0,0 +1,236 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Admission Control
+
+Every API route gets a concurrency limit that adapts to the latency it
+observes: it grows by about one per round trip while requests finish within
+the target and shrinks by a factor when they do not (AIMD). A request over
+the limit waits in a short queue and is shed with 503 and Retry-After when
+its queue-time budget runs out, so a burst fails fast instead of making
+every request slow.
+
+Routes decorated with @low_priority, the full-table lists, get half the
+starting limit and a quarter of the queue budget, and never take a slot
+while a normal request is waiting for one. Routes outside the API such as
+/health and the static files are never limited.
+"""
+import math
+import threading
+import time
+from flask import g, jsonify, request
+from service import app
+from . import status
+
+NORMAL = "normal"
+LOW = "low"
+
+# Shrink the limit by this factor when latency is over target
+DECREASE_FACTOR = 0.75
+
+
+def low_priority(function):
+    """Marks a resource method as expensive, it is shed first under load"""
+    function.admission_priority = LOW
+    return function
+
+
+######################################################################
+# Adaptive Limit
+######################################################################
+class AdaptiveLimit:
+    """The concurrency limit of one route, adjusted additively up and
+    multiplicatively down from the latency of completed requests"""
+
+    def __init__(self, priority, limit, min_limit, max_limit):
+        self.priority = priority
+        self.limit = float(limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed = 0
+        self.latency = 0.0  # moving average in seconds
+        self._last_decrease = 0.0
+
+    def has_room(self) -> bool:
+        """Tells whether another request may start now"""
+        return self.in_flight < max(self.min_limit, int(self.limit))
+
+    def complete(self, elapsed: float, target: float, now: float):
+        """Releases a slot and adapts the limit to the latency observed"""
+        saturated = self.in_flight >= int(self.limit)
+        self.in_flight -= 1
+        self.latency = elapsed if not self.latency else 0.8 * self.latency + 0.2 * elapsed
+        if elapsed > target:
+            # one decrease per round trip, requests already running saw the old limit
+            if now - self._last_decrease >= elapsed:
+                self.limit = max(self.min_limit, self.limit * DECREASE_FACTOR)
+                self._last_decrease = now
+        elif saturated:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def stats(self) -> dict:
+        """Returns the state and counters of the limit"""
+        return {
+            "priority": self.priority,
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "latency_ms": round(self.latency * 1000, 1),
+        }
+
+
+######################################################################
+# Admission Controller
+######################################################################
+class AdmissionController:
+    """Admits, queues or sheds requests against per-route adaptive limits"""
+
+    def __init__(self, limit=4, max_limit=32, queue_timeout=0.5, target_latency=0.25):
+        self.limit = limit
+        self.max_limit = max_limit
+        self.queue_timeout = queue_timeout
+        self.target_latency = target_latency
+        self._condition = threading.Condition()
+        self._limits = {}
+        self._waiting = {NORMAL: 0, LOW: 0}
+
+    def limiter(self, route: str, priority=NORMAL) -> AdaptiveLimit:
+        """Returns the limit of a route, creating it on first use"""
+        with self._condition:
+            return self._limiter(route, priority)
+
+    def _limiter(self, route, priority):
+        limiter = self._limits.get(route)
+        if limiter is None:
+            start = self.limit if priority == NORMAL else max(1, self.limit // 2)
+            limiter = self._limits[route] = AdaptiveLimit(priority, start, 1, self.max_limit)
+        return limiter
+
+    def acquire(self, route: str, priority=NORMAL, waited=0.0) -> bool:
+        """Takes a slot of the route, waiting at most what is left of the
+        queue-time budget, and tells whether the request was admitted"""
+        budget = self.queue_timeout if priority == NORMAL else self.queue_timeout / 4
+        deadline = time.monotonic() + budget - waited
+        with self._condition:
+            limiter = self._limiter(route, priority)
+            self._waiting[priority] += 1
+            try:
+                while not self._can_start(limiter):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        limiter.shed += 1
+                        return False
+                    self._condition.wait(remaining)
+            finally:
+                self._waiting[priority] -= 1
+            limiter.in_flight += 1
+            limiter.admitted += 1
+            return True
+
+    def _can_start(self, limiter):
+        if limiter.priority == LOW and self._waiting[NORMAL]:
+            return False
+        return limiter.has_room()
+
+    def release(self, route: str, elapsed: float):
+        """Gives the slot back and wakes the waiting requests"""
+        with self._condition:
+            self._limits[route].complete(elapsed, self.target_latency, time.monotonic())
+            self._condition.notify_all()
+
+    def retry_after(self, route: str) -> int:
+        """Returns the seconds a shed client should wait before retrying"""
+        with self._condition:
+            limiter = self._limits[route]
+            return max(1, math.ceil(limiter.latency * limiter.in_flight / max(1, limiter.limit)))
+
+    def stats(self) -> dict:
+        """Returns the state of every route seen so far"""
+        with self._condition:
+            return {route: limiter.stats() for route, limiter in sorted(self._limits.items())}
+
+
+controller = AdmissionController(
+    limit=app.config["ADMISSION_LIMIT"],
+    max_limit=app.config["ADMISSION_MAX_LIMIT"],
+    queue_timeout=app.config["ADMISSION_QUEUE_TIMEOUT"],
+    target_latency=app.config["ADMISSION_TARGET_LATENCY"],
+)
+
+
+######################################################################
+# Request Hooks
+######################################################################
+def queued_for() -> float:
+    """Returns the seconds the request waited in front of the service,
+    from the X-Request-Start header set by the router if there is one"""
+    header = request.headers.get("X-Request-Start", "")
+    try:
+        started = float(header.removeprefix("t="))
+    except ValueError:
+        return 0.0
+    # routers send seconds, milliseconds or microseconds since the epoch
+    while started > 1e11:
+        started /= 1000
+    return max(0.0, time.time() - started)
+
+
+def request_priority():
+    """Returns the priority of the resource method handling the request,
+    or None when the request is not limited"""
+    view = app.view_functions.get(request.endpoint)
+    resource = getattr(view, "view_class", None)
+    if resource is None:  # plain Flask routes like /health and static files
+        return None
+    method = getattr(resource, request.method.lower(), None)
+    return getattr(method, "admission_priority", NORMAL)
+
+
+@app.before_request
+def admit_request():
+    """Admits the request or sheds it with 503 Service Unavailable"""
+    if not app.config["ADMISSION_CONTROL"]:
+        return None
+    priority = request_priority()
+    if priority is None:
+        return None
+    route = f"{request.method} {request.endpoint}"
+    if not controller.acquire(route, priority, waited=queued_for()):
+        retry_after = controller.retry_after(route)
+        app.logger.warning("Shed %s, retry after %ds", route, retry_after)
+        response = jsonify(
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            error="Service Unavailable",
+            message="The service is overloaded, please retry later",
+        )
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        response.headers["Retry-After"] = str(retry_after)
+        return response
+    g.admission = (route, time.monotonic())
+    return None
+
+
+@app.teardown_request
+def release_request(error=None):  # pylint: disable=unused-argument
+    """Gives the slot of an admitted request back"""
+    admission = g.pop("admission", None)
+    if admission:
+        route, started = admission
+        controller.release(route, time.monotonic() - started)
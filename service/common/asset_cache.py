@@ -0,0 +1,263 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Asset Cache
+
+This module builds the static assets and the Swagger specification once
+per process and serves them as precompressed bytes with caching headers
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import threading
+from flask import Response, abort, request
+from service import app, api
+from . import status
+
+try:  # brotli is optional, gzip is always available
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+# Only text assets are worth compressing, images are already compressed
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/javascript",
+    "application/json",
+    "image/svg+xml",
+)
+
+# Rendered documents are cached per host, so bound how many we keep
+MAX_DOCUMENTS = 32
+
+# Matches static/... references in index.html so they can be fingerprinted
+STATIC_REF = re.compile(r"""(["'])(/?static/)([^"'?#]+)\1""")
+
+
+def best_encoding(available) -> str:
+    """Returns the encoding of available with the highest quality the
+    request accepts, the smaller one on a tie, and identity when no other
+    is acceptable"""
+    accepted = request.accept_encodings
+    best, best_quality = "identity", accepted.quality("identity") if "identity" in accepted else 0
+    for encoding in ("gzip", "br"):  # smallest last, it wins the ties
+        quality = accepted.quality(encoding)
+        if encoding in available and quality > 0 and quality >= best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+######################################################################
+# Cached Asset
+######################################################################
+class CachedAsset:
+    """An immutable response body with its precompressed variants"""
+
+    def __init__(self, data: bytes, mimetype: str):
+        self.mimetype = mimetype
+        self.digest = hashlib.sha256(data).hexdigest()[:16]
+        self.variants = {"identity": data}
+        if mimetype.startswith(COMPRESSIBLE_TYPES):
+            level = app.config["ASSET_COMPRESSION_LEVEL"]
+            gzipped = gzip.compress(data, compresslevel=level, mtime=0)
+            if len(gzipped) < len(data):
+                self.variants["gzip"] = gzipped
+            if brotli:
+                brotlied = brotli.compress(data, quality=11)
+                if len(brotlied) < len(data):
+                    self.variants["br"] = brotlied
+
+    def etag(self, encoding: str) -> str:
+        """Returns the strong validator of a variant, each encoding is a
+        different representation and has its own"""
+        return self.digest if encoding == "identity" else f"{self.digest}-{encoding}"
+
+    def select_encoding(self) -> str:
+        """Returns the variant the request accepts best, see best_encoding"""
+        return best_encoding(self.variants)
+
+    def response(self, cache_control: str) -> Response:
+        """Builds a response for the current request"""
+        encoding = self.select_encoding()
+        headers = {
+            "ETag": f'"{self.etag(encoding)}"',
+            "Cache-Control": cache_control,
+            "Vary": "Accept-Encoding",
+        }
+        # the content is the same in every variant, so a cache holding any
+        # of them is up to date; the ETag of the 304 names the selected one
+        if any(request.if_none_match.contains(self.etag(variant)) for variant in self.variants):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(
+            self.variants[encoding],
+            status=status.HTTP_200_OK,
+            mimetype=self.mimetype,
+            headers=headers,
+        )
+
+
+######################################################################
+# Asset Registry
+######################################################################
+class AssetRegistry:
+    """Holds every static file and rendered document in memory"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._static = None
+        self._index = None
+        self._docs = {}
+
+    def clear(self):
+        """Drops everything so that it is rebuilt on the next request"""
+        with self._lock:
+            self._static = None
+            self._index = None
+            self._docs = {}
+
+    @property
+    def static(self) -> dict:
+        """Returns the static files keyed by their path"""
+        if self._static is None:
+            with self._lock:
+                if self._static is None:
+                    self._static = self._load_static()
+        return self._static
+
+    @property
+    def index(self) -> CachedAsset:
+        """Returns index.html with fingerprinted asset urls"""
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = self._render_index()
+        return self._index
+
+    def document(self, key: tuple, builder) -> CachedAsset:
+        """Returns a generated document, building it only the first time"""
+        asset = self._docs.get(key)
+        if asset is None:
+            with self._lock:
+                asset = self._docs.get(key)
+                if asset is None:
+                    asset = builder()
+                    if len(self._docs) >= MAX_DOCUMENTS:
+                        self._docs = {}
+                    self._docs[key] = asset
+        return asset
+
+    def url_for(self, filename: str) -> str:
+        """Returns the content hashed url of a static file"""
+        asset = self.static.get(filename)
+        if not asset:
+            return f"/static/{filename}"
+        return f"/static/{filename}?v={asset.digest}"
+
+    def _load_static(self) -> dict:
+        assets = {}
+        root = app.static_folder
+        for folder, _, files in os.walk(root):
+            for filename in files:
+                path = os.path.join(folder, filename)
+                key = os.path.relpath(path, root).replace(os.sep, "/")
+                if key == "index.html":
+                    continue
+                with open(path, "rb") as asset_file:
+                    data = asset_file.read()
+                mimetype = _guess_mimetype(filename)
+                assets[key] = CachedAsset(data, mimetype)
+        app.logger.info("Cached %d static assets", len(assets))
+        return assets
+
+    def _render_index(self) -> CachedAsset:
+        path = os.path.join(app.static_folder, "index.html")
+        with open(path, "r", encoding="utf-8") as index_file:
+            html = index_file.read()
+
+        def fingerprint(match):
+            quote, _, filename = match.groups()
+            return f"{quote}{self.url_for(filename)}{quote}"
+
+        html = STATIC_REF.sub(fingerprint, html)
+        return CachedAsset(html.encode("utf-8"), "text/html")
+
+
+assets = AssetRegistry()
+
+
+def _guess_mimetype(filename: str) -> str:
+    """Returns the mimetype of a file, defaulting to binary data"""
+    guessed, _ = mimetypes.guess_type(filename)
+    return guessed or "application/octet-stream"
+
+
+######################################################################
+# Views
+######################################################################
+def send_index():
+    """Sends the index page, which must always be revalidated"""
+    return assets.index.response("no-cache")
+
+
+def send_static(filename):
+    """Sends a cached static file
+
+    Requests carrying the current content hash can be cached forever,
+    anything else has to be revalidated with its ETag
+    """
+    asset = assets.static.get(filename)
+    if not asset:
+        abort(status.HTTP_404_NOT_FOUND)
+    if request.args.get("v") == asset.digest:
+        max_age = app.config["ASSET_MAX_AGE"]
+        return asset.response(f"public, max-age={max_age}, immutable")
+    return asset.response("no-cache")
+
+
+def send_specs():
+    """Sends the Swagger specification encoded once per process"""
+
+    schema = api.__schema__
+    if "error" in schema:
+        return schema, status.HTTP_500_INTERNAL_SERVER_ERROR
+
+    def build():
+        return CachedAsset(json.dumps(schema).encode("utf-8"), "application/json")
+
+    return assets.document(("specs", request.host_url), build).response("no-cache")
+
+
+def send_doc():
+    """Sends the Swagger UI page rendered once per host"""
+
+    def build():
+        html = api.render_doc()
+        return CachedAsset(html.encode("utf-8"), "text/html")
+
+    return assets.document(("doc", request.host_url), build).response("no-cache")
+
+
+# Replace the default views with the cached ones
+app.view_functions["static"] = send_static
+app.view_functions["specs"] = send_specs
+app.view_functions["doc"] = send_doc
@@ -1,8 +1,9 @@
 """
 Flask CLI Command Extensions
 """
+import click
 from service import app
-from service.models import db
+from service.models import db, DataValidationError, Wishlist, upgrade_schema
 
 
 ######################################################################
@@ -19,3 +20,48 @@ def db_create():
     db.drop_all()
     db.create_all()
     db.session.commit()
+
+
+######################################################################
+# Command to upgrade the tables of an earlier version in place
+# Usage:
+#   flask db-upgrade
+######################################################################
+@app.cli.command("db-upgrade")
+def db_upgrade():
+    """
+    Adds the columns, indexes and triggers that the tables of a database
+    created by an earlier version are missing, keeping their data
+    """
+    try:
+        with db.engine.begin() as connection:
+            changes = upgrade_schema(connection)
+    except DataValidationError as error:
+        click.echo(f"Nothing was changed: {error}")
+        raise click.exceptions.Exit(1)
+    for change in changes:
+        click.echo(change)
+    click.echo("The database schema is up to date")
+
+
+######################################################################
+# Command to rebuild or verify the denormalized wishlist counters
+# Usage:
+#   flask db-counters [--verify]
+######################################################################
+@app.cli.command("db-counters")
+@click.option("--verify", is_flag=True, help="Only report wrong counters")
+def db_counters(verify):
+    """
+    Recomputes product_count and total_quantity of every wishlist from
+    its products and reinstalls the triggers that maintain them
+    """
+    if verify:
+        mismatches = Wishlist.counter_mismatches()
+        if mismatches:
+            click.echo(f"{len(mismatches)} wishlists have wrong counters: {mismatches}")
+            raise click.exceptions.Exit(1)
+        click.echo("All wishlist counters are correct")
+        return
+    fixed = Wishlist.rebuild_counters()
+    click.echo(f"Rebuilt the counters of {fixed} wishlists")
@@ -0,0 +1,121 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Response Compression
+
+Compresses the responses of the API with the encoding the client accepts
+with the highest quality, brotli only when the package is installed. Small
+bodies and the endpoints in the skip list are sent as they are. Streamed
+responses are compressed chunk by chunk and flushed after every chunk so
+clients keep receiving data as it is produced.
+"""
+import zlib
+from flask import request
+from service import app
+from .asset_cache import COMPRESSIBLE_TYPES, best_encoding
+
+try:  # brotli is optional, gzip is always available
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+# gzip container with the largest window, see zlib.compressobj
+GZIP_WBITS = 31
+
+
+def gzip_compressor(level: int):
+    """Returns (compress, flush, finish) functions of a gzip stream"""
+    stream = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    return (
+        stream.compress,
+        lambda: stream.flush(zlib.Z_SYNC_FLUSH),
+        stream.flush,
+    )
+
+
+def brotli_compressor(quality: int):
+    """Returns (compress, flush, finish) functions of a brotli stream"""
+    stream = brotli.Compressor(quality=quality)
+    return stream.process, stream.flush, stream.finish
+
+
+def select_encoding():
+    """Returns the encoding the current request accepts best, or None to
+    send the body as it is"""
+    encoding = best_encoding(("gzip", "br") if brotli else ("gzip",))
+    return None if encoding == "identity" else encoding
+
+
+def new_compressor(encoding):
+    """Returns the compressor of an encoding at the configured level"""
+    if encoding == "br":
+        return brotli_compressor(app.config["COMPRESSION_BROTLI_QUALITY"])
+    return gzip_compressor(app.config["COMPRESSION_LEVEL"])
+
+
+def compress_stream(chunks, encoding):
+    """Yields the compressed form of a stream of chunks"""
+    compress, flush, finish = new_compressor(encoding)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        data = compress(chunk) + flush()
+        if data:
+            yield data
+    yield finish()
+
+
+def should_compress(response) -> bool:
+    """Tells whether a response is worth compressing"""
+    if not app.config["COMPRESSION_ENABLED"]:
+        return False
+    if request.endpoint in app.config["COMPRESSION_SKIP"]:
+        return False
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return False
+    # already encoded, or negotiated by the asset cache
+    if "Content-Encoding" in response.headers or "Accept-Encoding" in response.vary:
+        return False
+    if not (response.mimetype or "").startswith(COMPRESSIBLE_TYPES):
+        return False
+    if response.is_streamed:
+        return True
+    return response.calculate_content_length() >= app.config["COMPRESSION_MIN_SIZE"]
+
+
+@app.after_request
+def compress_response(response):
+    """Compresses the body of the response when the client accepts it"""
+    if not should_compress(response):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = select_encoding()
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop("Content-Length", None)
+    else:
+        compress, _, finish = new_compressor(encoding)
+        body = response.get_data()
+        response.set_data(compress(body) + finish())
+    response.headers["Content-Encoding"] = encoding
+    if response.headers.get("ETag", "").startswith('"'):
+        # the bytes differ from the identity body, so the tag can only be weak
+        response.headers["ETag"] = "W/" + response.headers["ETag"]
+    return response
@@ -16,31 +16,53 @@
 
 """
 Module: error_handlers
+
+The exceptions of the models are registered with the Api as well as the
+app: flask-restx only hands the errors of its resources on to the handlers
+of the app when it propagates exceptions, under TESTING or DEBUG. The
+handlers return a body that both of them turn into JSON.
 """
-from flask import jsonify
-from service.models import DataValidationError
-from service import app
+from sqlalchemy.exc import IntegrityError
+from service.models import DataValidationError, db
+from service.repository import DataConflictError
+from service import api, app
 from . import status
 
 
 ######################################################################
 # Error Handlers
 ######################################################################
+@api.errorhandler(DataValidationError)
 @app.errorhandler(DataValidationError)
 def request_validation_error(error):
     """Handles Value Errors from bad data"""
     return bad_request(error)
 
 
+@api.errorhandler(IntegrityError)
+@app.errorhandler(IntegrityError)
+def database_integrity_error(error):
+    """Handles writes that break a database constraint"""
+    db.session.rollback()
+    app.logger.warning(str(error.orig))
+    return resource_conflict("The request conflicts with an existing resource")
+
+
+@api.errorhandler(DataConflictError)
+@app.errorhandler(DataConflictError)
+def data_conflict_error(error):
+    """Handles writes that break a rule of a repository outside the database"""
+    app.logger.warning(str(error))
+    return resource_conflict("The request conflicts with an existing resource")
+
+
 @app.errorhandler(status.HTTP_400_BAD_REQUEST)
 def bad_request(error):
     """Handles bad requests with 400_BAD_REQUEST"""
     message = str(error)
     app.logger.warning(message)
     return (
-        jsonify(
-            status=status.HTTP_400_BAD_REQUEST, error="Bad Request", message=message
-        ),
+        {"status": status.HTTP_400_BAD_REQUEST, "error": "Bad Request", "message": message},
         status.HTTP_400_BAD_REQUEST,
     )
 
@@ -71,19 +93,15 @@ def bad_request(error):
 #     )
 
 
-# @app.errorhandler(status.HTTP_409_CONFLICT)
-# def resource_conflict(error):
-#     """Handles resource conflicts with HTTP_409_CONFLICT"""
-#     message = str(error)
-#     app.logger.warning(message)
-#     return (
-#         jsonify(
-#             status=status.HTTP_409_CONFLICT,
-#             error="Conflict",
-#             message=message,
-#         ),
-#         status.HTTP_409_CONFLICT,
-#     )
+@app.errorhandler(status.HTTP_409_CONFLICT)
+def resource_conflict(error):
+    """Handles resource conflicts with HTTP_409_CONFLICT"""
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        {"status": status.HTTP_409_CONFLICT, "error": "Conflict", "message": message},
+        status.HTTP_409_CONFLICT,
+    )
 
 
 # @app.errorhandler(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
@@ -0,0 +1,166 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Job Runner
+
+Runs the jobs stored in the job table on a pool of threads. The database
+is the only coordination needed: every process polls for queued jobs,
+claims them with a conditional UPDATE and keeps their heartbeat fresh, so
+a job whose worker died is picked up again by another one and resumed
+from its last checkpoint.
+"""
+import logging
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from service import app
+from service.models import Job, JobCancelled, JobLost, db
+
+logger = logging.getLogger(__name__)
+
+
+class JobRunner:
+    """Polls the job table and runs the jobs it claims"""
+
+    def __init__(self, app, workers=2, poll_interval=1.0, stale_after=120, max_attempts=3):
+        # pylint: disable=too-many-arguments
+        self.app = app
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+        self.handlers = {}
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._slots = None
+        self._executor = None
+        self._poller = None
+        self._pid = None
+
+    def handler(self, kind):
+        """Registers the function that runs the jobs of a kind"""
+
+        def register(function):
+            self.handlers[kind] = function
+            return function
+
+        return register
+
+    @property
+    def name(self):
+        """Identifies this process in the worker column"""
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def start(self):
+        """Starts polling in this process, threads do not survive a fork
+        so a forked worker calls this again to get its own"""
+        if self.workers <= 0 or (self._pid == os.getpid() and self._poller):
+            return
+        self._pid = os.getpid()
+        self._stop.clear()
+        self._slots = threading.Semaphore(self.workers)
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="job")
+        self._poller = threading.Thread(target=self._poll, name="job-poller", daemon=True)
+        self._poller.start()
+        logger.info("Job runner started with %d workers", self.workers)
+
+    def stop(self):
+        """Stops polling and waits for the running jobs to checkpoint"""
+        if not self._poller:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._poller.join()
+        self._executor.shutdown(wait=True)
+        self._poller = None
+
+    def wake(self):
+        """Tells the poller a job was queued so it does not wait for the next poll"""
+        self._wake.set()
+
+    def run_pending(self):
+        """Runs every claimable job in the calling thread, returns how many ran"""
+        count = 0
+        while True:
+            with self.app.app_context():
+                job = Job.claim(self.name, self.stale_after)
+                job_id = job.id if job else None
+                db.session.remove()
+            if job_id is None:
+                return count
+            self.run(job_id)
+            count += 1
+
+    def _poll(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            while not self._stop.is_set() and self._slots.acquire(blocking=False):
+                try:
+                    with self.app.app_context():
+                        job = Job.claim(self.name, self.stale_after)
+                        job_id = job.id if job else None
+                        db.session.remove()
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception("Could not claim a job")
+                    job_id = None
+                if job_id is None:
+                    self._slots.release()
+                    break
+                self._executor.submit(self._run_and_release, job_id)
+
+    def _run_and_release(self, job_id):
+        try:
+            self.run(job_id)
+        finally:
+            self._slots.release()
+
+    def run(self, job_id):
+        """Runs a claimed job to its end and records the outcome"""
+        with self.app.app_context():
+            job = Job.find(job_id)
+            job.hold()
+            try:
+                try:
+                    handler = self.handlers[job.kind]
+                    if job.attempts > self.max_attempts:
+                        raise RuntimeError(f"gave up after {self.max_attempts} attempts")
+                    job.finish(handler(job))
+                except JobCancelled:
+                    db.session.rollback()
+                    job._end(Job.CANCELLED)  # pylint: disable=protected-access
+                except JobLost:
+                    raise
+                except Exception as error:  # pylint: disable=broad-except
+                    logger.exception("Job %s failed", job_id)
+                    db.session.rollback()
+                    job.fail(error)
+            except JobLost as lost:
+                # the worker that claimed it since records the outcome
+                logger.warning("Stopped: %s", lost)
+            finally:
+                db.session.remove()
+
+
+runner = JobRunner(
+    app,
+    workers=app.config["JOB_WORKERS"],
+    poll_interval=app.config["JOB_POLL_INTERVAL"],
+    stale_after=app.config["JOB_STALE_AFTER"],
+    max_attempts=app.config["JOB_MAX_ATTEMPTS"],
+)
@@ -18,19 +18,194 @@
 Log Handlers
 
 This module contains utility functions to set up logging
-consistently
+consistently. Records are put on a queue by the request threads and
+written out by a listener thread, so a slow stderr or log file never
+holds up a request. The sampling filter keeps a fraction of the info and
+debug records of the loggers it is configured for, and the levels can be
+changed while the service runs.
 """
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import threading
 
+TEXT_FORMAT = "[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S %z"
 
+
+######################################################################
+# Formatting
+######################################################################
+class JsonFormatter(logging.Formatter):
+    """Formats a record as a JSON object on a single line"""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+######################################################################
+# Sampling
+######################################################################
+def parse_rates(setting: str) -> dict:
+    """Parses "logger=rate,logger=rate" into a dictionary"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in setting.split(","))):
+        name, _, rate = item.partition("=")
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps one in every 1/rate info and debug records of a logger
+
+    The rate of a logger is the one of its closest configured ancestor.
+    Every message template is counted on its own, so a rare message is not
+    crowded out by a frequent one, and warnings and errors always pass.
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = dict(rates or {})
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def rate(self, name: str) -> float:
+        """Returns the sampling rate of a logger"""
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition(".")[0]
+        return self.rates.get("", 1.0)
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate(record.name)
+        if rate >= 1:
+            return True
+        if rate <= 0:
+            return False
+        key = (record.name, record.msg)
+        with self._lock:
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+        return count % round(1 / rate) == 0
+
+
+######################################################################
+# Queueing
+######################################################################
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """Queues records for a listener in the same process
+
+    The message is merged with its arguments right away, they may be
+    objects that change or must not be touched from another thread, but
+    the formatting and the writing are left to the listener.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class AsyncLogging:
+    """A queue and the listener thread that drains it into the handlers"""
+
+    def __init__(self, handlers):
+        self.queue = queue.SimpleQueue()
+        self.handlers = handlers
+        self._listener = None
+        self._pid = None
+        atexit.register(self.stop)
+
+    def start(self):
+        """Starts the listener, a forked worker calls this again to get its own"""
+        if self._pid == os.getpid() and self._listener:
+            return
+        self._pid = os.getpid()
+        self._listener = logging.handlers.QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+        self._listener.start()
+
+    def stop(self):
+        """Writes out the queued records and stops the listener"""
+        if self._listener and self._pid == os.getpid():
+            self._listener.stop()
+        self._listener = None
+
+
+sampler = SamplingFilter()
+pipeline = None
+
+
+######################################################################
+# Set up
+######################################################################
 def init_logging(app, logger_name: str):
     """Set up logging for production"""
+    global pipeline  # pylint: disable=global-statement
     app.logger.propagate = False
     gunicorn_logger = logging.getLogger(logger_name)
-    app.logger.handlers = gunicorn_logger.handlers
-    app.logger.setLevel(gunicorn_logger.level)
+    handlers = list(gunicorn_logger.handlers)
     # Make all log formats consistent
-    formatter = logging.Formatter("[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z")
-    for handler in app.logger.handlers:
+    if app.config["LOG_FORMAT"] == "json":
+        formatter = JsonFormatter(datefmt=DATE_FORMAT)
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT, DATE_FORMAT)
+    for handler in handlers:
         handler.setFormatter(formatter)
+    if app.config["LOG_ASYNC"] and handlers:
+        pipeline = AsyncLogging(handlers)
+        pipeline.start()
+        handlers = [LocalQueueHandler(pipeline.queue)]
+    sampler.rates = parse_rates(app.config["LOG_SAMPLING"])
+    for handler in handlers:
+        handler.addFilter(sampler)
+    app.logger.handlers = handlers
+    app.logger.setLevel(app.config["LOG_LEVEL"] or gunicorn_logger.level)
     app.logger.info("Logging handler established")
+
+
+######################################################################
+# Runtime changes
+######################################################################
+def logging_settings(app) -> dict:
+    """Returns the levels of the service loggers and the sampling rates"""
+    names = [app.logger.name] + sorted(
+        name for name in logging.root.manager.loggerDict if name.startswith(app.logger.name + ".")
+    )
+    return {
+        "levels": {name: logging.getLevelName(logging.getLogger(name).getEffectiveLevel()) for name in names},
+        "sampling": dict(sampler.rates),
+    }
+
+
+def change_settings(levels=None, sampling=None):
+    """Sets logger levels and sampling rates, in this process only
+
+    Raises ValueError for an unknown level or a rate outside 0 to 1,
+    before anything is changed.
+    """
+    levels = {name: str(level).upper() for name, level in (levels or {}).items()}
+    for name, level in levels.items():
+        if not isinstance(logging.getLevelName(level), int):
+            raise ValueError(f"Unknown level {level} for logger {name}")
+    sampling = {name: float(rate) for name, rate in (sampling or {}).items()}
+    for name, rate in sampling.items():
+        if not 0 <= rate <= 1:
+            raise ValueError(f"Sampling rate of logger {name} must be between 0 and 1")
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+    sampler.rates.update(sampling)
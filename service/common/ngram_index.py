@@ -0,0 +1,221 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+N-Gram Index
+
+An in-process trigram inverted index used to search product names when
+the database has no trigram support of its own. Trigrams are extracted the
+same way as PostgreSQL's pg_trgm so both backends rank names alike.
+"""
+import heapq
+import math
+import re
+import threading
+from array import array
+from collections import Counter
+from itertools import groupby
+
+WORD = re.compile(r"[^\W_]+")
+
+# Rebuild the postings when more than this share of the entries are stale
+COMPACT_RATIO = 0.5
+
+
+def trigrams(text: str) -> set:
+    """Returns the padded trigrams of every word in text, like pg_trgm"""
+    grams = set()
+    for word in WORD.findall((text or "").lower()):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def inner_trigrams(text: str) -> set:
+    """Returns the unpadded trigrams that any string containing text has"""
+    grams = set()
+    for word in WORD.findall((text or "").lower()):
+        grams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return grams
+
+
+def similarity(first: set, second: set) -> float:
+    """Returns the share of trigrams two names have in common"""
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+class NGramIndex:
+    """Maps trigrams to the distinct names that contain them
+
+    Product names repeat a lot, so postings refer to distinct names and
+    every name keeps the set of ids carrying it. Postings are compact arrays
+    that only ever grow: names that disappear leave stale entries behind,
+    which are skipped and purged once they make up most of the index.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clear()
+        self.built = False
+        self.position = None
+
+    def __len__(self):
+        return len(self._key_name)
+
+    def build(self, rows, position=None):
+        """Replaces the index with the (id, name) pairs in rows
+
+        Args:
+            rows: the (id, name) pairs to index
+            position (list): where the changes of the source of the rows
+                stood when they were read, see apply
+        """
+        with self._lock:
+            self._clear()
+            for key, name in rows:
+                self._add(key, name)
+            self.built = True
+            self.position = position
+
+    def apply(self, names, position):
+        """Takes in the (id, name) pairs changed up to a position of the
+        source, a None name for a deleted id, unless the index is further"""
+        with self._lock:
+            if self.position is not None and position <= self.position:
+                return
+            for key, name in names:
+                self._remove(key)
+                if name is not None:
+                    self._add(key, name)
+            self.position = position
+            self._maybe_compact()
+
+    def add(self, key: int, name: str):
+        """Indexes a new id or the new name of an existing one"""
+        with self._lock:
+            self._remove(key)
+            self._add(key, name)
+            self._maybe_compact()
+
+    def remove(self, key: int):
+        """Forgets an id"""
+        with self._lock:
+            self._remove(key)
+            self._maybe_compact()
+
+    def substring(self, term: str, limit=None) -> list:
+        """Returns the ids whose name contains term ignoring case, smallest first"""
+        needle = term.lower()
+        grams = inner_trigrams(term)
+        with self._lock:
+            if grams:
+                candidates = self._intersect(grams)
+            else:  # too short for trigrams, every name is a candidate
+                candidates = self._names.keys()
+            keys = []
+            for name_id in candidates:
+                name = self._names.get(name_id)
+                if name is not None and needle in name.lower():
+                    keys.extend(self._members[name_id])
+        if limit is None:
+            return sorted(keys)
+        return heapq.nsmallest(limit, keys)
+
+    def fuzzy(self, term: str, threshold: float, limit=None) -> list:
+        """Returns (id, score) pairs of similar names, best first"""
+        wanted = trigrams(term)
+        if not wanted:
+            return []
+        # a similar name shares at least threshold * len(wanted) trigrams
+        least = max(1, math.ceil(threshold * len(wanted)))
+        with self._lock:
+            shared = Counter()
+            for gram in wanted:
+                shared.update(self._postings.get(gram, ()))
+            scored = []
+            for name_id, count in shared.items():
+                name = self._names.get(name_id)
+                if count < least or name is None:
+                    continue
+                score = similarity(wanted, trigrams(name))
+                if score >= threshold:
+                    scored.append((-score, name_id))
+            scored.sort()
+            matches = []
+            # names with the same score are merged so ties are ordered by id
+            for negated, group in groupby(scored, key=lambda item: item[0]):
+                keys = heapq.merge(*(sorted(self._members[name_id]) for _, name_id in group))
+                matches.extend((key, -negated) for key in keys)
+                if limit is not None and len(matches) >= limit:
+                    break
+        return matches[:limit]
+
+    def _clear(self):
+        self._names = {}  # name id -> name
+        self._name_ids = {}  # name -> name id
+        self._members = {}  # name id -> ids carrying the name
+        self._key_name = {}  # id -> name id
+        self._postings = {}  # trigram -> name ids
+        self._next_name_id = 0
+        self._entries = 0
+        self._stale = 0
+
+    def _add(self, key: int, name: str):
+        name = name or ""
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            name_id = self._next_name_id
+            self._next_name_id += 1
+            self._names[name_id] = name
+            self._name_ids[name] = name_id
+            self._members[name_id] = set()
+            for gram in trigrams(name):
+                self._postings.setdefault(gram, array("q")).append(name_id)
+                self._entries += 1
+        self._members[name_id].add(key)
+        self._key_name[key] = name_id
+
+    def _remove(self, key: int):
+        name_id = self._key_name.pop(key, None)
+        if name_id is None:
+            return
+        members = self._members[name_id]
+        members.discard(key)
+        if not members:
+            name = self._names.pop(name_id)
+            del self._name_ids[name]
+            del self._members[name_id]
+            self._stale += len(trigrams(name))
+
+    def _intersect(self, grams: set) -> set:
+        postings = sorted(
+            (self._postings.get(gram, ()) for gram in grams), key=len
+        )
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(posting)
+        return candidates
+
+    def _maybe_compact(self):
+        if self._entries and self._stale / self._entries > COMPACT_RATIO:
+            keys = [(key, self._names[name_id]) for key, name_id in self._key_name.items()]
+            self._clear()
+            for key, name in keys:
+                self._add(key, name)
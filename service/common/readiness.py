@@ -0,0 +1,200 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Readiness
+
+Tells whether this process should be sent traffic. /health only shows that
+the process answers; being ready also takes a database that answers, a
+connection pool with room to spare and caches that are warm, or that have
+had max_warmup seconds to get there. The database
+is pinged at most once per interval however often the probe comes, and a
+probe never waits for the ping of another one, so probing every second
+costs next to nothing.
+"""
+import logging
+import os
+import threading
+import time
+from sqlalchemy import select, text
+from sqlalchemy.exc import SQLAlchemyError
+from service import app
+from service.common.asset_cache import assets
+from service.models import Product, db
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+DONE = "done"
+
+
+class ReadinessProbe:
+    """Caches a database ping and tracks the warm up of the caches"""
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self, app, interval=5.0, max_checked_out=0.9, max_pool_wait=0.25, max_warmup=5.0
+    ):
+        self.app = app
+        self.interval = interval
+        self.max_checked_out = max_checked_out
+        self.max_pool_wait = max_pool_wait
+        self.max_warmup = max_warmup
+        self.warmups = {}
+        self.warm = {}
+        self._warm_began = None
+        self._ping = None
+        self._lock = threading.Lock()
+        self._warmer = None
+        self._pid = None
+
+    def warmup(self, name):
+        """Registers a function that fills a cache before traffic comes, it
+        may return a status to report instead of done"""
+
+        def register(function):
+            self.warmups[name] = function
+            return function
+
+        return register
+
+    def start_warmup(self):
+        """Warms the caches on a thread, a forked worker calls this again to
+        finish what the thread of its parent did not"""
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._warm_began = time.monotonic()
+        for name in self.warmups:
+            if self.warm.get(name) != DONE:
+                self.warm[name] = PENDING
+        self._warmer = threading.Thread(target=self._warm_up, name="warmup", daemon=True)
+        self._warmer.start()
+
+    def join(self, timeout=None):
+        """Waits for the warm up to end"""
+        if self._warmer:
+            self._warmer.join(timeout)
+
+    def _warm_up(self):
+        for name, function in self.warmups.items():
+            if self.warm.get(name) != PENDING:
+                continue
+            began = time.monotonic()
+            try:
+                with self.app.app_context():
+                    try:
+                        result = function()
+                    finally:
+                        db.session.remove()
+                self.warm[name] = result if isinstance(result, str) else DONE
+                logger.info("Warmed up %s in %.2fs", name, time.monotonic() - began)
+            except Exception as error:  # pylint: disable=broad-except
+                # the cache still fills on first use, do not hold traffic back
+                logger.exception("Could not warm up %s", name)
+                self.warm[name] = f"failed: {error}"
+
+    def pool(self):
+        """Returns the connections checked out of the pool and its capacity"""
+        pool = db.engine.pool
+        if not hasattr(pool, "checkedout"):
+            return {"checked_out": None, "capacity": None}
+        overflow = pool._max_overflow  # pylint: disable=protected-access
+        return {
+            "checked_out": pool.checkedout(),
+            "capacity": pool.size() + overflow if overflow >= 0 else None,
+        }
+
+    def ping(self):
+        """Returns the last ping of the database, running a new one when it
+        is older than the interval and no other probe is running one"""
+        last = self._ping
+        if last and time.monotonic() - last["at"] < self.interval:
+            return last
+        if not self._lock.acquire(blocking=False):
+            return last or {"ok": False, "error": "first ping still running"}
+        try:
+            began = time.monotonic()
+            try:
+                with db.engine.connect() as connection:
+                    connected = time.monotonic()
+                    connection.execute(text("SELECT 1"))
+                result = {
+                    "ok": True,
+                    "pool_wait": round(connected - began, 4),
+                    "latency": round(time.monotonic() - connected, 4),
+                }
+            except SQLAlchemyError as error:
+                logger.warning("Database ping failed: %s", error)
+                result = {"ok": False, "error": str(getattr(error, "orig", None) or error)}
+            result["at"] = time.monotonic()
+            self._ping = result
+            return result
+        finally:
+            self._lock.release()
+
+    def check(self):
+        """Returns whether this process is ready and the details of why"""
+        reasons = []
+        pool = self.pool()
+        if pool["capacity"] and pool["checked_out"] >= pool["capacity"] * self.max_checked_out:
+            # a ping would only queue behind the requests for a connection
+            reasons.append("connection pool saturated")
+            ping = self._ping or {"ok": False}
+        else:
+            ping = self.ping()
+            if not ping["ok"]:
+                reasons.append("database unavailable")
+            elif ping["pool_wait"] > self.max_pool_wait:
+                reasons.append("connection pool wait too long")
+        if PENDING in self.warm.values() and time.monotonic() - self._warm_began < self.max_warmup:
+            # past that the caches fill behind the traffic, or on first use
+            reasons.append("caches warming up")
+        database = {key: value for key, value in ping.items() if key != "at"}
+        if "at" in ping:
+            database["age"] = round(time.monotonic() - ping["at"], 1)
+        return not reasons, {
+            "status": "NOT READY" if reasons else "READY",
+            "reasons": reasons,
+            "database": database,
+            "pool": pool,
+            "warmup": dict(self.warm),
+        }
+
+
+probe = ReadinessProbe(
+    app,
+    interval=app.config["READY_DB_INTERVAL"],
+    max_checked_out=app.config["READY_MAX_CHECKED_OUT"],
+    max_pool_wait=app.config["READY_MAX_POOL_WAIT"],
+    max_warmup=app.config["READY_MAX_WARMUP"],
+)
+
+
+@probe.warmup("static assets")
+def warm_assets():
+    """Loads and compresses the static files and the index page"""
+    assets.index  # pylint: disable=pointless-statement
+
+
+@probe.warmup("product name index")
+def warm_product_names():
+    """Builds the in-process index of product names, unless pg_trgm serves
+    search or there are more than READY_WARM_MAX_PRODUCTS products"""
+    most = app.config["READY_WARM_MAX_PRODUCTS"]
+    if db.session.execute(select(Product.id).offset(most).limit(1)).first() is not None:
+        return f"skipped: more than {most} products"
+    Product.build_search_index()
+    return None
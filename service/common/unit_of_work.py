@@ -0,0 +1,62 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Unit of Work
+
+Makes every request one transaction. The model methods only flush while a
+request is handled, and the changes are committed once after the view
+returns a successful response, or rolled back when it fails or raises.
+"""
+from service import app
+from service.models import db
+
+
+def in_unit_of_work() -> bool:
+    """Tells whether the current session defers its commit to the request"""
+    return bool(db.session.info.get("unit_of_work"))
+
+
+@app.before_request
+def begin_unit_of_work():
+    """Tells the model methods to flush instead of committing"""
+    if app.config["UNIT_OF_WORK"]:
+        db.session.info["unit_of_work"] = True
+
+
+@app.after_request
+def end_unit_of_work(response):
+    """Commits the request when it succeeded and rolls it back otherwise"""
+    if not in_unit_of_work():
+        return response
+    db.session.info.pop("unit_of_work")
+    if response.status_code >= 400:
+        db.session.rollback()
+        return response
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return response
+
+
+@app.teardown_request
+def discard_unit_of_work(error=None):  # pylint: disable=unused-argument
+    """Rolls back a request that raised before its response was made"""
+    if in_unit_of_work():
+        db.session.info.pop("unit_of_work")
+        db.session.rollback()
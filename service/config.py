@@ -12,8 +12,88 @@ DATABASE_URI = os.getenv(
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Server-side prepared statements: psycopg prepares a query once a connection
+# has run it DB_PREPARE_THRESHOLD times. PgBouncer in transaction mode hands
+# every transaction another server connection that does not know them, so
+# PGBOUNCER=true turns them off
+DB_PREPARE_THRESHOLD = int(os.getenv("DB_PREPARE_THRESHOLD", "2"))
+PGBOUNCER = os.getenv("PGBOUNCER", "false").lower() in ("1", "true", "yes", "on")
+SQLALCHEMY_ENGINE_OPTIONS = {}
+if DATABASE_URI.startswith("postgresql+psycopg:"):
+    SQLALCHEMY_ENGINE_OPTIONS["connect_args"] = {
+        "prepare_threshold": None if PGBOUNCER else DB_PREPARE_THRESHOLD,
+    }
+
+# Where the wishlists and products are kept: sql in the tables of the models,
+# document in one JSON document per wishlist with its products embedded,
+# memory in the process only, for tests, benchmarks and throwaway instances.
+# Jobs are always kept in the database
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sql").lower()
+
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "s3cr3t-key-shhhh")
 
 # API key
 API_KEY = os.getenv("API_KEY")
+
+# Static assets and the Swagger spec are cached in memory and compressed once
+ASSET_MAX_AGE = int(os.getenv("ASSET_MAX_AGE", "31536000"))
+ASSET_COMPRESSION_LEVEL = int(os.getenv("ASSET_COMPRESSION_LEVEL", "9"))
+
+# Least similarity (0 to 1) of a fuzzy product name match
+SEARCH_SIMILARITY = float(os.getenv("SEARCH_SIMILARITY", "0.3"))
+
+# Admission control: starting and largest concurrency limit per route, how
+# long a request may queue (seconds) and the latency the limits aim for
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "true").lower() in ("1", "true", "yes", "on")
+ADMISSION_LIMIT = int(os.getenv("ADMISSION_LIMIT", "4"))
+ADMISSION_MAX_LIMIT = int(os.getenv("ADMISSION_MAX_LIMIT", "32"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "0.5"))
+ADMISSION_TARGET_LATENCY = float(os.getenv("ADMISSION_TARGET_LATENCY", "0.25"))
+
+# Compression of API responses: gzip level (1-9), brotli quality (0-11) when
+# brotli is installed, smallest body worth compressing in bytes and the
+# endpoints that are never compressed
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() in ("1", "true", "yes", "on")
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL", "4"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_SKIP = os.getenv("COMPRESSION_SKIP", "health,ready").split(",")
+
+# Streamed listings: the bytes of JSON encoded before they are sent as a chunk
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", "65536"))
+
+# Background jobs: worker threads per process (0 disables the runner), the
+# seconds between polls of the job table, how long a running job may go
+# without a heartbeat before another worker resumes it, how often a job is
+# tried, and the product count above which a copy runs in the background
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+JOB_STALE_AFTER = int(os.getenv("JOB_STALE_AFTER", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+COPY_ASYNC_THRESHOLD = int(os.getenv("COPY_ASYNC_THRESHOLD", "1000"))
+
+# Commit once at the end of each API request instead of in every model call
+UNIT_OF_WORK = os.getenv("UNIT_OF_WORK", "true").lower() in ("1", "true", "yes", "on")
+
+# Logging: text or json lines, the level of the service loggers (empty
+# follows gunicorn), whether records are written by a listener thread
+# instead of the request thread, and the share of info and debug records
+# kept per logger, like service.models=0.1 (empty keeps them all)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "").upper()
+LOG_ASYNC = os.getenv("LOG_ASYNC", "true").lower() in ("1", "true", "yes", "on")
+LOG_SAMPLING = os.getenv("LOG_SAMPLING", "")
+
+# Readiness: seconds between database pings whatever the probe rate, the
+# share of the pool capacity checked out and the seconds waited for a
+# connection above which the process reports not ready
+READY_DB_INTERVAL = float(os.getenv("READY_DB_INTERVAL", "5"))
+READY_MAX_CHECKED_OUT = float(os.getenv("READY_MAX_CHECKED_OUT", "0.9"))
+READY_MAX_POOL_WAIT = float(os.getenv("READY_MAX_POOL_WAIT", "0.25"))
+
+# Seconds the warm up may hold readiness back before it goes on behind the
+# traffic, and the most products the name index is built from at startup,
+# a larger table builds it on the first search
+READY_MAX_WARMUP = float(os.getenv("READY_MAX_WARMUP", "5"))
+READY_WARM_MAX_PRODUCTS = int(os.getenv("READY_WARM_MAX_PRODUCTS", "100000"))
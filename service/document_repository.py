@@ -0,0 +1,524 @@
+"""
+Document Repository
+
+Keeps each Wishlist as one JSON document with its Products embedded, in the
+wishlist_document table: JSONB on PostgreSQL and JSON on SQLite. Reading a
+Wishlist costs one row however many Products it holds, and a change to a
+Wishlist or to one of its Products rewrites its document.
+
+Listings filter and sort on the members of DOCUMENT_FIELDS, which have
+expression indexes. On PostgreSQL a GIN index of the embedded products finds
+a Product by id, and a pg_trgm index of their names serves the substring
+search, and narrows the fuzzy one, when the extension is there. SQLite scans
+the documents for all of them.
+
+A write reads its document FOR UPDATE, so concurrent changes to a Wishlist
+wait for each other instead of losing one another. The writes join the
+transaction of the request like the writes of the models do.
+"""
+from datetime import date, datetime
+from sqlalchemy import Integer, String, delete, func, insert, inspect, literal, literal_column, select, text, update
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm.attributes import set_committed_value
+from service.common.ngram_index import similarity, trigrams
+from service.models import (
+    DOCUMENT_FIELDS,
+    LIKE_SPECIAL,
+    ROW_CHUNK,
+    DataValidationError,
+    DocumentCounter,
+    Product,
+    ProductRow,
+    Wishlist,
+    WishlistDocument,
+    WishlistRow,
+    db,
+    dialect_insert,
+    document_product_ids,
+    keyset_condition,
+    prefix_condition,
+    save_changes,
+    trigram_search_enabled,
+    utcnow,
+)
+from service.repository import WISHLIST_COLUMNS, DataConflictError, Repository, as_key, changes, commit, load, page
+
+# pylint: disable=not-callable, too-many-arguments, too-many-public-methods
+
+documents = WishlistDocument.__table__
+
+
+def field(name: str):
+    """Returns the expression of a document member, written as its index has it"""
+    return literal_column(
+        DOCUMENT_FIELDS[db.engine.dialect.name][name], Integer if name == "product_count" else String
+    )
+
+
+def holding(product_id):
+    """Matches the documents embedding the Product with an id"""
+    if db.engine.dialect.name == "postgresql":
+        return literal_column("(body -> 'products')", postgresql.JSONB()).contains([{"id": product_id}])
+    return text(
+        "EXISTS (SELECT 1 FROM json_each(body, '$.products') WHERE json_extract(value, '$.id') = :product_id)"
+    ).bindparams(product_id=product_id)
+
+
+def criteria_conditions(criteria: dict) -> list:
+    """Returns the conditions on the documents of the criteria of a listing"""
+    start, end = criteria.get("start"), criteria.get("end")
+    if start and end and start > end:
+        raise DataValidationError(
+            "Invalid Date: start date should be smaller than end date"
+        )
+    conditions = []
+    if criteria.get("ids") is not None:
+        conditions.append(documents.c.id.in_(criteria["ids"]))
+    for column in ("owner", "name"):
+        if criteria.get(column):
+            conditions.append(field(column) == criteria[column])
+    if criteria.get("name_prefix"):
+        conditions.append(prefix_condition(field("name"), criteria["name_prefix"]))
+    if start:
+        conditions.append(field("date_joined") >= start.isoformat())
+    if end:
+        conditions.append(field("date_joined") <= end.isoformat())
+    if criteria.get("min_items") is not None:
+        conditions.append(field("product_count") >= criteria["min_items"])
+    if criteria.get("max_items") is not None:
+        conditions.append(field("product_count") <= criteria["max_items"])
+    return conditions
+
+
+def product_row(record):
+    """Returns the read-only ProductRow of a Product record"""
+    return ProductRow(*[record[column.key] for column in ProductRow.columns()])
+
+
+def committed_value(instance, column):
+    """Returns the value of a column as it was loaded, before any change"""
+    history = inspect(instance).attrs[column].history
+    return history.deleted[0] if history.deleted else getattr(instance, column)
+
+
+######################################################################
+#  D O C U M E N T
+######################################################################
+class Document:
+    """The records of a Wishlist and of its Products, read from a document"""
+
+    def __init__(self, record: dict, products: dict):
+        self.record = record
+        self.products = products  # id -> record, in the order of the document
+
+    @classmethod
+    def from_body(cls, key, body):
+        """Returns the Document of a stored body"""
+        record = {
+            "id": key,
+            "name": body["name"],
+            "owner": body["owner"],
+            "date_joined": date.fromisoformat(body["date_joined"]),
+            "updated_at": datetime.fromisoformat(body["updated_at"]),
+        }
+        products = {
+            item["id"]: {
+                "id": item["id"],
+                "wishlist_id": key,
+                "name": item["name"],
+                "quantity": item["quantity"],
+                "updated_at": datetime.fromisoformat(item["updated_at"]),
+            }
+            for item in body["products"]
+        }
+        return cls(record, products)
+
+    def body(self) -> dict:
+        """Returns the JSON document of the records"""
+        return {
+            "name": self.record["name"],
+            "owner": self.record["owner"],
+            "date_joined": self.record["date_joined"].isoformat(),
+            "updated_at": self.record["updated_at"].isoformat(),
+            "products": [
+                {
+                    "id": product["id"],
+                    "name": product["name"],
+                    "quantity": product["quantity"],
+                    "updated_at": product["updated_at"].isoformat(),
+                }
+                for product in self.products.values()
+            ],
+        }
+
+    def figures(self) -> dict:
+        """Returns the Wishlist record with the counters the triggers keep in the tables"""
+        return dict(
+            self.record,
+            product_count=len(self.products),
+            total_quantity=sum(product["quantity"] or 0 for product in self.products.values()),
+        )
+
+    def wishlist(self):
+        """Returns a new Wishlist instance with its Products"""
+        wishlist = load(Wishlist, self.figures())
+        set_committed_value(wishlist, "products", [load(Product, record) for record in self.products.values()])
+        return wishlist
+
+    def row(self):
+        """Returns a read-only WishlistRow with its ProductRows"""
+        figures = self.figures()
+        return WishlistRow(
+            *[figures[column.key] for column in WishlistRow.columns()],
+            [product_row(record) for record in self.products.values()],
+        )
+
+    def attach(self, wishlist, products):
+        """Records the stored values as the committed state of a Wishlist
+        holding Products whose own state is already recorded"""
+        commit(wishlist, self.figures())
+        set_committed_value(wishlist, "products", list(products))
+
+    def add(self, name, quantity, key, now) -> dict:
+        """Embeds a new Product under an id and returns its record"""
+        record = {"id": key, "wishlist_id": self.record["id"], "name": name, "quantity": quantity, "updated_at": now}
+        self.products[key] = record
+        return record
+
+    def named(self, name):
+        """Returns the record of the Product with a name, None if there is none"""
+        return next((record for record in self.products.values() if record["name"] == name), None)
+
+    def check_names(self):
+        """Raises DataConflictError when two Products have the same name"""
+        names = [record["name"] for record in self.products.values() if record["name"] is not None]
+        if len(names) != len(set(names)):
+            raise DataConflictError(f"Wishlist {self.record['id']} would have two Products with the same name")
+
+
+######################################################################
+#  D O C U M E N T   R E P O S I T O R Y
+######################################################################
+class DocumentRepository(Repository):
+    """Keeps each Wishlist and its Products in one JSON document"""
+
+    def clear(self):
+        db.session.execute(delete(documents))
+        db.session.commit()
+
+    # ------------------------------------------------------------------
+    # W I S H L I S T S
+    # ------------------------------------------------------------------
+    def find_wishlist(self, wishlist_id):
+        document = self._get(as_key(wishlist_id))
+        return document.wishlist() if document else None
+
+    def list_wishlists(self, criteria: dict, sort=None, after=None, limit=None) -> list:
+        return [document.wishlist() for document in self._listing(criteria, sort, after, limit)]
+
+    def read_wishlists(self, criteria: dict, sort=None, after=None, limit=None) -> list:
+        return [document.row() for document in self._listing(criteria, sort, after, limit)]
+
+    def stream_wishlists(self, criteria: dict, sort=None):
+        statement = self._listing_statement(criteria, sort, None)
+        for row in db.session.execute(statement, execution_options={"yield_per": ROW_CHUNK}):
+            yield Document.from_body(row.id, row.body).row()
+
+    def _listing(self, criteria: dict, sort, after, limit) -> list:
+        return self._read(self._listing_statement(criteria, sort, after).limit(limit))
+
+    def _listing_statement(self, criteria: dict, sort, after):
+        columns = Wishlist.sort_columns(Wishlist.listing_sort(criteria, sort))
+        fields = [(documents.c.id if column.key == "id" else field(column.key), descending) for column, descending in columns]
+        statement = self._select(*criteria_conditions(criteria))
+        if after is not None:
+            values = Wishlist.cursor_values(columns, after)
+            values = [value.isoformat() if isinstance(value, date) else value for value in values]
+            statement = statement.where(keyset_condition(fields, values))
+        return statement.order_by(*[column.desc() if descending else column.asc() for column, descending in fields])
+
+    def count_wishlists(self, criteria: dict, estimated=False) -> int:
+        return db.session.execute(
+            select(func.count()).select_from(documents).where(*criteria_conditions(criteria))
+        ).scalar_one()
+
+    def find_by_owner(self, owner) -> list:
+        return [document.wishlist() for document in self._read(self._select(field("owner") == owner))]
+
+    def find_by_name(self, name) -> list:
+        return [document.wishlist() for document in self._read(self._select(field("name") == name))]
+
+    def filter_by_date(self, start=None, end=None) -> list:
+        return self.list_wishlists({"start": start, "end": end})
+
+    def create_wishlist(self, wishlist):
+        if wishlist.date_joined is None:
+            raise DataValidationError("Invalid Wishlist: missing date_joined")
+        now = utcnow()
+        record = {column: getattr(wishlist, column) for column in WISHLIST_COLUMNS}
+        record.update(id=None, updated_at=now)
+        document = Document(record, {})
+        products = list(wishlist.products)
+        added = [
+            (product, document.add(product.name, product.quantity, key, now))
+            for product, key in zip(products, self._product_ids(len(products)))
+        ]
+        document.check_names()
+        record["id"] = db.session.execute(
+            insert(documents).values(body=document.body()).returning(documents.c.id)
+        ).scalar_one()
+        save_changes()
+        for product, values in added:
+            values["wishlist_id"] = record["id"]
+            commit(product, values)
+        document.attach(wishlist, products)
+
+    def create_wishlists(self, wishlists):
+        for wishlist in wishlists:
+            self.create_wishlist(wishlist)
+
+    def update_wishlist(self, wishlist):
+        if not wishlist.id:
+            raise DataValidationError("Update called with empty ID field")
+        document = self._get(wishlist.id, lock=True)
+        if document is None:
+            raise DataConflictError(f"Wishlist {wishlist.id} not exist")
+        now = utcnow()
+        for product in inspect(wishlist).attrs.products.history.deleted:
+            document.products.pop(product.id, None)
+        document.record.update(changes(wishlist, WISHLIST_COLUMNS))
+        added = [product for product in wishlist.products if product.id is None]
+        for product in wishlist.products:
+            if product.id in document.products:
+                self._write_product(document, product, now)
+        for product, key in zip(added, self._product_ids(len(added))):
+            commit(product, document.add(product.name, product.quantity, key, now))
+        self._save(document)
+        document.attach(wishlist, [product for product in wishlist.products if product.id in document.products])
+
+    def delete_wishlist(self, wishlist):
+        db.session.execute(delete(documents).where(documents.c.id == wishlist.id))
+        save_changes()
+
+    def delete_wishlists(self, criteria: dict) -> int:
+        result = db.session.execute(delete(documents).where(*criteria_conditions(criteria)))
+        save_changes()
+        return result.rowcount
+
+    def summarize_wishlist(self, wishlist_id):
+        document = self._get(as_key(wishlist_id))
+        if document is None:
+            return None
+        return {
+            "id": document.record["id"],
+            "name": document.record["name"],
+            "owner": document.record["owner"],
+            **self._figures([document]),
+        }
+
+    def summarize_owner(self, owner) -> dict:
+        found = self._read(self._select(field("owner") == owner))
+        return {"owner": owner, "wishlist_count": len(found), **self._figures(found)}
+
+    @staticmethod
+    def _figures(found) -> dict:
+        products = [product for document in found for product in document.products.values()]
+        updates = [row["updated_at"] for row in [document.record for document in found] + products]
+        return {
+            "product_count": len(products),
+            "total_quantity": sum(product["quantity"] or 0 for product in products),
+            "distinct_product_names": len({product["name"] for product in products} - {None}),
+            "last_modified": max(updates) if updates else None,
+        }
+
+    # ------------------------------------------------------------------
+    # P R O D U C T S
+    # ------------------------------------------------------------------
+    def find_product(self, product_id):
+        key = as_key(product_id)
+        if key is None:
+            return None
+        found = self._read(self._select(holding(key)))
+        return load(Product, found[0].products[key]) if found else None
+
+    def find_product_in_wishlist(self, wishlist_id, product_id) -> tuple:
+        document = self._get(as_key(wishlist_id))
+        if document is None:
+            return False, None
+        record = document.products.get(as_key(product_id))
+        return True, load(Product, record) if record else None
+
+    def list_products(self, wishlist_id, name=None, sort=None, after=None, limit=None) -> list:
+        records = self._product_page(wishlist_id, name, sort, after, limit)
+        return [load(Product, record) for record in records]
+
+    def read_products(self, wishlist_id, name=None, sort=None, after=None, limit=None) -> list:
+        return [product_row(record) for record in self._product_page(wishlist_id, name, sort, after, limit)]
+
+    def _product_page(self, wishlist_id, name, sort, after, limit) -> list:
+        document = self._get(as_key(wishlist_id))
+        if document is None:
+            return []
+        records = [record for record in document.products.values() if not name or record["name"] == name]
+        return page(Product, records, sort, after, limit)
+
+    def create_product(self, product):
+        self.create_products([product])
+
+    def create_products(self, products):
+        now = utcnow()
+        for wishlist_id in dict.fromkeys(product.wishlist_id for product in products):
+            document = self._get(wishlist_id, lock=True)
+            if document is None:
+                raise DataConflictError(f"Wishlist {wishlist_id} not exist")
+            added = [product for product in products if product.wishlist_id == wishlist_id]
+            records = [
+                document.add(product.name, product.quantity, key, now)
+                for product, key in zip(added, self._product_ids(len(added)))
+            ]
+            self._save(document)
+            for product, record in zip(added, records):
+                commit(product, record)
+
+    def update_product(self, product):
+        if not product.id:
+            raise DataValidationError("Update called with empty ID field")
+        source = committed_value(product, "wishlist_id")
+        document = self._get(source, lock=True)
+        if document is None or product.id not in document.products:
+            raise DataConflictError(f"Product {product.id} not exist")
+        if product.wishlist_id == source:
+            self._write_product(document, product, utcnow())
+            self._save(document)
+            return
+        target = self._get(product.wishlist_id, lock=True)
+        if target is None:
+            raise DataConflictError(f"Wishlist {product.wishlist_id} not exist")
+        del document.products[product.id]
+        self._save(document)
+        commit(product, target.add(product.name, product.quantity, product.id, utcnow()))
+        self._save(target)
+
+    def delete_product(self, product):
+        document = self._get(product.wishlist_id, lock=True)
+        if document is not None and document.products.pop(product.id, None):
+            self._save(document)
+
+    def upsert_product(self, wishlist_id, name, quantity):
+        document = self._get(wishlist_id, lock=True)
+        if document is None:
+            return None
+        now = utcnow()
+        record = document.named(name)
+        if record is None:
+            record = document.add(name, quantity, self._product_ids(1)[0], now)
+        else:
+            old = record["quantity"]
+            record.update(quantity=None if old is None else old + quantity, updated_at=now)
+        self._save(document)
+        return self._returned(record)
+
+    def adjust_quantity(self, wishlist_id, product_id, delta):
+        document = self._get(wishlist_id, lock=True)
+        record = document.products.get(product_id) if document else None
+        if record is None or record["quantity"] is None or record["quantity"] + delta < 0:
+            return None
+        record.update(quantity=record["quantity"] + delta, updated_at=utcnow())
+        self._save(document)
+        return self._returned(record)
+
+    def search_products(self, term, fuzzy=False, limit=20, offset=0, threshold=0.3) -> list:
+        statement = self._select()
+        if fuzzy and trigram_search_enabled():
+            # a name at least threshold similar to the term makes the word
+            # similarity of the term in the list at least as high, so the
+            # trigram index of the names finds every document to score
+            db.session.execute(
+                text("SELECT set_config('pg_trgm.word_similarity_threshold', :value, true)"),
+                {"value": str(threshold)},
+            )
+            statement = statement.where(literal(term.lower()).op("<%")(field("product_names")))
+        # the names are matched in the JSON text of the list, where quotes
+        # and backslashes are escaped, so such terms check every document
+        if not fuzzy and term.isprintable() and not {'"', "\\"} & set(term):
+            pattern = "%" + LIKE_SPECIAL.sub(r"\\\1", term.lower()) + "%"
+            statement = statement.where(field("product_names").like(pattern, escape="\\"))
+        wanted = trigrams(term)
+        matches = []
+        for document in self._read(statement):
+            for record in document.products.values():
+                name = record["name"] or ""
+                if fuzzy:
+                    score = similarity(wanted, trigrams(name))
+                    if score >= threshold:
+                        matches.append(((-score, record["id"]), score, record, document))
+                elif term.lower() in name.lower():
+                    matches.append(((record["id"],), None, record, document))
+        matches.sort(key=lambda match: match[0])
+        return [
+            Product._search_result(  # pylint: disable=protected-access
+                load(Product, record), document.record["name"], document.record["owner"], score
+            )
+            for _, score, record, document in matches[offset:offset + limit]
+        ]
+
+    # ------------------------------------------------------------------
+    # D O C U M E N T S
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _select(*conditions):
+        return select(documents.c.id, documents.c.body).where(*conditions)
+
+    @staticmethod
+    def _read(statement) -> list:
+        return [Document.from_body(row.id, row.body) for row in db.session.execute(statement)]
+
+    def _get(self, key, lock=False):
+        """Returns the Document of a Wishlist, None if there is none
+
+        A locked Document stays locked until the end of the transaction
+        """
+        if key is None:
+            return None
+        statement = self._select(documents.c.id == key)
+        found = self._read(statement.with_for_update() if lock else statement)
+        return found[0] if found else None
+
+    @staticmethod
+    def _save(document):
+        """Writes back a changed Document"""
+        document.check_names()
+        document.record["updated_at"] = utcnow()
+        db.session.execute(
+            update(documents).where(documents.c.id == document.record["id"]).values(body=document.body())
+        )
+        save_changes()
+
+    @staticmethod
+    def _write_product(document, product, now):
+        """Copies the changed columns of an embedded Product into its record"""
+        record = document.products[product.id]
+        changed = changes(product, ("name", "quantity"))
+        if changed:
+            record.update(changed, updated_at=now)
+        commit(product, record)
+
+    @staticmethod
+    def _product_ids(count) -> list:
+        """Hands out the ids of new embedded Products"""
+        if not count:
+            return []
+        if db.engine.dialect.name == "postgresql":
+            return db.session.scalars(
+                select(document_product_ids.next_value()).select_from(func.generate_series(1, count))
+            ).all()
+        statement = dialect_insert()(DocumentCounter).values(name="product", value=count)
+        statement = statement.on_conflict_do_update(
+            index_elements=["name"], set_={"value": DocumentCounter.value + statement.excluded.value}
+        ).returning(DocumentCounter.value)
+        last = db.session.execute(statement).scalar_one()
+        return list(range(last - count + 1, last + 1))
+
+    @staticmethod
+    def _returned(record) -> dict:
+        return {column: record[column] for column in ("id", "wishlist_id", "name", "quantity")}
@@ -0,0 +1,66 @@
+"""
+Background Jobs
+
+The long operations that run on the job runner. Each one saves a checkpoint
+together with the rows it wrote since the previous one, so a job picked up
+again after its worker died carries on where the last commit left it.
+"""
+from datetime import date
+from service.common.job_runner import runner
+from service.models import Product, Wishlist, DataValidationError, unit_of_work
+from service.repository import repository
+
+# Rows written between two checkpoints
+JOB_BATCH_SIZE = 500
+
+
+@runner.handler("copy_wishlist")
+def copy_wishlist(job):
+    """Copies a Wishlist and its Products, in batches ordered by product id"""
+    # in a unit of work the writes only flush, the checkpoint commits them
+    with unit_of_work():
+        checkpoint = dict(job.checkpoint)
+        if "new_id" not in checkpoint:
+            source = repository.find_wishlist(job.params["wishlist_id"])
+            if not source:
+                raise DataValidationError(f"Wishlist {job.params['wishlist_id']} not exist")
+            copy = Wishlist(  # pylint: disable=unexpected-keyword-arg
+                name=source.name + " COPY",
+                owner=source.owner,
+                date_joined=date.today(),
+            )
+            repository.create_wishlist(copy)
+            checkpoint = {"new_id": copy.id, "last_product_id": 0}
+            job.save_progress(0, checkpoint, total=source.product_count)
+
+        done = job.progress
+        while True:
+            batch = repository.list_products(
+                job.params["wishlist_id"], after=[checkpoint["last_product_id"]], limit=JOB_BATCH_SIZE
+            )
+            if not batch:
+                return {"wishlist_id": checkpoint["new_id"], "products": done}
+            new_id, last_id = checkpoint["new_id"], batch[-1].id
+            repository.create_products([
+                Product(  # pylint: disable=unexpected-keyword-arg
+                    wishlist_id=new_id, name=product.name, quantity=product.quantity
+                )
+                for product in batch
+            ])
+            done += len(batch)
+            checkpoint = {"new_id": new_id, "last_product_id": last_id}
+            job.save_progress(done, checkpoint)
+
+
+@runner.handler("import_wishlists")
+def import_wishlists(job):
+    """Creates the Wishlists of an import, in batches in the order given"""
+    items = job.params["wishlists"]
+    with unit_of_work():
+        done = job.checkpoint.get("done", 0)
+        while done < len(items):
+            batch = items[done:done + JOB_BATCH_SIZE]
+            repository.create_wishlists([Wishlist().deserialize(data) for data in batch])
+            done = min(done + JOB_BATCH_SIZE, len(items))
+            job.save_progress(done, {"done": done})
+        return {"imported": done}
@@ -0,0 +1,485 @@
+"""
+In-Memory Repository
+
+Keeps the Wishlists and Products in dictionaries of this process, with the
+secondary indexes the listings need: hash maps of the ids by owner and by
+name, and sorted lists of (date_joined, id) and (name, id) that bisect
+turns into date ranges and name prefixes. Nothing survives a restart and
+each process has its own data, so it suits tests, benchmarks and throwaway
+instances.
+
+Reads return new model instances outside of any session. Their loaded
+values are recorded as committed, so the attribute history tells the
+writes what changed, as it tells a flush. There are no transactions: a
+request that fails keeps the writes it made before.
+"""
+import itertools
+import math
+import threading
+from bisect import bisect_left, bisect_right, insort
+from sqlalchemy import inspect
+from sqlalchemy.orm.attributes import set_committed_value
+from service.common.ngram_index import NGramIndex
+from service.models import DataValidationError, Product, Wishlist, utcnow
+from service.repository import (
+    PRODUCT_COLUMNS,
+    WISHLIST_COLUMNS,
+    DataConflictError,
+    Repository,
+    as_key,
+    changes,
+    commit,
+    load,
+    page,
+)
+
+# pylint: disable=too-many-arguments, too-many-public-methods
+
+
+def criteria_filters(criteria: dict) -> list:
+    """Returns a check of (id, record) pairs per criterion of a listing"""
+    start, end = criteria.get("start"), criteria.get("end")
+    if start and end and start > end:
+        raise DataValidationError(
+            "Invalid Date: start date should be smaller than end date"
+        )
+    checks = []
+    if criteria.get("ids") is not None:
+        ids = set(criteria["ids"])
+        checks.append(lambda key, record: key in ids)
+    for column in ("owner", "name"):
+        if criteria.get(column):
+            checks.append(lambda key, record, column=column: record[column] == criteria[column])
+    if criteria.get("name_prefix"):
+        checks.append(lambda key, record: (record["name"] or "").startswith(criteria["name_prefix"]))
+    if start:
+        checks.append(lambda key, record: record["date_joined"] >= start)
+    if end:
+        checks.append(lambda key, record: record["date_joined"] <= end)
+    if criteria.get("min_items") is not None:
+        checks.append(lambda key, record: record["product_count"] >= criteria["min_items"])
+    if criteria.get("max_items") is not None:
+        checks.append(lambda key, record: record["product_count"] <= criteria["max_items"])
+    return checks
+
+
+def discard(index: dict, value, key):
+    """Takes an id out of the set of a hash index, dropping emptied sets"""
+    keys = index.get(value)
+    if keys is not None:
+        keys.discard(key)
+        if not keys:
+            del index[value]
+
+
+def remove_sorted(entries: list, entry):
+    """Takes an entry out of a sorted list"""
+    position = bisect_left(entries, entry)
+    if position < len(entries) and entries[position] == entry:
+        del entries[position]
+
+
+######################################################################
+#  M E M O R Y   R E P O S I T O R Y
+######################################################################
+class MemoryRepository(Repository):  # pylint: disable=too-many-instance-attributes
+    """Keeps Wishlists and Products in this process, indexed for the listings"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._wishlists = {}  # id -> columns
+        self._products = {}  # id -> columns
+        self._by_owner = {}  # owner -> wishlist ids
+        self._by_name = {}  # name -> wishlist ids
+        self._by_date = []  # sorted (date_joined, id)
+        self._by_prefix = []  # sorted (name, id) of the names that are set
+        self._contents = {}  # wishlist id -> product ids
+        self._product_names = {}  # (wishlist id, name) -> product id
+        self._search = NGramIndex()
+        self._wishlist_ids = itertools.count(1)
+        self._product_ids = itertools.count(1)
+
+    def clear(self):
+        with self._lock:
+            for index in (
+                self._wishlists, self._products, self._by_owner, self._by_name,
+                self._by_date, self._by_prefix, self._contents, self._product_names,
+            ):
+                index.clear()
+            self._search.build([])
+
+    # ------------------------------------------------------------------
+    # W I S H L I S T S
+    # ------------------------------------------------------------------
+    def find_wishlist(self, wishlist_id):
+        with self._lock:
+            key = as_key(wishlist_id)
+            return self._wishlist(key) if key in self._wishlists else None
+
+    def list_wishlists(self, criteria: dict, sort=None, after=None, limit=None) -> list:
+        sort = Wishlist.listing_sort(criteria, sort)
+        with self._lock:
+            records = [self._wishlists[key] for key in self._match(criteria)]
+            return [self._wishlist(record["id"]) for record in page(Wishlist, records, sort, after, limit)]
+
+    def count_wishlists(self, criteria: dict, estimated=False) -> int:
+        with self._lock:
+            return len(self._match(criteria))
+
+    def find_by_owner(self, owner) -> list:
+        with self._lock:
+            return [self._wishlist(key) for key in sorted(self._by_owner.get(owner, ()))]
+
+    def find_by_name(self, name) -> list:
+        with self._lock:
+            return [self._wishlist(key) for key in sorted(self._by_name.get(name, ()))]
+
+    def filter_by_date(self, start=None, end=None) -> list:
+        with self._lock:
+            return [self._wishlist(key) for key in self._match({"start": start, "end": end})]
+
+    def create_wishlist(self, wishlist):
+        with self._lock:
+            self._insert_wishlist(wishlist)
+
+    def create_wishlists(self, wishlists):
+        with self._lock:
+            for wishlist in wishlists:
+                self._insert_wishlist(wishlist)
+
+    def update_wishlist(self, wishlist):
+        if not wishlist.id:
+            raise DataValidationError("Update called with empty ID field")
+        with self._lock:
+            record = self._wishlists.get(wishlist.id)
+            if record is None:
+                raise DataConflictError(f"Wishlist {wishlist.id} not exist")
+            history = inspect(wishlist).attrs.products.history
+            removed = [product.id for product in history.deleted if product.id in self._contents[wishlist.id]]
+            kept = [product for product in wishlist.products if product.id in self._products]
+            added = [product for product in wishlist.products if product.id is None]
+            self._check_contents(wishlist.id, removed, kept, added)
+
+            changed = changes(wishlist, WISHLIST_COLUMNS)
+            if changed:
+                self._unindex_wishlist(record)
+                record.update(changed, updated_at=utcnow())
+                self._index_wishlist(record)
+            for key in removed:
+                self._remove_product(key)
+            for product in kept:
+                self._write_product(product)
+            for product in added:
+                product.wishlist_id = wishlist.id
+                self._insert_product(product)
+            commit(wishlist, record)
+            set_committed_value(wishlist, "products", list(wishlist.products))
+
+    def delete_wishlist(self, wishlist):
+        with self._lock:
+            if wishlist.id in self._wishlists:
+                self._remove_wishlist(wishlist.id)
+
+    def delete_wishlists(self, criteria: dict) -> int:
+        with self._lock:
+            keys = self._match(criteria)
+            for key in keys:
+                self._remove_wishlist(key)
+            return len(keys)
+
+    def summarize_wishlist(self, wishlist_id):
+        with self._lock:
+            record = self._wishlists.get(as_key(wishlist_id))
+            if record is None:
+                return None
+            return {
+                "id": record["id"],
+                "name": record["name"],
+                "owner": record["owner"],
+                **self._figures([record]),
+            }
+
+    def summarize_owner(self, owner) -> dict:
+        with self._lock:
+            records = [self._wishlists[key] for key in self._by_owner.get(owner, ())]
+            return {"owner": owner, "wishlist_count": len(records), **self._figures(records)}
+
+    def _wishlist(self, key):
+        """Returns a new instance of a stored Wishlist with its Products"""
+        wishlist = load(Wishlist, self._wishlists[key])
+        products = [load(Product, self._products[product_id]) for product_id in sorted(self._contents[key])]
+        set_committed_value(wishlist, "products", products)
+        return wishlist
+
+    def _insert_wishlist(self, wishlist):
+        if wishlist.date_joined is None:
+            raise DataValidationError("Invalid Wishlist: missing date_joined")
+        names = [product.name for product in wishlist.products if product.name is not None]
+        if len(names) != len(set(names)):
+            raise DataConflictError("Invalid Wishlist: the same product name appears twice")
+        key = next(self._wishlist_ids)
+        record = {column: getattr(wishlist, column) for column in WISHLIST_COLUMNS}
+        record.update(id=key, product_count=0, total_quantity=0, updated_at=utcnow())
+        self._wishlists[key] = record
+        self._contents[key] = set()
+        self._index_wishlist(record)
+        for product in wishlist.products:
+            product.wishlist_id = key
+            self._insert_product(product)
+        commit(wishlist, record)
+        set_committed_value(wishlist, "products", list(wishlist.products))
+
+    def _remove_wishlist(self, key):
+        for product_id in list(self._contents[key]):
+            self._remove_product(product_id)
+        del self._contents[key]
+        self._unindex_wishlist(self._wishlists.pop(key))
+
+    def _index_wishlist(self, record):
+        key = record["id"]
+        self._by_owner.setdefault(record["owner"], set()).add(key)
+        self._by_name.setdefault(record["name"], set()).add(key)
+        insort(self._by_date, (record["date_joined"], key))
+        if record["name"] is not None:
+            insort(self._by_prefix, (record["name"], key))
+
+    def _unindex_wishlist(self, record):
+        key = record["id"]
+        discard(self._by_owner, record["owner"], key)
+        discard(self._by_name, record["name"], key)
+        remove_sorted(self._by_date, (record["date_joined"], key))
+        if record["name"] is not None:
+            remove_sorted(self._by_prefix, (record["name"], key))
+
+    def _match(self, criteria: dict) -> list:
+        """Returns the ids of the Wishlists matching every criterion, in the
+        order of the index they were found with"""
+        checks = criteria_filters(criteria)
+        return [
+            key for key in self._candidates(criteria)
+            if all(check(key, self._wishlists[key]) for check in checks)
+        ]
+
+    def _candidates(self, criteria: dict):
+        """Returns the ids the most selective index gives for the criteria
+
+        The hash indexes know their sizes and bisect finds the bounds of
+        the ranges, so only the smallest set of ids is gone through.
+        """
+        options = [(len(self._wishlists), lambda: sorted(self._wishlists))]
+        if criteria.get("ids") is not None:
+            ids = [key for key in set(criteria["ids"]) if key in self._wishlists]
+            options.append((len(ids), lambda: sorted(ids)))
+        for column, index in (("owner", self._by_owner), ("name", self._by_name)):
+            if criteria.get(column):
+                keys = index.get(criteria[column], ())
+                options.append((len(keys), lambda keys=keys: sorted(keys)))
+        if criteria.get("name_prefix"):
+            low, high = self._prefix_bounds(criteria["name_prefix"])
+            options.append((high - low, lambda: [key for _, key in self._by_prefix[low:high]]))
+        if criteria.get("start") or criteria.get("end"):
+            first, last = self._date_bounds(criteria.get("start"), criteria.get("end"))
+            options.append((last - first, lambda: [key for _, key in self._by_date[first:last]]))
+        return min(options, key=lambda option: option[0])[1]()
+
+    def _prefix_bounds(self, prefix):
+        """Returns where the names starting with prefix are in _by_prefix"""
+        low = bisect_left(self._by_prefix, (prefix,))
+        last = ord(prefix[-1])
+        if last == 0x10FFFF:  # no character sorts after it, the range stays open
+            return low, len(self._by_prefix)
+        return low, bisect_left(self._by_prefix, (prefix[:-1] + chr(last + 1),))
+
+    def _date_bounds(self, start, end):
+        """Returns where the dates from start to end are in _by_date"""
+        first = bisect_left(self._by_date, (start,)) if start else 0
+        last = bisect_right(self._by_date, (end, math.inf)) if end else len(self._by_date)
+        return first, last
+
+    def _figures(self, records) -> dict:
+        products = [
+            self._products[product_id] for record in records for product_id in self._contents[record["id"]]
+        ]
+        updates = [row["updated_at"] for row in records + products]
+        return {
+            "product_count": len(products),
+            "total_quantity": sum(product["quantity"] or 0 for product in products),
+            "distinct_product_names": len({product["name"] for product in products} - {None}),
+            "last_modified": max(updates) if updates else None,
+        }
+
+    # ------------------------------------------------------------------
+    # P R O D U C T S
+    # ------------------------------------------------------------------
+    def find_product(self, product_id):
+        with self._lock:
+            record = self._products.get(as_key(product_id))
+            return load(Product, record) if record else None
+
+    def find_product_in_wishlist(self, wishlist_id, product_id) -> tuple:
+        with self._lock:
+            key = as_key(wishlist_id)
+            if key not in self._wishlists:
+                return False, None
+            found = as_key(product_id) in self._contents[key]
+            return True, self.find_product(product_id) if found else None
+
+    def list_products(self, wishlist_id, name=None, sort=None, after=None, limit=None) -> list:
+        key = as_key(wishlist_id)
+        with self._lock:
+            if name:
+                found = self._product_names.get((key, name))
+                keys = [] if found is None else [found]
+            else:
+                keys = self._contents.get(key, ())
+            records = [self._products[product_id] for product_id in keys]
+            return [load(Product, record) for record in page(Product, records, sort, after, limit)]
+
+    def create_product(self, product):
+        with self._lock:
+            self._insert_product(product)
+
+    def create_products(self, products):
+        with self._lock:
+            for product in products:
+                self._insert_product(product)
+
+    def update_product(self, product):
+        if not product.id:
+            raise DataValidationError("Update called with empty ID field")
+        with self._lock:
+            if product.id not in self._products:
+                raise DataConflictError(f"Product {product.id} not exist")
+            self._check_name(product.wishlist_id, product.name, product.id)
+            self._write_product(product)
+
+    def delete_product(self, product):
+        with self._lock:
+            if product.id in self._products:
+                self._remove_product(product.id)
+
+    def upsert_product(self, wishlist_id, name, quantity):
+        with self._lock:
+            if wishlist_id not in self._wishlists:
+                return None
+            key = self._product_names.get((wishlist_id, name))
+            if key is None:
+                record = self._insert({"wishlist_id": wishlist_id, "name": name, "quantity": quantity})
+            else:
+                record = self._products[key]
+                old = record["quantity"]
+                self._set_quantity(record, None if old is None else old + quantity)
+            return self._returned(record)
+
+    def adjust_quantity(self, wishlist_id, product_id, delta):
+        with self._lock:
+            record = self._products.get(product_id)
+            if record is None or record["wishlist_id"] != wishlist_id or record["quantity"] is None:
+                return None
+            if record["quantity"] + delta < 0:
+                return None
+            self._set_quantity(record, record["quantity"] + delta)
+            return self._returned(record)
+
+    def search_products(self, term, fuzzy=False, limit=20, offset=0, threshold=0.3) -> list:
+        # the index follows every write, so unlike the shared one of the
+        # models its matches need no checking against the data
+        window = slice(offset, offset + limit)
+        with self._lock:
+            if fuzzy:
+                ranked = self._search.fuzzy(term, threshold, window.stop)[window]
+            else:
+                ranked = [(key, None) for key in self._search.substring(term, window.stop)[window]]
+            results = []
+            for key, score in ranked:
+                record = self._products[key]
+                wishlist = self._wishlists[record["wishlist_id"]]
+                results.append(
+                    Product._search_result(  # pylint: disable=protected-access
+                        load(Product, record), wishlist["name"], wishlist["owner"], score
+                    )
+                )
+            return results
+
+    def _insert_product(self, product):
+        record = self._insert({column: getattr(product, column) for column in PRODUCT_COLUMNS})
+        commit(product, record)
+
+    def _insert(self, record) -> dict:
+        """Stores a new Product record and gives it its id"""
+        if record["wishlist_id"] not in self._wishlists:
+            raise DataConflictError(f"Wishlist {record['wishlist_id']} not exist")
+        self._check_name(record["wishlist_id"], record["name"])
+        record.update(id=next(self._product_ids), updated_at=utcnow())
+        self._products[record["id"]] = record
+        self._link_product(record)
+        return record
+
+    def _write_product(self, product):
+        """Saves the changed columns of a stored Product"""
+        record = self._products[product.id]
+        changed = changes(product, PRODUCT_COLUMNS)
+        target = changed.get("wishlist_id", record["wishlist_id"])
+        if target not in self._wishlists:
+            raise DataConflictError(f"Wishlist {target} not exist")
+        if changed:
+            self._unlink_product(record)
+            record.update(changed, updated_at=utcnow())
+            self._link_product(record)
+        commit(product, record)
+
+    def _remove_product(self, key):
+        self._unlink_product(self._products.pop(key))
+
+    def _set_quantity(self, record, quantity):
+        self._count(record["wishlist_id"], 0, (quantity or 0) - (record["quantity"] or 0))
+        record.update(quantity=quantity, updated_at=utcnow())
+
+    def _link_product(self, record):
+        """Adds a Product to the indexes and the counters of its Wishlist"""
+        key, wishlist_id = record["id"], record["wishlist_id"]
+        self._contents[wishlist_id].add(key)
+        if record["name"] is not None:
+            self._product_names[(wishlist_id, record["name"])] = key
+        self._search.add(key, record["name"])
+        self._count(wishlist_id, 1, record["quantity"] or 0)
+
+    def _unlink_product(self, record):
+        key, wishlist_id = record["id"], record["wishlist_id"]
+        self._contents[wishlist_id].discard(key)
+        # a product renamed to the old name of another one may own the entry
+        if self._product_names.get((wishlist_id, record["name"])) == key:
+            del self._product_names[(wishlist_id, record["name"])]
+        self._search.remove(key)
+        self._count(wishlist_id, -1, -(record["quantity"] or 0))
+
+    def _count(self, wishlist_id, products, quantity):
+        """Keeps the counters of a Wishlist as the triggers do in the database"""
+        record = self._wishlists[wishlist_id]
+        record["product_count"] += products
+        record["total_quantity"] += quantity
+        record["updated_at"] = utcnow()
+
+    def _check_name(self, wishlist_id, name, key=None):
+        """Raises DataConflictError when another Product of the Wishlist has the name"""
+        taken = self._product_names.get((wishlist_id, name))
+        if name is not None and taken is not None and taken != key:
+            raise DataConflictError(f"Wishlist {wishlist_id} already has a Product named {name}")
+
+    def _check_contents(self, wishlist_id, removed, kept, added):
+        """Raises DataConflictError when the Products of a Wishlist would
+        repeat a name after an update"""
+        names = {key: self._products[key]["name"] for key in self._contents[wishlist_id]}
+        for key in removed:
+            names.pop(key, None)
+        for product in kept:
+            if product.id in names:
+                names[product.id] = product.name
+        listed = [name for name in names.values() if name is not None]
+        listed.extend(product.name for product in added if product.name is not None)
+        if len(listed) != len(set(listed)):
+            raise DataConflictError(f"Wishlist {wishlist_id} would have two Products with the same name")
+
+    @staticmethod
+    def _returned(record) -> dict:
+        return {column: record[column] for column in ("id", "wishlist_id", "name", "quantity")}
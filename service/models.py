@@ -4,26 +4,200 @@ Models for Wishlist
 All of the models are stored in this module
 """
 import logging
-from datetime import date
+import re
+import sqlite3
+import warnings
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
 from abc import abstractmethod
+from typing import NamedTuple
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import and_
+from sqlalchemy import and_, bindparam, event, false, func, inspect, literal, or_, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError, SAWarning
+from sqlalchemy.orm import Session, merge_frozen_result
+from sqlalchemy.schema import AddConstraint, CreateColumn
+from service.common.ngram_index import NGramIndex, similarity, trigrams
+from service.common.single_flight import SingleFlight
 
-logger = logging.getLogger("flask.app")
+# pylint: disable=not-callable, too-many-lines
+
+logger = logging.getLogger(__name__)
 
 # Create the SQLAlchemy object to be initialized later in init_db()
 db = SQLAlchemy()
 
+# Characters that must be escaped inside a LIKE pattern
+LIKE_SPECIAL = re.compile(r"([\\%_])")
+
+# In-process index of product names for databases without pg_trgm
+product_names = NGramIndex()
+
+# Number of Wishlists removed per statement by a bulk delete
+BULK_DELETE_CHUNK = 1000
+
+# Number of Wishlists whose Products one query of a read-only listing loads
+ROW_CHUNK = 1000
+
+# Below this many rows by the planner's estimate an exact count is cheap
+EXACT_COUNT_BELOW = 1000
+
+# Identical finder queries running at the same time share one execution
+finder_flight = SingleFlight()
+
+# Statements of the listings by their shape, with bind parameters for the values
+_listing_statements = {}
+
 
 class DataValidationError(Exception):
     """Used for an data validation errors when deserializing"""
 
 
+class JobCancelled(Exception):
+    """Raised inside a job when its cancellation was requested"""
+
+
+class JobLost(Exception):
+    """Raised inside a job when another worker has claimed it since"""
+
+
+def prefix_condition(column, prefix: str):
+    """Matches the values of a column starting with prefix, using its index
+
+    PostgreSQL compares strings by collation, so only a LIKE on a
+    varchar_pattern_ops index finds prefixes; SQLite compares bytes, where
+    the prefixes form a range of the ordinary index.
+    """
+    parameters = prefix_parameters(prefix)
+    return and_(*prefix_clauses(column, parameters, parameters.get))
+
+
+def prefix_parameters(prefix: str) -> dict:
+    """Returns the values of the conditions of prefix_clauses by name"""
+    if db.engine.dialect.name == "postgresql":
+        return {"prefix_pattern": LIKE_SPECIAL.sub(r"\\\1", prefix) + "%"}
+    last = ord(prefix[-1])
+    if last == 0x10FFFF:  # no character sorts after it, the range stays open
+        return {"prefix_low": prefix}
+    following = 0xE000 if last == 0xD7FF else last + 1  # skip the surrogates
+    return {"prefix_low": prefix, "prefix_high": prefix[:-1] + chr(following)}
+
+
+def prefix_clauses(column, parameters, value=bindparam) -> list:
+    """Returns the conditions of prefix_condition for the names of
+    prefix_parameters, with bind parameters in place of the values unless
+    value looks them up"""
+    if "prefix_pattern" in parameters:
+        return [column.like(value("prefix_pattern"), escape="\\")]
+    conditions = [column >= value("prefix_low")] if "prefix_low" in parameters else []
+    if "prefix_high" in parameters:
+        conditions.append(column < value("prefix_high"))
+    return conditions
+
+
+def keyset_condition(columns: list, values: list):
+    """Matches the rows that sort after values in the order of (expression,
+    descending) pairs, with NULL where the database puts it: after every
+    value on PostgreSQL and before them on SQLite"""
+    nulls_last = db.engine.dialect.name == "postgresql"
+    condition = false()
+    for (column, descending), value in zip(reversed(columns), reversed(values)):
+        nulls_after = nulls_last != descending
+        if value is None:
+            after = column.isnot(None) if not nulls_after else false()
+            same = column.is_(None)
+        else:
+            after = column < value if descending else column > value
+            if nulls_after:
+                after = or_(after, column.is_(None))
+            same = column == value
+        condition = or_(after, and_(same, condition))
+    # a plain bound on the first column lets the index range scan start there
+    column, descending = columns[0]
+    if values[0] is not None and nulls_last == descending:
+        condition = and_(column <= values[0] if descending else column >= values[0], condition)
+    return condition
+
+
+def listing_statement(key: tuple, build):
+    """Returns the statement of a listing of this shape, built by build()
+    with bind parameters in place of the values the first time
+
+    SQLAlchemy keeps the cache key of a statement once computed, so a
+    listing finds its compiled SQL without building and hashing a select
+    on every request. The shapes are few: the criteria, sort keys and
+    cursor given, never their values.
+    """
+    statement = _listing_statements.get(key)
+    if statement is None:
+        statement = _listing_statements.setdefault(key, build())
+    return statement
+
+
+def patch_value(kind, parse=None):
+    """Returns a function that checks a patched value is of the given type"""
+
+    def check(value):
+        try:
+            if parse and isinstance(value, str):
+                return parse(value)
+        except ValueError as error:
+            raise DataValidationError(f"Invalid value: {error}") from error
+        if not isinstance(value, kind) or isinstance(value, bool):
+            raise DataValidationError(
+                f"Invalid value: {value!r} is not a {kind.__name__}"
+            )
+        return value
+
+    return check
+
+
 def init_db(app):
     """Initialize the SQLAlchemy app"""
     Wishlist.init_db(app)
 
 
+######################################################################
+#  U N I T   O F   W O R K
+######################################################################
+@contextmanager
+def unit_of_work():
+    """
+    Groups the changes of the model methods into one transaction
+
+    Inside the block create, update, delete and the other writes only flush,
+    and the block commits once at the end or rolls back if it raises. Nested
+    blocks join the outer one.
+    """
+    session = db.session()
+    if session.info.get("unit_of_work"):
+        yield session
+        return
+    session.info["unit_of_work"] = True
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.info.pop("unit_of_work", None)
+
+
+def save_changes():
+    """Commits the session, or only flushes it inside a unit of work
+
+    The flush also expires the loaded objects like a commit would, so the
+    counters the triggers maintain are read again on next access.
+    """
+    if db.session.info.get("unit_of_work"):
+        db.session.flush()
+        db.session.expire_all()
+    else:
+        db.session.commit()
+
+
 ######################################################################
 #  P E R S I S T E N T   B A S E   M O D E L
 ######################################################################
@@ -48,7 +222,7 @@ class PersistentBase:
         logger.info("Creating %s", self.name)
         self.id = None  # id must be none to generate next primary key
         db.session.add(self)
-        db.session.commit()
+        save_changes()
 
     def update(self):
         """
@@ -57,13 +231,130 @@ class PersistentBase:
         logger.info("Updating %s", self.name)
         if not self.id:
             raise DataValidationError("Update called with empty ID field")
-        db.session.commit()
+        save_changes()
 
     def delete(self):
         """Removes an object from the data store"""
         logger.info("Deleting %s", self.name)
         db.session.delete(self)
-        db.session.commit()
+        save_changes()
+
+    # Columns a listing can be sorted by, each one leads an index
+    SORTABLE = ("id",)
+
+    @classmethod
+    def sort_columns(cls, sort: list) -> list:
+        """Checks sort keys against SORTABLE and returns (column, descending)
+        pairs, ending with the id so that the order is total"""
+        columns, seen = [], set()
+        for key in sort:
+            name = key.removeprefix("-")
+            if name not in cls.SORTABLE:
+                raise DataValidationError(
+                    f"Invalid sort: {name} is not one of {', '.join(cls.SORTABLE)}"
+                )
+            if name not in seen:
+                seen.add(name)
+                columns.append((cls.__table__.c[name], key.startswith("-")))
+        if "id" not in seen:
+            columns.append((cls.__table__.c.id, False))
+        return columns
+
+    @classmethod
+    def sort_order(cls, sort: list) -> list:
+        """Returns the ORDER BY clauses of sort keys"""
+        return [column.desc() if descending else column.asc() for column, descending in cls.sort_columns(sort)]
+
+    def sort_values(self, sort: list) -> list:
+        """Returns the values of the sort columns of this record as JSON values"""
+        return self.cursor_of(self, sort)
+
+    @classmethod
+    def cursor_of(cls, record, sort: list) -> list:
+        """Returns the values of the sort columns of a record, an instance or
+        a read-only row, as JSON values"""
+        values = []
+        for column, _ in cls.sort_columns(sort):
+            value = getattr(record, column.key)
+            values.append(value.isoformat() if isinstance(value, date) else value)
+        return values
+
+    @classmethod
+    def after_condition(cls, sort: list, values: list):
+        """Matches the records that come after the given sort values (keyset)
+
+        The comparisons follow the order of the database, which puts NULL
+        after every value on PostgreSQL and before them on SQLite.
+        """
+        columns = cls.sort_columns(sort)
+        return keyset_condition(columns, cls.cursor_values(columns, values))
+
+    @classmethod
+    def after_parameters(cls, sort: list, values: list) -> dict:
+        """Returns the values of a cursor by the names after_clause gives
+        their bind parameters, leaving out the NULL ones"""
+        values = cls.cursor_values(cls.sort_columns(sort), values)
+        return {f"after_{index}": value for index, value in enumerate(values) if value is not None}
+
+    @classmethod
+    def after_clause(cls, sort: list, parameters):
+        """Returns after_condition for the names of after_parameters, with
+        bind parameters in place of the values"""
+        columns = cls.sort_columns(sort)
+        values = [bindparam(f"after_{index}") if f"after_{index}" in parameters else None for index in range(len(columns))]
+        return keyset_condition(columns, values)
+
+    @classmethod
+    def sort_shape(cls, sort: list) -> tuple:
+        """Returns the sort keys as they order a listing, a key of its statement"""
+        return tuple((column.key, descending) for column, descending in cls.sort_columns(sort))
+
+    @classmethod
+    def cursor_values(cls, columns: list, values: list) -> list:
+        """Checks the values of a cursor against the sort columns and
+        converts them back to the types of the columns"""
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise DataValidationError("Invalid cursor: it does not match the sort")
+        return [cls._sort_value(column, value) for (column, _), value in zip(columns, values)]
+
+    @classmethod
+    def _sort_value(cls, column, value):
+        """Converts a value of a cursor back to the type of its column"""
+        try:
+            if value is not None and column.type.python_type is date:
+                return date.fromisoformat(value)
+            if value is not None and not isinstance(value, column.type.python_type):
+                raise TypeError(value)
+        except (TypeError, ValueError) as error:
+            raise DataValidationError(f"Invalid cursor: bad value for {column.key}") from error
+        return value
+
+    def merge_patch(self, changes: dict) -> None:
+        """
+        Applies a JSON Merge Patch (RFC 7396) to the columns of an object
+
+        Only the members in the patch are assigned, so the flush updates the
+        columns that really changed and nothing else. A null member clears a
+        nullable column.
+
+        Args:
+            changes (dict): the patch, members of READ_ONLY are skipped
+        """
+        kind = type(self).__name__
+        if not isinstance(changes, dict):
+            raise DataValidationError(f"Invalid {kind}: the patch must be an object")
+        for key, value in changes.items():
+            if key in self.READ_ONLY:
+                continue
+            if key not in self.PATCHABLE:
+                raise DataValidationError(f"Invalid {kind}: unknown field {key}")
+            if value is None:
+                if not self.__table__.c[key].nullable:
+                    raise DataValidationError(f"Invalid {kind}: {key} cannot be null")
+            else:
+                value = self.PATCHABLE[key](value)
+            if getattr(self, key) != value:
+                setattr(self, key, value)
 
     @classmethod
     def init_db(cls, app):
@@ -71,9 +362,12 @@ class PersistentBase:
         logger.info("Initializing database")
         cls.app = app
         # This is where we initialize SQLAlchemy from the Flask app
-        db.init_app(app)
+        if "sqlalchemy" not in app.extensions:
+            db.init_app(app)
         app.app_context().push()
         db.create_all()  # make our sqlalchemy tables
+        with db.engine.begin() as connection:
+            install_trigram_index(connection)
 
     @classmethod
     def all(cls):
@@ -97,6 +391,12 @@ class Product(db.Model, PersistentBase):
     """
 
     __tablename__ = "product"
+    # A name appears once per wishlist, the index also serves wishlist_id
+    # lookups and listings by name; the second one lists them by id
+    __table_args__ = (
+        db.UniqueConstraint("wishlist_id", "name", name="uq_product_wishlist_name"),
+        db.Index("ix_product_wishlist_id_id", "wishlist_id", "id"),
+    )
 
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
@@ -105,6 +405,14 @@ class Product(db.Model, PersistentBase):
     )
     name = db.Column(db.String(64))
     quantity = db.Column(db.Integer)
+    updated_at = db.Column(
+        db.DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
+
+    # JSON Merge Patch members and the checks of their values
+    PATCHABLE = {"name": patch_value(str), "quantity": patch_value(int)}
+    READ_ONLY = ("id", "wishlist_id")
+    SORTABLE = ("id", "name")
 
     def __repr__(self):
         return f"<Product {self.name} id=[{self.id}] quantity={self.quantity} wishlist[{self.wishlist_id}]>"
@@ -144,6 +452,296 @@ class Product(db.Model, PersistentBase):
             ) from error
         return self
 
+    def patch(self, changes: dict) -> None:
+        """
+        Applies a JSON Merge Patch to a Product
+
+        Args:
+            changes (dict): the members to change
+        """
+        if isinstance(changes, dict) and changes.get("wishlist_id", self.wishlist_id) != self.wishlist_id:
+            raise DataValidationError("Should not change the wishlist a product belongs to")
+        self.merge_patch(changes)
+
+    @classmethod
+    def upsert(cls, wishlist_id, name, quantity):
+        """Adds a product to a Wishlist, or adds to its quantity if it is there
+
+        Runs as a single INSERT ... ON CONFLICT DO UPDATE statement
+
+        Args:
+            wishlist_id (int): the id of the Wishlist
+            name (string): the name of the product
+            quantity (int): the quantity to add
+
+        Returns:
+            dict: the product after the change, None if the Wishlist is missing
+        """
+        logger.info("Processing upsert of %s in Wishlist %s", name, wishlist_id)
+        insert = dialect_insert()
+        # selecting from wishlist inserts nothing when it does not exist
+        source = select(
+            Wishlist.id, literal(name, db.String), literal(quantity, db.Integer)
+        ).where(Wishlist.id == wishlist_id)
+        statement = insert(cls).from_select(["wishlist_id", "name", "quantity"], source)
+        statement = statement.on_conflict_do_update(
+            index_elements=["wishlist_id", "name"],
+            set_={
+                "quantity": cls.quantity + statement.excluded.quantity,
+                "updated_at": func.now(),
+            },
+        ).returning(*cls._returned_columns())
+        return cls._execute_returning(statement)
+
+    @classmethod
+    def find_matching(cls, wishlist_id, name=None, sort=None, after=None):
+        """Returns the Products of a Wishlist in the order asked for
+
+        Args:
+            wishlist_id (int): the Wishlist holding the Products
+            name (string): only the Product with this name
+            sort (list): names of SORTABLE columns, a leading - sorts descending
+            after (list): the sort values of the last Product of the previous
+                page, to continue after it
+        """
+        logger.info("Processing query for Products of Wishlist %s sorted by %s", wishlist_id, sort)
+        sort = sort or []
+        query = cls.query.filter(cls.wishlist_id == wishlist_id)
+        if name:
+            query = query.filter(cls.name == name)
+        if after is not None:
+            query = query.filter(cls.after_condition(sort, after))
+        return query.order_by(*cls.sort_order(sort))
+
+    @classmethod
+    def find_rows(  # pylint: disable=too-many-arguments
+        cls, wishlist_id, name=None, sort=None, after=None, limit=None
+    ) -> list:
+        """Returns the Products of find_matching as read-only ProductRows
+
+        The columns are selected instead of the entities, so the rows skip
+        the identity map and the change tracking of instances. They are for
+        responses that only serialize them.
+        """
+        logger.info("Processing row query for Products of Wishlist %s sorted by %s", wishlist_id, sort)
+        sort = sort or []
+        parameters = {"wishlist_id": wishlist_id}
+        if name:
+            parameters["name"] = name
+        if after is not None:
+            parameters.update(cls.after_parameters(sort, after))
+        if limit is not None:
+            parameters["limit"] = limit
+
+        def build():
+            statement = select(*ProductRow.columns()).where(cls.wishlist_id == bindparam("wishlist_id"))
+            if name:
+                statement = statement.where(cls.name == bindparam("name"))
+            if after is not None:
+                statement = statement.where(cls.after_clause(sort, parameters))
+            statement = statement.order_by(*cls.sort_order(sort))
+            return statement if limit is None else statement.limit(bindparam("limit"))
+
+        key = ("product_rows", cls.sort_shape(sort), after is not None, *sorted(parameters))
+        statement = listing_statement(key, build)
+        return [ProductRow(*row) for row in db.session.execute(statement, parameters).all()]
+
+    @classmethod
+    def rows_by_wishlist(cls, wishlist_ids: list) -> dict:
+        """Returns the ProductRows of Wishlists by Wishlist id, in id order"""
+        products = {}
+        statement = listing_statement(
+            ("products_by_wishlist",),
+            lambda: select(*ProductRow.columns())
+            .where(cls.wishlist_id.in_(bindparam("ids", expanding=True)))
+            .order_by(cls.id),
+        )
+        for start in range(0, len(wishlist_ids), ROW_CHUNK):
+            chunk = wishlist_ids[start:start + ROW_CHUNK]
+            for row in db.session.execute(statement, {"ids": chunk}).all():
+                products.setdefault(row.wishlist_id, []).append(ProductRow(*row))
+        return products
+
+    @classmethod
+    def find_in_wishlist(cls, wishlist_id, product_id):
+        """Looks up a Wishlist and a Product together in one query
+
+        The Wishlist is the driving row and its Product is outer joined by
+        the primary key, so a single round trip tells a missing Wishlist
+        from a missing Product.
+
+        Args:
+            wishlist_id (int): the id of the Wishlist
+            product_id (int): the id of the Product
+
+        Returns:
+            tuple: whether the Wishlist exists and the Product or None,
+            which it also is for a Product of another Wishlist
+        """
+        logger.info("Processing lookup for Product %s in Wishlist %s", product_id, wishlist_id)
+        row = db.session.execute(
+            select(Wishlist.id, cls)
+            .select_from(Wishlist)
+            .outerjoin(cls, and_(cls.id == product_id, cls.wishlist_id == wishlist_id))
+            .where(Wishlist.id == wishlist_id)
+        ).one_or_none()
+        if row is None:
+            return False, None
+        return True, row[1]
+
+    @classmethod
+    def adjust_quantity(cls, wishlist_id, product_id, delta):
+        """Adds delta to the quantity of a product, which cannot drop below zero
+
+        Runs as a single UPDATE statement
+
+        Returns:
+            dict: the product after the change, None if nothing was changed
+        """
+        logger.info("Processing quantity change of %s for Product %s", delta, product_id)
+        statement = (
+            cls.__table__.update()
+            .where(
+                cls.id == product_id,
+                cls.wishlist_id == wishlist_id,
+                cls.quantity + delta >= 0,
+            )
+            .values(quantity=cls.quantity + delta, updated_at=func.now())
+            .returning(*cls._returned_columns())
+        )
+        return cls._execute_returning(statement)
+
+    @classmethod
+    def _returned_columns(cls):
+        return [cls.id, cls.wishlist_id, cls.name, cls.quantity]
+
+    @classmethod
+    def _execute_returning(cls, statement):
+        row = db.session.execute(statement).mappings().one_or_none()
+        save_changes()
+        if row is None:
+            return None
+        if product_names.built:
+            product_names.add(row["id"], row["name"])
+        return dict(row)
+
+    @classmethod
+    def search(cls, term, fuzzy=False, limit=20, offset=0, threshold=0.3):  # pylint: disable=too-many-arguments
+        """Searches the product names of every Wishlist
+
+        Uses the pg_trgm GIN index when PostgreSQL has it, otherwise the
+        in-process trigram index, brought up to date from the change feed
+
+        Args:
+            term (string): the text to look for
+            fuzzy (bool): rank similar names instead of matching a substring
+            limit (int): the most results to return
+            offset (int): the number of results to skip
+            threshold (float): the least similarity of a fuzzy match
+        """
+        logger.info("Processing product search for %s ...", term)
+        window = slice(offset, offset + limit)
+        if trigram_search_enabled():
+            return cls._search_trigram(term, fuzzy, window, threshold)
+        return cls._search_index(term, fuzzy, window, threshold)
+
+    @classmethod
+    def _search_query(cls, score):
+        return db.session.query(
+            cls, Wishlist.name, Wishlist.owner, score.label("score")
+        ).join(Wishlist, cls.wishlist_id == Wishlist.id)
+
+    @classmethod
+    def _search_trigram(cls, term, fuzzy, window, threshold):
+        if fuzzy:
+            db.session.execute(
+                text("SELECT set_config('pg_trgm.similarity_threshold', :value, true)"),
+                {"value": str(threshold)},
+            )
+            score = func.similarity(cls.name, term)
+            query = (
+                cls._search_query(score)
+                .filter(cls.name.op("%")(term))
+                .order_by(score.desc(), cls.id)
+            )
+        else:
+            pattern = "%" + LIKE_SPECIAL.sub(r"\\\1", term) + "%"
+            query = (
+                cls._search_query(db.null())
+                .filter(cls.name.ilike(pattern, escape="\\"))
+                .order_by(cls.id)
+            )
+        rows = query.slice(window.start, window.stop).all()
+        return [cls._search_result(*row) for row in rows]
+
+    @classmethod
+    def build_search_index(cls):
+        """Builds the in-process product name index if search needs it"""
+        if product_names.built or trigram_search_enabled():
+            return
+        logger.info("Building the product name index")
+        # the rows read next hold every change up to here, the later ones
+        # that they hold too are applied again by refresh_search_index
+        position = RecordChange.last_position()
+        rows = db.session.execute(
+            select(cls.id, cls.name).execution_options(yield_per=10000)
+        )
+        product_names.build(rows, position)
+
+    @classmethod
+    def refresh_search_index(cls):
+        """Takes the product changes committed since the in-process index
+        was built, by every process, from the change feed into the index"""
+        changes = RecordChange.product_changes(product_names.position)
+        if not changes:
+            return
+        names = dict.fromkeys(change.record_id for change in changes)
+        ids = [change.record_id for change in changes if not change.deleted]
+        for start in range(0, len(ids), ROW_CHUNK):
+            names.update(
+                db.session.execute(select(cls.id, cls.name).where(cls.id.in_(ids[start:start + ROW_CHUNK]))).all()
+            )
+        product_names.apply(names.items(), [changes[-1].txid, changes[-1].seq])
+
+    @classmethod
+    def _search_index(cls, term, fuzzy, window, threshold):
+        cls.build_search_index()
+        cls.refresh_search_index()
+        if fuzzy:
+            ranked = product_names.fuzzy(term, threshold, window.stop)[window]
+        else:
+            ranked = [(key, None) for key in product_names.substring(term, window.stop)[window]]
+        if not ranked:
+            return []
+        # the database has the last word, the index may hold deleted or
+        # renamed rows that other processes changed
+        rows = {
+            row[0].id: row
+            for row in cls._search_query(db.null()).filter(cls.id.in_([key for key, _ in ranked]))
+        }
+        wanted = trigrams(term)
+        results = []
+        for key, score in ranked:
+            if key not in rows:
+                continue
+            name = rows[key][0].name or ""
+            if fuzzy:
+                score = similarity(wanted, trigrams(name))
+                if score < threshold:
+                    continue
+            elif term.lower() not in name.lower():
+                continue
+            results.append(cls._search_result(*rows[key][:3], score))
+        return results
+
+    @staticmethod
+    def _search_result(product, wishlist_name, owner, score):
+        result = product.serialize()
+        result["wishlist_name"] = wishlist_name
+        result["owner"] = owner
+        result["score"] = score
+        return result
+
 
 ######################################################################
 #  W I S H L I S T   M O D E L
@@ -154,15 +752,41 @@ class Wishlist(db.Model, PersistentBase):
     """
 
     __tablename__ = "wishlist"
+    # Serves owner lookups alone and together with a date range
+    __table_args__ = (
+        db.Index("ix_wishlist_owner_date_joined", "owner", "date_joined"),
+    )
 
     app = None
 
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(64))
-    date_joined = db.Column(db.Date(), nullable=False, default=date.today())
-    products = db.relationship("Product", backref="wishlist", passive_deletes=True)
+    name = db.Column(db.String(64), index=True)
+    date_joined = db.Column(db.Date(), nullable=False, default=date.today(), index=True)
+    products = db.relationship(
+        "Product", backref="wishlist", passive_deletes=True, order_by="Product.id"
+    )
     owner = db.Column(db.String(64))
+    updated_at = db.Column(
+        db.DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
+    # Denormalized from the products by the triggers in COUNTER_TRIGGERS
+    product_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0", index=True
+    )
+    total_quantity = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0"
+    )
+
+    # JSON Merge Patch members and the checks of their values
+    PATCHABLE = {
+        "name": patch_value(str),
+        "owner": patch_value(str),
+        "date_joined": patch_value(date, date.fromisoformat),
+    }
+    READ_ONLY = ("id", "product_count", "total_quantity")
+
+    SORTABLE = ("id", "name", "owner", "date_joined", "product_count")
 
     def __repr__(self):
         return f"<Wishlist {self.name} id=[{self.id}]>"
@@ -175,6 +799,8 @@ class Wishlist(db.Model, PersistentBase):
             "date_joined": self.date_joined.isoformat(),
             "products": [],
             "owner": self.owner,
+            "product_count": self.product_count,
+            "total_quantity": self.total_quantity,
         }
         for product in self.products:
             wishlist["products"].append(product.serialize())
@@ -184,6 +810,9 @@ class Wishlist(db.Model, PersistentBase):
         """
         Populates an Wishlist from a dictionary
 
+        The products of a saved Wishlist are matched to the current ones by
+        id like in patch, so a Wishlist read and sent back is unchanged.
+
         Args:
             data (dict): A dictionary containing the resource data
         """
@@ -193,6 +822,9 @@ class Wishlist(db.Model, PersistentBase):
             self.owner = data["owner"]
             # handle inner list of products
             product_list = data.get("products")
+            if self.id is not None:
+                self._patch_products(product_list)
+                return self
             for json_address in product_list:
                 product = Product()
                 product.deserialize(json_address)
@@ -208,6 +840,53 @@ class Wishlist(db.Model, PersistentBase):
             ) from error
         return self
 
+    def patch(self, changes: dict) -> None:
+        """
+        Applies a JSON Merge Patch to a Wishlist
+
+        The products member lists the products the Wishlist should end up
+        with. It is compared with the current ones by id: entries without an
+        id are added, entries with one are patched, and products left out are
+        deleted, so unchanged products cost nothing.
+
+        Args:
+            changes (dict): the members to change
+        """
+        if not isinstance(changes, dict):
+            raise DataValidationError("Invalid Wishlist: the patch must be an object")
+        columns = {key: value for key, value in changes.items() if key != "products"}
+        self.merge_patch(columns)
+        if "products" in changes:
+            items = changes["products"]
+            self._patch_products([] if items is None else items)
+
+    def _patch_products(self, items):
+        if not isinstance(items, list):
+            raise DataValidationError("Invalid Wishlist: products must be a list")
+        current = {product.id: product for product in self.products}
+        kept = set()
+        for item in items:
+            if not isinstance(item, dict):
+                raise DataValidationError("Invalid Wishlist: products must be objects")
+            key = item.get("id")
+            if key is None:
+                product = Product()
+                product.deserialize(dict(item, wishlist_id=self.id))
+                self.products.append(product)
+            elif key in current:
+                current[key].patch(item)
+                kept.add(key)
+            else:
+                raise DataValidationError(
+                    f"Invalid Wishlist: Product {key} is not in Wishlist {self.id}"
+                )
+        for key, product in current.items():
+            if key not in kept:
+                self.products.remove(product)
+                # products of the in-memory repository are in no session
+                if inspect(product).persistent:
+                    db.session.delete(product)
+
     def find_product_by_name(self, product_name):
         """Return the products by the name
 
@@ -220,6 +899,255 @@ class Wishlist(db.Model, PersistentBase):
                 results.append(product)
         return results
 
+    @classmethod
+    def summarize(cls, wishlist_id):
+        """Returns the aggregate figures of a Wishlist computed by the database
+
+        Args:
+            wishlist_id (int): the id of the Wishlist to summarize
+        """
+        logger.info("Processing summary for Wishlist with id %s ...", wishlist_id)
+        row = (
+            cls._summary_query(cls.id, cls.name, cls.owner)
+            .filter(cls.id == wishlist_id)
+            .group_by(cls.id, cls.name, cls.owner)
+            .one_or_none()
+        )
+        if row is None:
+            return None
+        return {
+            "id": row.id,
+            "name": row.name,
+            "owner": row.owner,
+            **cls._summary_figures(row),
+        }
+
+    @classmethod
+    def summarize_owner(cls, owner):
+        """Returns the aggregate figures of all Wishlists of an owner
+
+        Args:
+            owner (string): the owner of the Wishlists to summarize
+        """
+        logger.info("Processing summary for owner %s ...", owner)
+        row = (
+            cls._summary_query(
+                func.count(func.distinct(cls.id)).label("wishlist_count")
+            )
+            .filter(cls.owner == owner)
+            .one()
+        )
+        return {
+            "owner": owner,
+            "wishlist_count": row.wishlist_count,
+            **cls._summary_figures(row),
+        }
+
+    @classmethod
+    def _summary_query(cls, *columns):
+        """Builds the aggregate query shared by the summaries"""
+        return db.session.query(
+            *columns,
+            func.count(Product.id).label("product_count"),
+            func.coalesce(func.sum(Product.quantity), 0).label("total_quantity"),
+            func.count(func.distinct(Product.name)).label("distinct_names"),
+            func.max(cls.updated_at).label("wishlist_updated"),
+            func.max(Product.updated_at).label("product_updated"),
+        ).outerjoin(Product, Product.wishlist_id == cls.id)
+
+    @staticmethod
+    def _summary_figures(row) -> dict:
+        """Converts the aggregate columns of a summary row into a dictionary"""
+        updates = [when for when in (row.wishlist_updated, row.product_updated) if when]
+        return {
+            "product_count": row.product_count,
+            "total_quantity": int(row.total_quantity),
+            "distinct_product_names": row.distinct_names,
+            "last_modified": max(updates) if updates else None,
+        }
+
+    @classmethod
+    def find_matching(cls, criteria: dict, sort=None, after=None):
+        """Returns the Wishlists matching all of the criteria in one query
+
+        Every filter is a plain comparison on an indexed column, so the
+        planner can start from the most selective index and check the other
+        conditions on the rows it reads. A name prefix is a LIKE served by
+        the varchar_pattern_ops index on PostgreSQL and a range on the name
+        index elsewhere.
+
+        Args:
+            criteria (dict): any of ids, owner, name, name_prefix, start, end,
+                min_items and max_items
+            sort (list): sort keys, see listing_sort
+            after (list): the sort values of the last Wishlist of the
+                previous page, to continue after it
+        """
+        logger.info("Processing query for Wishlists matching %s sorted by %s", criteria, sort)
+        sort = cls.listing_sort(criteria, sort)
+        query = cls.query.filter(*cls._criteria_conditions(criteria))
+        if after is not None:
+            query = query.filter(cls.after_condition(sort, after))
+        return query.order_by(*cls.sort_order(sort)).execution_options(single_flight=True)
+
+    @classmethod
+    def find_rows(cls, criteria: dict, sort=None, after=None, limit=None) -> list:
+        """Returns the Wishlists of find_matching as read-only WishlistRows
+
+        The columns are selected instead of the entities and the Products of
+        every ROW_CHUNK Wishlists come in one more query, so a listing holds
+        tuples and not instances tracked by the session. They are for
+        responses that only serialize them.
+        """
+        logger.info("Processing row query for Wishlists matching %s sorted by %s", criteria, sort)
+        statement, parameters = cls._row_statement(criteria, sort, after, limit)
+        rows = db.session.execute(statement, parameters, execution_options={"single_flight": True}).all()
+        products = Product.rows_by_wishlist([row.id for row in rows])
+        return [WishlistRow(*row, products.get(row.id, [])) for row in rows]
+
+    @classmethod
+    def stream_rows(cls, criteria: dict, sort=None):
+        """Yields the WishlistRows of find_rows one at a time
+
+        The Wishlists are fetched ROW_CHUNK at a time from a server-side
+        cursor on PostgreSQL, with the Products of each chunk in one query,
+        so only a chunk is held however many Wishlists match. Nothing is
+        read until the generator is iterated.
+        """
+        logger.info("Processing streamed row query for Wishlists matching %s sorted by %s", criteria, sort)
+        statement, parameters = cls._row_statement(criteria, sort)
+        result = db.session.execute(statement, parameters, execution_options={"yield_per": ROW_CHUNK})
+        for rows in result.partitions():
+            products = Product.rows_by_wishlist([row.id for row in rows])
+            for row in rows:
+                yield WishlistRow(*row, products.get(row.id, []))
+
+    @classmethod
+    def _row_statement(cls, criteria: dict, sort=None, after=None, limit=None) -> tuple:
+        """Returns the sorted select of the WishlistRow columns matching the
+        criteria and the values of its bind parameters"""
+        sort = cls.listing_sort(criteria, sort)
+        parameters = cls._criteria_parameters(criteria)
+        if after is not None:
+            parameters.update(cls.after_parameters(sort, after))
+        if limit is not None:
+            parameters["limit"] = limit
+
+        def build():
+            statement = select(*WishlistRow.columns()).where(*cls._criteria_clauses(parameters))
+            if after is not None:
+                statement = statement.where(cls.after_clause(sort, parameters))
+            statement = statement.order_by(*cls.sort_order(sort))
+            return statement if limit is None else statement.limit(bindparam("limit"))
+
+        key = ("wishlist_rows", cls.sort_shape(sort), after is not None, *sorted(parameters))
+        return listing_statement(key, build), parameters
+
+    @classmethod
+    def count_matching(cls, criteria: dict, estimated=False) -> int:
+        """Counts the Wishlists matching all of the criteria
+
+        An estimated count comes from the statistics of the PostgreSQL
+        planner: reltuples of pg_class without criteria and the row estimate
+        of EXPLAIN with them. It is only used from EXACT_COUNT_BELOW rows up,
+        smaller counts are cheap and estimated badly, and never on a table
+        without statistics or on other databases.
+        """
+        logger.info("Processing %s count of Wishlists matching %s", "estimated" if estimated else "exact", criteria)
+        if estimated and db.engine.dialect.name == "postgresql":
+            estimate = cls._estimated_rows(cls._criteria_conditions(criteria))
+            if estimate >= EXACT_COUNT_BELOW:
+                return estimate
+        parameters = cls._criteria_parameters(criteria)
+        statement = listing_statement(
+            ("wishlist_count", *sorted(parameters)),
+            lambda: select(func.count()).select_from(cls).where(*cls._criteria_clauses(parameters)),
+        )
+        return db.session.execute(statement, parameters).scalar_one()
+
+    @classmethod
+    def _estimated_rows(cls, conditions: list) -> int:
+        """Returns the planner's idea of the rows matching, -1 without statistics"""
+        reltuples = db.session.execute(
+            text("SELECT reltuples FROM pg_class WHERE oid = CAST(:table AS regclass)"),
+            {"table": cls.__tablename__},
+        ).scalar()
+        if reltuples is None or reltuples < 0:  # never analyzed
+            return -1
+        if not conditions:
+            return int(reltuples)
+        compiled = select(cls.id).where(*conditions).compile(db.engine)
+        plan = db.session.connection().exec_driver_sql(
+            "EXPLAIN (FORMAT JSON) " + str(compiled), compiled.params
+        ).scalar()
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+    @classmethod
+    def listing_sort(cls, criteria: dict, sort=None) -> list:
+        """Returns the sort keys of a listing, the largest first when it is
+        filtered by size and by id otherwise unless sort names others
+
+        The keys are checked here, a streamed listing sends its status
+        before it runs the query."""
+        if sort:
+            cls.sort_columns(sort)
+            return list(sort)
+        if criteria.get("min_items") is not None or criteria.get("max_items") is not None:
+            return ["-product_count"]
+        return []
+
+    @classmethod
+    def counter_mismatches(cls):
+        """Returns the ids of Wishlists whose counters disagree with their products"""
+        counted, summed = cls._counter_subqueries()
+        query = select(cls.id).where(
+            (cls.product_count != counted) | (cls.total_quantity != summed)
+        )
+        return db.session.execute(query.order_by(cls.id)).scalars().all()
+
+    @classmethod
+    def rebuild_counters(cls, connection=None):
+        """Recomputes the counters of every Wishlist from its products
+
+        Args:
+            connection: runs in the transaction of this connection instead
+                of committing the session
+
+        Returns:
+            int: the number of Wishlists that had to be corrected
+        """
+        logger.info("Rebuilding wishlist counters")
+        counted, summed = cls._counter_subqueries()
+        statement = (
+            cls.__table__.update()
+            .where((cls.product_count != counted) | (cls.total_quantity != summed))
+            .values(product_count=counted, total_quantity=summed)
+        )
+        if connection is not None:
+            result = connection.execute(statement)
+            install_counter_triggers(connection)
+            return result.rowcount
+        result = db.session.execute(statement)
+        install_counter_triggers(db.session.connection())
+        db.session.commit()
+        return result.rowcount
+
+    @classmethod
+    def _counter_subqueries(cls):
+        """Correlated subqueries counting the products of each Wishlist"""
+        products = Product.__table__
+        counted = (
+            select(func.count(products.c.id))
+            .where(products.c.wishlist_id == cls.id)
+            .scalar_subquery()
+        )
+        summed = (
+            select(func.coalesce(func.sum(products.c.quantity), 0))
+            .where(products.c.wishlist_id == cls.id)
+            .scalar_subquery()
+        )
+        return counted, summed
+
     @classmethod
     def find_by_name(cls, name):
         """Returns all Wishlists with the given name
@@ -228,7 +1156,7 @@ class Wishlist(db.Model, PersistentBase):
             name (string): the name of the Wishlists you want to match
         """
         logger.info("Processing name query for %s ...", name)
-        return cls.query.filter(cls.name == name)
+        return cls.query.filter(cls.name == name).execution_options(single_flight=True)
 
     @classmethod
     def find_by_owner(cls, owner):
@@ -238,13 +1166,106 @@ class Wishlist(db.Model, PersistentBase):
             owner (string): the owner of the Wishlists you want to match
         """
         logger.info("Processing name query for %s ...", owner)
-        return cls.query.filter(cls.owner == owner)
+        return cls.query.filter(cls.owner == owner).execution_options(single_flight=True)
 
     @classmethod
     def find(cls, by_id):
-        """Finds a Wishlist by its id"""
+        """Finds a Wishlist by its id
+
+        The identity map is looked at first, and SQLAlchemy keeps the load
+        statement of get() built and compiled already
+        """
         logger.info("Processing lookup for Wishlist with id %s ...", by_id)
-        return cls.query.get(by_id)
+        return db.session.get(cls, by_id, execution_options={"single_flight": True})
+
+    @classmethod
+    def delete_matching(cls, criteria: dict, chunk_size=BULK_DELETE_CHUNK):
+        """Deletes every Wishlist that matches the criteria with their products
+
+        Each chunk is one DELETE statement in its own transaction, even
+        inside a unit of work, so locks are held briefly however many rows
+        match. Products go with the
+        cascade of the foreign key.
+
+        Args:
+            criteria (dict): any of ids, owner, name, start and end,
+                an empty dict matches every Wishlist
+            chunk_size (int): the most Wishlists removed by one statement
+
+        Returns:
+            int: the number of Wishlists removed
+        """
+        logger.info("Processing bulk delete of Wishlists matching %s", criteria)
+        matching = (
+            select(cls.id)
+            .where(*cls._criteria_conditions(criteria))
+            .order_by(cls.id)
+            .limit(chunk_size)
+            .scalar_subquery()
+        )
+        deleted = 0
+        while True:
+            stale = []
+            if product_names.built:
+                stale = db.session.scalars(
+                    select(Product.id).where(Product.wishlist_id.in_(matching))
+                ).all()
+            result = db.session.execute(
+                cls.__table__.delete().where(cls.id.in_(matching))
+            )
+            db.session.commit()
+            for key in stale:
+                product_names.remove(key)
+            deleted += result.rowcount
+            if result.rowcount < chunk_size:
+                return deleted
+
+    @classmethod
+    def _criteria_conditions(cls, criteria: dict) -> list:
+        parameters = cls._criteria_parameters(criteria)
+        return cls._criteria_clauses(parameters, parameters.get)
+
+    @classmethod
+    def _criteria_parameters(cls, criteria: dict) -> dict:
+        """Returns the values of the criteria by the names _criteria_clauses
+        gives their bind parameters"""
+        start, end = criteria.get("start"), criteria.get("end")
+        if start and end and start > end:
+            raise DataValidationError(
+                "Invalid Date: start date should be smaller than end date"
+            )
+        parameters = {
+            "ids": criteria.get("ids"),
+            "owner": criteria.get("owner") or None,
+            "name": criteria.get("name") or None,
+        }
+        if criteria.get("name_prefix"):
+            parameters.update(prefix_parameters(criteria["name_prefix"]))
+        parameters.update(
+            start=start or None,
+            end=end or None,
+            min_items=criteria.get("min_items"),
+            max_items=criteria.get("max_items"),
+        )
+        return {key: value for key, value in parameters.items() if value is not None}
+
+    @classmethod
+    def _criteria_clauses(cls, parameters, value=bindparam) -> list:
+        """Returns the conditions of the criteria for the names of
+        _criteria_parameters, with bind parameters in place of the values
+        unless value looks them up"""
+        comparisons = {
+            "ids": lambda: cls.id.in_(value("ids")),
+            "owner": lambda: cls.owner == value("owner"),
+            "name": lambda: cls.name == value("name"),
+            "start": lambda: cls.date_joined >= value("start"),
+            "end": lambda: cls.date_joined <= value("end"),
+            "min_items": lambda: cls.product_count >= value("min_items"),
+            "max_items": lambda: cls.product_count <= value("max_items"),
+        }
+        conditions = [comparisons[key]() for key in ("ids", "owner", "name") if key in parameters]
+        conditions += prefix_clauses(cls.name, parameters, value)
+        return conditions + [comparisons[key]() for key in ("start", "end", "min_items", "max_items") if key in parameters]
 
     @classmethod
     def filter_by_date(cls, start=None, end=None):
@@ -260,11 +1281,967 @@ class Wishlist(db.Model, PersistentBase):
                 raise DataValidationError(
                     "Invalid Date: start date should be smaller than end date"
                 )
-            return cls.query.filter(
+            query = cls.query.filter(
                 and_(cls.date_joined <= end, cls.date_joined >= start)
             )
-        if start:
-            return cls.query.filter(cls.date_joined >= start)
-        if end:
-            return cls.query.filter(cls.date_joined <= end)
-        return cls.all()
+        elif start:
+            query = cls.query.filter(cls.date_joined >= start)
+        elif end:
+            query = cls.query.filter(cls.date_joined <= end)
+        else:
+            return cls.all()
+        return query.execution_options(single_flight=True)
+
+
+######################################################################
+#  R E A D - O N L Y   R O W S
+######################################################################
+class ProductRow(NamedTuple):
+    """A Product read for a listing, a plain tuple that serializes like one"""
+
+    id: int
+    wishlist_id: int
+    name: str
+    quantity: int
+
+    @staticmethod
+    def columns() -> list:
+        """Returns the columns a ProductRow is made of, in order"""
+        return [Product.id, Product.wishlist_id, Product.name, Product.quantity]
+
+    def serialize(self) -> dict:
+        """Converts a ProductRow into a dictionary"""
+        return self._asdict()
+
+    def sort_values(self, sort: list) -> list:
+        """Returns the values of the sort columns as JSON values"""
+        return Product.cursor_of(self, sort)
+
+
+class WishlistRow(NamedTuple):
+    """A Wishlist read for a listing with its ProductRows, a plain tuple
+    that serializes like one"""
+
+    id: int
+    name: str
+    date_joined: date
+    owner: str
+    product_count: int
+    total_quantity: int
+    products: list
+
+    @staticmethod
+    def columns() -> list:
+        """Returns the columns a WishlistRow is made of, in order, but the products"""
+        return [
+            Wishlist.id, Wishlist.name, Wishlist.date_joined, Wishlist.owner,
+            Wishlist.product_count, Wishlist.total_quantity,
+        ]
+
+    def serialize(self) -> dict:
+        """Converts a WishlistRow into a dictionary"""
+        return {
+            "id": self.id,
+            "name": self.name,
+            "date_joined": self.date_joined.isoformat(),
+            "products": [product.serialize() for product in self.products],
+            "owner": self.owner,
+            "product_count": self.product_count,
+            "total_quantity": self.total_quantity,
+        }
+
+    def sort_values(self, sort: list) -> list:
+        """Returns the values of the sort columns as JSON values"""
+        return Wishlist.cursor_of(self, sort)
+
+
+######################################################################
+#  C H A N G E   F E E D
+######################################################################
+class RecordChange(db.Model):  # pylint: disable=too-few-public-methods
+    """
+    The last change of a Wishlist or a Product, a tombstone once it is deleted
+
+    The triggers of CHANGE_TRIGGERS write a row per record on every insert,
+    update and delete, so there is one row per record however often it
+    changes. seq grows with every change. On PostgreSQL txid is the id of
+    the writing transaction; a reader only takes the changes of the
+    transactions older than every one still running, so a change that
+    commits late is never behind a cursor already handed out. SQLite has a
+    single writer and txid is always 0.
+    """
+
+    __tablename__ = "record_change"
+    # The feed reads the changes in this order from a cursor
+    __table_args__ = (db.Index("ix_record_change_txid_seq", "txid", "seq"),)
+
+    WISHLIST = "wishlist"
+    PRODUCT = "product"
+
+    kind = db.Column(db.String(16), primary_key=True)
+    record_id = db.Column(db.Integer, primary_key=True)
+    wishlist_id = db.Column(db.Integer, nullable=False)
+    deleted = db.Column(db.Boolean, nullable=False, default=False)
+    txid = db.Column(db.BigInteger, nullable=False)
+    seq = db.Column(db.BigInteger, nullable=False)
+    changed_at = db.Column(db.DateTime(timezone=True), nullable=False)
+
+    @classmethod
+    def find_after(cls, after=None, limit=100) -> list:
+        """Returns the ChangeRows following a cursor in the order they were committed
+
+        Args:
+            after (list): the [txid, seq] of the last change already seen
+            limit (int): the most changes to return
+        """
+        logger.info("Processing change query after %s", after)
+        statement = cls._committed(select(cls), cls.cursor_values(after) if after is not None else None)
+        changes = db.session.execute(statement.order_by(cls.txid, cls.seq).limit(limit)).scalars().all()
+
+        records = {}
+        ids = [change.record_id for change in changes if change.kind == cls.WISHLIST and not change.deleted]
+        if ids:
+            records.update(((cls.WISHLIST, row.id), row) for row in Wishlist.find_rows({"ids": ids}))
+        ids = [change.record_id for change in changes if change.kind == cls.PRODUCT and not change.deleted]
+        for start in range(0, len(ids), ROW_CHUNK):
+            found = db.session.execute(
+                select(*ProductRow.columns()).where(Product.id.in_(ids[start:start + ROW_CHUNK]))
+            ).all()
+            records.update(((cls.PRODUCT, row.id), ProductRow(*row)) for row in found)
+        # a record gone without its tombstone in sight yet is deleted all the same
+        return [
+            ChangeRow(
+                change.kind, change.record_id, change.wishlist_id, (change.kind, change.record_id) not in records,
+                change.changed_at, change.txid, change.seq, records.get((change.kind, change.record_id)),
+            )
+            for change in changes
+        ]
+
+    @classmethod
+    def last_position(cls):
+        """Returns the [txid, seq] of the last change a reader can take, None
+        when there is none"""
+        statement = cls._committed(select(cls.txid, cls.seq), None)
+        row = db.session.execute(statement.order_by(cls.txid.desc(), cls.seq.desc()).limit(1)).first()
+        return None if row is None else list(row)
+
+    @classmethod
+    def product_changes(cls, after=None) -> list:
+        """Returns the (record_id, deleted, txid, seq) of the changes of
+        Products following a cursor, without reading the Products"""
+        statement = cls._committed(select(cls.record_id, cls.deleted, cls.txid, cls.seq), after)
+        return db.session.execute(statement.where(cls.kind == cls.PRODUCT).order_by(cls.txid, cls.seq)).all()
+
+    @classmethod
+    def _committed(cls, statement, after):
+        """Narrows a statement to the changes after a cursor that a reader
+        can take"""
+        if after is not None:
+            statement = statement.where(keyset_condition([(cls.txid, False), (cls.seq, False)], after))
+        if db.engine.dialect.name == "postgresql":
+            statement = statement.where(cls.txid < text("pg_snapshot_xmin(pg_current_snapshot())::text::bigint"))
+        return statement
+
+    @staticmethod
+    def cursor_values(after) -> list:
+        """Returns the [txid, seq] of a cursor or raises DataValidationError"""
+        if not isinstance(after, list) or len(after) != 2 or not all(
+            isinstance(value, int) and not isinstance(value, bool) for value in after
+        ):
+            raise DataValidationError("Invalid cursor: it is not a position in the change feed")
+        return after
+
+
+class ChangeRow(NamedTuple):
+    """A change of the feed with the record as it is now, None once deleted"""
+
+    kind: str
+    id: int
+    wishlist_id: int
+    deleted: bool
+    changed_at: datetime
+    txid: int
+    seq: int
+    record: object
+
+    def serialize(self) -> dict:
+        """Converts a ChangeRow into a dictionary"""
+        return {
+            "kind": self.kind,
+            "id": self.id,
+            "wishlist_id": self.wishlist_id,
+            "deleted": self.deleted,
+            "changed_at": self.changed_at,
+            self.kind: self.record.serialize() if self.record else None,
+        }
+
+    def sort_values(self, sort: list) -> list:  # pylint: disable=unused-argument
+        """Returns the position of the change in the feed"""
+        return [self.txid, self.seq]
+
+
+######################################################################
+#  W I S H L I S T   D O C U M E N T   M O D E L
+######################################################################
+class WishlistDocument(db.Model):  # pylint: disable=too-few-public-methods
+    """
+    A Wishlist stored as one JSON document with its Products embedded
+
+    The body holds name, owner, date_joined, updated_at and the list of
+    products, each with its id, name, quantity and updated_at. Listings
+    filter and sort on the expressions of DOCUMENT_FIELDS, which have
+    expression indexes, see DOCUMENT_INDEXES.
+    """
+
+    __tablename__ = "wishlist_document"
+
+    id = db.Column(db.Integer, primary_key=True)
+    body = db.Column(db.JSON().with_variant(postgresql.JSONB(), "postgresql"), nullable=False)
+
+
+class DocumentCounter(db.Model):  # pylint: disable=too-few-public-methods
+    """The last id given to an embedded Product, on databases without sequences"""
+
+    __tablename__ = "document_counter"
+
+    name = db.Column(db.String(32), primary_key=True)
+    value = db.Column(db.Integer, nullable=False)
+
+
+# PostgreSQL hands out the ids of embedded Products from a sequence, which
+# unlike a counter row is never locked until the end of a transaction
+document_product_ids = db.Sequence("document_product_id_seq", metadata=db.metadata)
+
+# The SQL of the document members a listing filters and sorts on, written out
+# so that queries repeat the expressions of the indexes to the letter
+DOCUMENT_FIELDS = {
+    "postgresql": {
+        "name": "(body ->> 'name')",
+        "owner": "(body ->> 'owner')",
+        "date_joined": "(body ->> 'date_joined')",
+        "product_count": "jsonb_array_length(body -> 'products')",
+        "product_names": "lower(jsonb_path_query_array(body, '$.products[*].name')::text)",
+    },
+    "sqlite": {
+        "name": "json_extract(body, '$.name')",
+        "owner": "json_extract(body, '$.owner')",
+        "date_joined": "json_extract(body, '$.date_joined')",
+        "product_count": "json_array_length(body, '$.products')",
+        "product_names": "lower(json_extract(body, '$.products'))",
+    },
+}
+
+
+######################################################################
+#  J O B   M O D E L
+######################################################################
+def utcnow():
+    """Returns the current time in UTC"""
+    return datetime.now(timezone.utc)
+
+
+class Job(db.Model):  # pylint: disable=too-many-instance-attributes
+    """
+    A long running operation done in the background
+
+    The row is the whole state of the job: workers claim queued rows, write
+    their progress and a checkpoint as they go, and another worker resumes
+    from the checkpoint when the heartbeat of a running job goes stale.
+    Its methods always commit, even inside a unit of work, since workers
+    in other processes have to see the row.
+    """
+
+    __tablename__ = "job"
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+    FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+    # Table Schema
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(32), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default=QUEUED, index=True)
+    params = db.Column(db.JSON, nullable=False, default=dict)
+    checkpoint = db.Column(db.JSON, nullable=False, default=dict)
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer)
+    result = db.Column(db.JSON)
+    error = db.Column(db.Text)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    worker = db.Column(db.String(64))
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=utcnow)
+    heartbeat_at = db.Column(db.DateTime(timezone=True))
+    finished_at = db.Column(db.DateTime(timezone=True))
+
+    # The (worker, attempts) of the claim this instance runs under, see hold
+    claimed_as = None
+
+    def __repr__(self):
+        return f"<Job {self.kind} id=[{self.id}] {self.status}>"
+
+    def serialize(self) -> dict:
+        """Converts a Job into a dictionary"""
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": self.progress,
+            "total": self.total,
+            "result": self.result,
+            "error": self.error,
+            "attempts": self.attempts,
+            "cancel_requested": self.cancel_requested,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+    @classmethod
+    def submit(cls, kind, params, total=None):
+        """Queues a new Job and returns it"""
+        logger.info("Queueing %s job", kind)
+        job = cls(kind=kind, params=params, total=total, checkpoint={})
+        db.session.add(job)
+        db.session.commit()
+        return job
+
+    @classmethod
+    def find(cls, by_id):
+        """Finds a Job by its id"""
+        logger.info("Processing lookup for Job with id %s ...", by_id)
+        return db.session.get(cls, by_id)
+
+    @classmethod
+    def claim(cls, worker, stale_after):
+        """Takes the oldest queued Job, or a running one whose worker died
+
+        The status and heartbeat read are checked again by the UPDATE, so two
+        workers racing for the same row cannot both win it.
+
+        Returns:
+            Job: the claimed Job or None when there is nothing to do
+        """
+        stale = utcnow() - timedelta(seconds=stale_after)
+        candidates = db.session.execute(
+            select(cls.id, cls.status, cls.heartbeat_at)
+            .where(
+                (cls.status == cls.QUEUED)
+                | ((cls.status == cls.RUNNING) & (cls.heartbeat_at < stale))
+            )
+            .order_by(cls.id)
+            .limit(5)
+        ).all()
+        for job_id, seen_status, seen_heartbeat in candidates:
+            heartbeat = (
+                cls.heartbeat_at.is_(None) if seen_heartbeat is None else cls.heartbeat_at == seen_heartbeat
+            )
+            claimed = db.session.execute(
+                cls.__table__.update()
+                .where(cls.id == job_id, cls.status == seen_status, heartbeat)
+                .values(
+                    status=cls.RUNNING,
+                    worker=worker,
+                    heartbeat_at=utcnow(),
+                    attempts=cls.attempts + 1,
+                )
+            ).rowcount
+            db.session.commit()
+            if claimed:
+                logger.info("Worker %s claimed Job %s", worker, job_id)
+                job = cls.find(job_id)
+                job.hold()
+                return job
+        return None
+
+    def hold(self):
+        """Remembers the claim the Job runs under
+
+        A stale heartbeat lets another worker claim the Job while this one
+        is still alive. The progress and the outcome are only written while
+        the row still carries the worker and attempt of this claim.
+        """
+        self.claimed_as = (self.worker, self.attempts)
+
+    def _write(self, **values):
+        """Writes values to the row of the Job if the claim is still its own
+
+        Returns:
+            bool: whether cancellation was requested
+
+        Raises:
+            JobLost: when another worker has claimed the Job since, after
+                rolling back the work that was not committed
+        """
+        worker, attempts = self.claimed_as
+        cancel_requested = db.session.execute(
+            Job.__table__.update()
+            .where(Job.id == self.id, Job.status == self.RUNNING, Job.worker == worker, Job.attempts == attempts)
+            .values(**values)
+            .returning(Job.cancel_requested)
+        ).scalar()
+        if cancel_requested is None:
+            db.session.rollback()
+            raise JobLost(f"Job {self.id} was claimed by another worker")
+        db.session.commit()
+        return cancel_requested
+
+    def save_progress(self, progress, checkpoint=None, total=None):
+        """Records progress and the checkpoint to resume from
+
+        Commits the session, so the work done since the last call is saved
+        in the same transaction as the checkpoint that covers it.
+
+        Raises:
+            JobCancelled: when the cancellation of the Job was requested
+            JobLost: when another worker has claimed the Job since
+        """
+        values = {"progress": progress, "heartbeat_at": utcnow()}
+        if checkpoint is not None:
+            values["checkpoint"] = checkpoint
+        if total is not None:
+            values["total"] = total
+        if self._write(**values):
+            raise JobCancelled(f"Job {self.id} was cancelled")
+
+    def finish(self, result):
+        """Marks the Job as done with its result"""
+        self._end(self.SUCCEEDED, result=result)
+
+    def fail(self, error):
+        """Marks the Job as failed"""
+        self._end(self.FAILED, error=str(error))
+
+    def cancel(self):
+        """Cancels a queued Job now, or asks a running one to stop
+
+        Returns:
+            bool: False when the Job had already finished
+        """
+        if self.status in self.FINISHED:
+            return False
+        logger.info("Cancelling Job %s", self.id)
+        # only a job that nobody has claimed yet can be cancelled right away
+        cancelled = db.session.execute(
+            Job.__table__.update()
+            .where(Job.id == self.id, Job.status == self.QUEUED)
+            .values(status=self.CANCELLED, cancel_requested=True, finished_at=utcnow())
+        ).rowcount
+        if not cancelled:
+            self.cancel_requested = True
+        db.session.commit()
+        return True
+
+    def _end(self, final_status, result=None, error=None):
+        logger.info("Job %s %s", self.id, final_status)
+        self._write(status=final_status, result=result, error=error, finished_at=utcnow())
+
+
+######################################################################
+#  F I N D E R   C O A L E S C I N G
+######################################################################
+# Compiled SQL of the coalesced statements, keyed by their structure
+_statement_keys = {}
+
+
+@event.listens_for(Session, "do_orm_execute")
+def coalesce_finders(orm_execute_state):
+    """Shares one execution between identical finder queries in flight
+
+    The statement runs in a private session, its frozen result is then
+    merged into the session of every caller without further SQL, so each
+    gets its own instances. Sessions holding changes that are not committed
+    run their queries alone, they must see their own writes; the writes
+    issued as statements are marked here, they are never flushed.
+    """
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info["uncommitted"] = True
+        return None
+    options = orm_execute_state.execution_options
+    if not orm_execute_state.is_select or not options.get("single_flight"):
+        return None
+    session = orm_execute_state.session
+    if session.info.get("uncommitted") or session.new or session.dirty or session.deleted:
+        return None
+    statement = orm_execute_state.statement
+    parameters = orm_execute_state.parameters or {}
+    key = statement._generate_cache_key().to_offline_string(  # pylint: disable=protected-access
+        _statement_keys, statement, parameters
+    )
+
+    def execute():
+        with Session(db.engine) as private:
+            result = private.execute(
+                statement,
+                parameters,
+                execution_options={"single_flight": False},
+                bind_arguments=orm_execute_state.bind_arguments,
+            )
+            return result.freeze()
+
+    frozen = finder_flight.do(key, execute)
+    return merge_frozen_result(session, statement, frozen, load=False)()
+
+
+@event.listens_for(Session, "after_flush")
+def mark_uncommitted(session, flush_context):  # pylint: disable=unused-argument
+    """Remembers that the session has written rows it has not committed"""
+    session.info["uncommitted"] = True
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def clear_uncommitted(session):
+    """Forgets the writes once the transaction has ended"""
+    session.info.pop("uncommitted", None)
+
+
+######################################################################
+#  S Q L I T E   F O R E I G N   K E Y S
+######################################################################
+@event.listens_for(Engine, "connect")
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):  # pylint: disable=unused-argument
+    """Makes SQLite honour ON DELETE CASCADE like PostgreSQL does"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+
+######################################################################
+#  C O U N T E R   T R I G G E R S
+######################################################################
+# The database keeps Wishlist.product_count and Wishlist.total_quantity in
+# step with every insert, update and delete of a product, including the ones
+# issued as plain SQL statements that never go through the ORM.
+COUNTER_TRIGGERS = {
+    "postgresql": [
+        """
+        CREATE OR REPLACE FUNCTION product_counters() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                UPDATE wishlist
+                SET product_count = product_count - 1,
+                    total_quantity = total_quantity - COALESCE(OLD.quantity, 0),
+                    updated_at = now()
+                WHERE id = OLD.wishlist_id;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                UPDATE wishlist
+                SET product_count = product_count + 1,
+                    total_quantity = total_quantity + COALESCE(NEW.quantity, 0),
+                    updated_at = now()
+                WHERE id = NEW.wishlist_id;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS product_counters ON product",
+        """
+        CREATE TRIGGER product_counters
+        AFTER INSERT OR DELETE OR UPDATE OF wishlist_id, quantity ON product
+        FOR EACH ROW EXECUTE FUNCTION product_counters()
+        """,
+    ],
+    "sqlite": [
+        "DROP TRIGGER IF EXISTS product_counters_insert",
+        """
+        CREATE TRIGGER product_counters_insert AFTER INSERT ON product
+        BEGIN
+            UPDATE wishlist
+            SET product_count = product_count + 1,
+                total_quantity = total_quantity + COALESCE(NEW.quantity, 0),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = NEW.wishlist_id;
+        END
+        """,
+        "DROP TRIGGER IF EXISTS product_counters_update",
+        """
+        CREATE TRIGGER product_counters_update
+        AFTER UPDATE OF wishlist_id, quantity ON product
+        BEGIN
+            UPDATE wishlist
+            SET product_count = product_count - 1,
+                total_quantity = total_quantity - COALESCE(OLD.quantity, 0),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = OLD.wishlist_id;
+            UPDATE wishlist
+            SET product_count = product_count + 1,
+                total_quantity = total_quantity + COALESCE(NEW.quantity, 0),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = NEW.wishlist_id;
+        END
+        """,
+        "DROP TRIGGER IF EXISTS product_counters_delete",
+        """
+        CREATE TRIGGER product_counters_delete AFTER DELETE ON product
+        BEGIN
+            UPDATE wishlist
+            SET product_count = product_count - 1,
+                total_quantity = total_quantity - COALESCE(OLD.quantity, 0),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = OLD.wishlist_id;
+        END
+        """,
+    ],
+}
+
+
+def install_counter_triggers(connection):
+    """Creates or replaces the counter triggers on the product table"""
+    statements = COUNTER_TRIGGERS.get(connection.dialect.name)
+    if not statements:
+        logger.warning(
+            "No counter triggers for %s, run flask db-counters after writes",
+            connection.dialect.name,
+        )
+        return
+    for statement in statements:
+        connection.exec_driver_sql(statement)
+
+
+# Every insert, update and delete of a wishlist or a product, through the
+# ORM or as plain SQL, records the last change of the row in record_change;
+# {table} is formatted with the table, the kind of record and the column
+# holding the id of its wishlist
+CHANGE_TRIGGERS = {
+    "postgresql": [
+        "CREATE SEQUENCE IF NOT EXISTS record_change_seq",
+        """
+        CREATE OR REPLACE FUNCTION {table}_changes() RETURNS trigger AS $$
+        DECLARE
+            changed RECORD;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                changed := OLD;
+            ELSE
+                changed := NEW;
+            END IF;
+            INSERT INTO record_change (kind, record_id, wishlist_id, deleted, txid, seq, changed_at)
+            VALUES ('{kind}', changed.id, changed.{wishlist_id}, TG_OP = 'DELETE',
+                    pg_current_xact_id()::text::bigint, nextval('record_change_seq'), now())
+            ON CONFLICT (kind, record_id) DO UPDATE
+            SET wishlist_id = EXCLUDED.wishlist_id, deleted = EXCLUDED.deleted,
+                txid = EXCLUDED.txid, seq = EXCLUDED.seq, changed_at = EXCLUDED.changed_at;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS {table}_changes ON {table}",
+        """
+        CREATE TRIGGER {table}_changes AFTER INSERT OR UPDATE OR DELETE ON {table}
+        FOR EACH ROW EXECUTE FUNCTION {table}_changes()
+        """,
+    ],
+    "sqlite": [
+        "DROP TRIGGER IF EXISTS {table}_changes_insert",
+        """
+        CREATE TRIGGER {table}_changes_insert AFTER INSERT ON {table}
+        BEGIN
+            INSERT INTO record_change (kind, record_id, wishlist_id, deleted, txid, seq, changed_at)
+            SELECT '{kind}', NEW.id, NEW.{wishlist_id}, 0, 0, COALESCE(MAX(seq), 0) + 1, CURRENT_TIMESTAMP
+            FROM record_change WHERE txid = 0
+            ON CONFLICT (kind, record_id) DO UPDATE
+            SET wishlist_id = excluded.wishlist_id, deleted = excluded.deleted,
+                seq = excluded.seq, changed_at = excluded.changed_at;
+        END
+        """,
+        "DROP TRIGGER IF EXISTS {table}_changes_update",
+        """
+        CREATE TRIGGER {table}_changes_update AFTER UPDATE ON {table}
+        BEGIN
+            INSERT INTO record_change (kind, record_id, wishlist_id, deleted, txid, seq, changed_at)
+            SELECT '{kind}', NEW.id, NEW.{wishlist_id}, 0, 0, COALESCE(MAX(seq), 0) + 1, CURRENT_TIMESTAMP
+            FROM record_change WHERE txid = 0
+            ON CONFLICT (kind, record_id) DO UPDATE
+            SET wishlist_id = excluded.wishlist_id, deleted = excluded.deleted,
+                seq = excluded.seq, changed_at = excluded.changed_at;
+        END
+        """,
+        "DROP TRIGGER IF EXISTS {table}_changes_delete",
+        """
+        CREATE TRIGGER {table}_changes_delete AFTER DELETE ON {table}
+        BEGIN
+            INSERT INTO record_change (kind, record_id, wishlist_id, deleted, txid, seq, changed_at)
+            SELECT '{kind}', OLD.id, OLD.{wishlist_id}, 1, 0, COALESCE(MAX(seq), 0) + 1, CURRENT_TIMESTAMP
+            FROM record_change WHERE txid = 0
+            ON CONFLICT (kind, record_id) DO UPDATE
+            SET wishlist_id = excluded.wishlist_id, deleted = excluded.deleted,
+                seq = excluded.seq, changed_at = excluded.changed_at;
+        END
+        """,
+    ],
+}
+
+
+def install_change_triggers(connection):
+    """Creates or replaces the triggers recording the changes of wishlists and products"""
+    statements = CHANGE_TRIGGERS.get(connection.dialect.name)
+    if not statements:
+        logger.warning("No change triggers for %s, the change feed stays empty", connection.dialect.name)
+        return
+    for table, kind, wishlist_id in (
+        ("wishlist", RecordChange.WISHLIST, "id"), ("product", RecordChange.PRODUCT, "wishlist_id")
+    ):
+        for statement in statements:
+            connection.exec_driver_sql(statement.format(table=table, kind=kind, wishlist_id=wishlist_id))
+
+
+# Records the wishlists and products that have no change yet, the ones
+# written before the triggers were installed; {table} is formatted like above
+CHANGE_BACKFILL = {
+    "postgresql": """
+        INSERT INTO record_change (kind, record_id, wishlist_id, deleted, txid, seq, changed_at)
+        SELECT '{kind}', id, owner_id, false, pg_current_xact_id()::text::bigint,
+               nextval('record_change_seq'), now()
+        FROM (SELECT id, {wishlist_id} AS owner_id FROM {table} ORDER BY id) AS existing
+        ON CONFLICT (kind, record_id) DO NOTHING
+        """,
+    "sqlite": """
+        INSERT INTO record_change (kind, record_id, wishlist_id, deleted, txid, seq, changed_at)
+        SELECT '{kind}', id, {wishlist_id}, 0, 0,
+               (SELECT COALESCE(MAX(seq), 0) FROM record_change WHERE txid = 0)
+               + row_number() OVER (ORDER BY id), CURRENT_TIMESTAMP
+        FROM {table} WHERE true
+        ON CONFLICT (kind, record_id) DO NOTHING
+        """,
+}
+
+
+def backfill_changes(connection) -> int:
+    """Records the wishlists and products missing from the change feed as
+    changed now, and returns how many there were"""
+    statement = CHANGE_BACKFILL.get(connection.dialect.name)
+    if not statement:
+        return 0
+    recorded = 0
+    for table, kind, wishlist_id in (
+        ("wishlist", RecordChange.WISHLIST, "id"), ("product", RecordChange.PRODUCT, "wishlist_id")
+    ):
+        result = connection.exec_driver_sql(statement.format(table=table, kind=kind, wishlist_id=wishlist_id))
+        recorded += result.rowcount
+    return recorded
+
+
+@event.listens_for(Wishlist.__table__, "after_create")
+def _create_name_pattern_index(target, connection, **kwargs):  # pylint: disable=unused-argument
+    if connection.dialect.name == "postgresql":
+        connection.exec_driver_sql(
+            "CREATE INDEX IF NOT EXISTS ix_wishlist_name_pattern "
+            "ON wishlist (name varchar_pattern_ops)"
+        )
+
+
+@event.listens_for(Product.__table__, "after_create")
+def _create_counter_triggers(target, connection, **kwargs):  # pylint: disable=unused-argument
+    install_counter_triggers(connection)
+    install_trigram_index(connection)
+
+
+# The expression indexes of the document storage; dates are ISO strings in
+# the documents, so their text order is the order of the dates
+DOCUMENT_INDEXES = {
+    "postgresql": [
+        "CREATE INDEX IF NOT EXISTS ix_wishlist_document_owner "
+        "ON wishlist_document (({owner}), ({date_joined}))",
+        "CREATE INDEX IF NOT EXISTS ix_wishlist_document_name ON wishlist_document (({name}))",
+        "CREATE INDEX IF NOT EXISTS ix_wishlist_document_name_pattern "
+        "ON wishlist_document (({name}) text_pattern_ops)",
+        "CREATE INDEX IF NOT EXISTS ix_wishlist_document_date_joined ON wishlist_document (({date_joined}))",
+        "CREATE INDEX IF NOT EXISTS ix_wishlist_document_product_count ON wishlist_document (({product_count}))",
+        # serves the containment lookups of products by id and by name
+        "CREATE INDEX IF NOT EXISTS ix_wishlist_document_products "
+        "ON wishlist_document USING gin ((body -> 'products') jsonb_path_ops)",
+    ],
+    "sqlite": [
+        "CREATE INDEX IF NOT EXISTS ix_wishlist_document_owner "
+        "ON wishlist_document ({owner}, {date_joined})",
+        "CREATE INDEX IF NOT EXISTS ix_wishlist_document_name ON wishlist_document ({name})",
+        "CREATE INDEX IF NOT EXISTS ix_wishlist_document_date_joined ON wishlist_document ({date_joined})",
+        "CREATE INDEX IF NOT EXISTS ix_wishlist_document_product_count ON wishlist_document ({product_count})",
+    ],
+}
+
+
+# after every table, record_change sorts before wishlist and product, and also
+# on a database created before the change feed
+@event.listens_for(db.metadata, "after_create")
+def _create_change_triggers(target, connection, **kwargs):  # pylint: disable=unused-argument
+    install_change_triggers(connection)
+
+
+@event.listens_for(WishlistDocument.__table__, "after_create")
+def _create_document_indexes(target, connection, **kwargs):  # pylint: disable=unused-argument
+    fields = DOCUMENT_FIELDS.get(connection.dialect.name, {})
+    for statement in DOCUMENT_INDEXES.get(connection.dialect.name, []):
+        connection.exec_driver_sql(statement.format(**fields))
+    if connection.dialect.name != "postgresql":
+        return
+    try:
+        with connection.begin_nested():
+            connection.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            connection.exec_driver_sql(
+                "CREATE INDEX IF NOT EXISTS ix_wishlist_document_product_names_trgm "
+                f"ON wishlist_document USING gin (({fields['product_names']}) gin_trgm_ops)"
+            )
+    except DBAPIError as error:
+        logger.warning("pg_trgm is not available, product search scans the documents: %s", error.orig)
+
+
+def dialect_insert():
+    """Returns the insert construct of the database, which knows ON CONFLICT"""
+    name = db.engine.dialect.name
+    if name == "postgresql":
+        return postgresql.insert
+    if name == "sqlite":
+        return sqlite.insert
+    raise NotImplementedError(f"Upserts are not supported on {name}")
+
+
+######################################################################
+#  P R O D U C T   N A M E   S E A R C H
+######################################################################
+_trigram_support = {}
+
+
+def install_trigram_index(connection):
+    """Creates the pg_trgm GIN index on product names where possible"""
+    if connection.dialect.name != "postgresql":
+        return
+    try:
+        with connection.begin_nested():
+            connection.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            connection.exec_driver_sql(
+                "CREATE INDEX IF NOT EXISTS ix_product_name_trgm "
+                "ON product USING gin (name gin_trgm_ops)"
+            )
+    except DBAPIError as error:
+        logger.warning("pg_trgm is not available, using the in-process index: %s", error.orig)
+    _trigram_support.clear()
+
+
+def trigram_search_enabled():
+    """Returns True when the database can search names with pg_trgm"""
+    url = str(db.engine.url)
+    if url not in _trigram_support:
+        enabled = False
+        if db.engine.dialect.name == "postgresql":
+            enabled = bool(
+                db.session.execute(
+                    text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+                ).scalar()
+            )
+        _trigram_support[url] = enabled
+    return _trigram_support[url]
+
+
+@event.listens_for(Product, "after_insert")
+def _index_new_product(mapper, connection, target):  # pylint: disable=unused-argument
+    if product_names.built:
+        product_names.add(target.id, target.name)
+
+
+@event.listens_for(Product, "after_update")
+def _index_renamed_product(mapper, connection, target):  # pylint: disable=unused-argument
+    if product_names.built and inspect(target).attrs.name.history.has_changes():
+        product_names.add(target.id, target.name)
+
+
+@event.listens_for(Product, "after_delete")
+def _unindex_product(mapper, connection, target):  # pylint: disable=unused-argument
+    if product_names.built:
+        product_names.remove(target.id)
+
+
+######################################################################
+#  S C H E M A   U P G R A D E
+######################################################################
+def upgrade_schema(connection) -> list:
+    """Brings a database created by an earlier version up to the models
+
+    create_all only creates the tables that are missing. This also adds the
+    missing columns and indexes of the existing tables, installs the
+    triggers and the indexes that are created with their tables, and puts
+    the records written before the change feed into it. Every step is
+    skipped when it was done already, so it can run again.
+
+    Args:
+        connection: the connection to upgrade in its transaction
+
+    Returns:
+        list: a description of every change made
+    """
+    logger.info("Upgrading the database schema")
+    db.metadata.create_all(connection)
+    changes = []
+    for table in db.metadata.sorted_tables:
+        schema = inspect(connection)
+        present = {column["name"] for column in schema.get_columns(table.name)}
+        with warnings.catch_warnings():
+            # the expression indexes of the documents cannot be reflected, and
+            # they are not among the indexes of the table anyway
+            warnings.simplefilter("ignore", SAWarning)
+            indexes = schema.get_indexes(table.name)
+            unique = schema.get_unique_constraints(table.name)
+        for column in table.columns:
+            if column.name not in present:
+                _add_column(connection, column)
+                changes.append(f"Added column {table.name}.{column.name}")
+        present = {index["name"] for index in indexes}
+        for index in table.indexes:
+            if index.name not in present:
+                index.create(connection)
+                changes.append(f"Created index {index.name}")
+        present.update(constraint["name"] for constraint in unique)
+        for constraint in table.constraints:
+            if isinstance(constraint, db.UniqueConstraint) and constraint.name not in present:
+                _add_unique_constraint(connection, constraint)
+                changes.append(f"Added constraint {constraint.name}")
+    _create_name_pattern_index(Wishlist.__table__, connection)
+    install_trigram_index(connection)
+    fixed = Wishlist.rebuild_counters(connection)
+    if fixed:
+        changes.append(f"Rebuilt the counters of {fixed} wishlists")
+    install_change_triggers(connection)
+    recorded = backfill_changes(connection)
+    if recorded:
+        changes.append(f"Recorded {recorded} wishlists and products in the change feed")
+    return changes
+
+
+def _add_unique_constraint(connection, constraint):
+    """Adds a unique constraint to its table, unless the rows break it"""
+    columns = list(constraint.columns)
+    duplicates = connection.execute(
+        select(*columns, func.count()).group_by(*columns).having(func.count() > 1).limit(10)
+    ).all()
+    if duplicates:
+        raise DataValidationError(
+            f"Cannot add {constraint.name}, these {', '.join(column.name for column in columns)} "
+            f"appear more than once: {[tuple(row[:-1]) for row in duplicates]}"
+        )
+    # SQLite cannot add constraints to a table, a unique index does the same
+    if connection.dialect.name == "sqlite":
+        names = ", ".join(column.name for column in columns)
+        connection.exec_driver_sql(f"CREATE UNIQUE INDEX {constraint.name} ON {constraint.table.name} ({names})")
+    else:
+        connection.execute(AddConstraint(constraint))
+
+
+def _add_column(connection, column):
+    """Adds a column to its table, filling it with its server default"""
+    default = column.server_default
+    # SQLite only adds columns with a constant default
+    if connection.dialect.name == "sqlite" and default is not None and not isinstance(default.arg, str):
+        added = db.Column(column.name, column.type)
+        connection.exec_driver_sql(
+            f"ALTER TABLE {column.table.name} ADD COLUMN {CreateColumn(added).compile(dialect=connection.dialect)}"
+        )
+        connection.execute(column.table.update().values({column.name: default.arg}))
+        return
+    connection.exec_driver_sql(
+        f"ALTER TABLE {column.table.name} ADD COLUMN {CreateColumn(column).compile(dialect=connection.dialect)}"
+    )
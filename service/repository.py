@@ -0,0 +1,366 @@
+"""
+Repository
+
+The storage operations of the routes and the jobs behind one interface.
+SqlRepository keeps the data in the tables of the models,
+DocumentRepository in one JSON document per Wishlist and MemoryRepository
+in the process, STORAGE_BACKEND picks the one the service runs on. Jobs
+stay in the database either way, their rows are how the workers coordinate.
+
+The helpers below are shared by the backends that keep records of their
+own: they page records like ORDER BY and move values between the records
+and the committed state of model instances.
+"""
+from abc import ABC, abstractmethod
+from sqlalchemy import inspect
+from sqlalchemy.orm.attributes import set_committed_value
+from service import app
+from service.models import Product, RecordChange, Wishlist, db, save_changes
+
+# pylint: disable=too-many-arguments, too-many-public-methods
+
+
+class DataConflictError(Exception):
+    """Used when a write breaks a uniqueness or reference rule of the data"""
+
+
+# Columns written from the instances, the others are kept by the repository
+WISHLIST_COLUMNS = ("name", "owner", "date_joined")
+PRODUCT_COLUMNS = ("wishlist_id", "name", "quantity")
+
+
+def as_key(value):
+    """Returns an id, maybe given as a string in a URL, as the int it is
+    stored under, None when it is not one"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def null_first(value):
+    """Sort key putting None before every value, where SQLite puts NULL"""
+    return (value is not None, value)
+
+
+def comes_after(record, columns, values) -> bool:
+    """Tells whether a record sorts after the values of a cursor"""
+    for (column, descending), value in zip(columns, values):
+        mine, theirs = null_first(record[column.key]), null_first(value)
+        if mine != theirs:
+            return mine < theirs if descending else mine > theirs
+    return False
+
+
+def page(model, records, sort, after, limit) -> list:
+    """Sorts records like ORDER BY and returns the ones after a cursor"""
+    columns = model.sort_columns(sort or [])
+    if after is not None:
+        values = model.cursor_values(columns, after)
+        records = [record for record in records if comes_after(record, columns, values)]
+    else:
+        records = list(records)
+    # stable sorts from the last key to the first give the combined order
+    for column, descending in reversed(columns):
+        records.sort(key=lambda record, key=column.key: null_first(record[key]), reverse=descending)
+    return records if limit is None else records[:limit]
+
+
+def load(model, record):
+    """Returns a new instance holding a record as its committed state"""
+    instance = model()
+    commit(instance, record)
+    return instance
+
+
+def commit(instance, record):
+    """Records the values of a record as the committed state of an instance"""
+    for column, value in record.items():
+        set_committed_value(instance, column, value)
+
+
+def changes(instance, columns) -> dict:
+    """Returns the columns of an instance changed since they were committed"""
+    attrs = inspect(instance).attrs
+    return {
+        column: getattr(instance, column)
+        for column in columns
+        if attrs[column].history.has_changes()
+    }
+
+
+class Repository(ABC):
+    """The storage operations on Wishlists and their Products
+
+    The Wishlists and Products returned are model instances, the changes
+    made to them are saved by update_wishlist and update_product.
+    """
+
+    # ------------------------------------------------------------------
+    # W I S H L I S T S
+    # ------------------------------------------------------------------
+    @abstractmethod
+    def find_wishlist(self, wishlist_id):
+        """Returns the Wishlist with an id, None if there is none"""
+
+    @abstractmethod
+    def list_wishlists(self, criteria: dict, sort=None, after=None, limit=None) -> list:
+        """Returns the Wishlists matching the criteria in the order of sort
+
+        Args:
+            criteria (dict): any of ids, owner, name, name_prefix, start, end,
+                min_items and max_items
+            sort (list): sort keys, see Wishlist.listing_sort
+            after (list): the sort values of the last Wishlist of the
+                previous page, to continue after it
+            limit (int): the most Wishlists to return
+        """
+
+    def read_wishlists(self, criteria: dict, sort=None, after=None, limit=None) -> list:
+        """Returns the Wishlists of list_wishlists for a response that only
+        serializes them, as read-only rows where that is cheaper"""
+        return self.list_wishlists(criteria, sort, after, limit)
+
+    def stream_wishlists(self, criteria: dict, sort=None):
+        """Yields the Wishlists of read_wishlists one at a time, for a
+        response that is encoded while they are read"""
+        yield from self.read_wishlists(criteria, sort)
+
+    @abstractmethod
+    def count_wishlists(self, criteria: dict, estimated=False) -> int:
+        """Counts the Wishlists matching the criteria"""
+
+    @abstractmethod
+    def find_by_owner(self, owner) -> list:
+        """Returns the Wishlists of an owner"""
+
+    @abstractmethod
+    def find_by_name(self, name) -> list:
+        """Returns the Wishlists with a name"""
+
+    @abstractmethod
+    def filter_by_date(self, start=None, end=None) -> list:
+        """Returns the Wishlists created between two dates"""
+
+    @abstractmethod
+    def create_wishlist(self, wishlist):
+        """Saves a new Wishlist with its Products and gives them their ids"""
+
+    @abstractmethod
+    def create_wishlists(self, wishlists):
+        """Saves many new Wishlists at once"""
+
+    @abstractmethod
+    def update_wishlist(self, wishlist):
+        """Saves the changes of a Wishlist, Products added to or removed
+        from its list included"""
+
+    @abstractmethod
+    def delete_wishlist(self, wishlist):
+        """Removes a Wishlist with its Products"""
+
+    @abstractmethod
+    def delete_wishlists(self, criteria: dict) -> int:
+        """Removes the Wishlists matching the criteria, returns how many"""
+
+    @abstractmethod
+    def summarize_wishlist(self, wishlist_id):
+        """Returns the aggregate figures of a Wishlist, None if there is none"""
+
+    @abstractmethod
+    def summarize_owner(self, owner) -> dict:
+        """Returns the aggregate figures of the Wishlists of an owner"""
+
+    # ------------------------------------------------------------------
+    # P R O D U C T S
+    # ------------------------------------------------------------------
+    @abstractmethod
+    def find_product(self, product_id):
+        """Returns the Product with an id, None if there is none"""
+
+    @abstractmethod
+    def find_product_in_wishlist(self, wishlist_id, product_id) -> tuple:
+        """Returns whether the Wishlist exists and the Product or None,
+        which it also is for a Product of another Wishlist"""
+
+    @abstractmethod
+    def list_products(self, wishlist_id, name=None, sort=None, after=None, limit=None) -> list:
+        """Returns the Products of a Wishlist in the order of sort
+
+        Args:
+            wishlist_id (int): the Wishlist holding the Products
+            name (string): only the Product with this name
+            sort (list): names of Product.SORTABLE, a leading - sorts descending
+            after (list): the sort values of the last Product of the previous
+                page, to continue after it
+            limit (int): the most Products to return
+        """
+
+    def read_products(self, wishlist_id, name=None, sort=None, after=None, limit=None) -> list:
+        """Returns the Products of list_products for a response that only
+        serializes them, as read-only rows where that is cheaper"""
+        return self.list_products(wishlist_id, name, sort, after, limit)
+
+    @abstractmethod
+    def create_product(self, product):
+        """Saves a new Product and gives it its id"""
+
+    @abstractmethod
+    def create_products(self, products):
+        """Saves many new Products at once"""
+
+    @abstractmethod
+    def update_product(self, product):
+        """Saves the changes of a Product"""
+
+    @abstractmethod
+    def delete_product(self, product):
+        """Removes a Product"""
+
+    @abstractmethod
+    def upsert_product(self, wishlist_id, name, quantity):
+        """Adds a Product by name or adds to its quantity, returns it as a
+        dict or None if the Wishlist is missing"""
+
+    @abstractmethod
+    def adjust_quantity(self, wishlist_id, product_id, delta):
+        """Adds delta to the quantity of a Product, which cannot drop below
+        zero, returns it as a dict or None if nothing was changed"""
+
+    @abstractmethod
+    def search_products(self, term, fuzzy=False, limit=20, offset=0, threshold=0.3) -> list:
+        """Searches the Product names of every Wishlist, see Product.search"""
+
+    def list_changes(self, after=None, limit=100) -> list:
+        """Returns the changes of Wishlists and Products in the order they
+        were committed, each with its record as it is now or as a tombstone
+
+        Args:
+            after (list): the position of the last change already seen
+            limit (int): the most changes to return
+        """
+        raise NotImplementedError(f"The {type(self).__name__} does not record changes")
+
+    @abstractmethod
+    def clear(self):
+        """Removes every Wishlist and Product"""
+
+
+######################################################################
+#  S Q L   R E P O S I T O R Y
+######################################################################
+class SqlRepository(Repository):
+    """Keeps Wishlists and Products in the database through the models
+
+    Writes commit, or only flush inside a unit of work.
+    """
+
+    def find_wishlist(self, wishlist_id):
+        return Wishlist.find(wishlist_id)
+
+    def list_wishlists(self, criteria: dict, sort=None, after=None, limit=None) -> list:
+        query = Wishlist.find_matching(criteria, sort, after)
+        return (query if limit is None else query.limit(limit)).all()
+
+    def read_wishlists(self, criteria: dict, sort=None, after=None, limit=None) -> list:
+        return Wishlist.find_rows(criteria, sort, after, limit)
+
+    def stream_wishlists(self, criteria: dict, sort=None):
+        return Wishlist.stream_rows(criteria, sort)
+
+    def count_wishlists(self, criteria: dict, estimated=False) -> int:
+        return Wishlist.count_matching(criteria, estimated)
+
+    def find_by_owner(self, owner) -> list:
+        return Wishlist.find_by_owner(owner)
+
+    def find_by_name(self, name) -> list:
+        return Wishlist.find_by_name(name)
+
+    def filter_by_date(self, start=None, end=None) -> list:
+        return Wishlist.filter_by_date(start, end)
+
+    def create_wishlist(self, wishlist):
+        wishlist.create()
+
+    def create_wishlists(self, wishlists):
+        db.session.add_all(wishlists)
+        save_changes()
+
+    def update_wishlist(self, wishlist):
+        wishlist.update()
+
+    def delete_wishlist(self, wishlist):
+        wishlist.delete()
+
+    def delete_wishlists(self, criteria: dict) -> int:
+        return Wishlist.delete_matching(criteria)
+
+    def summarize_wishlist(self, wishlist_id):
+        return Wishlist.summarize(wishlist_id)
+
+    def summarize_owner(self, owner) -> dict:
+        return Wishlist.summarize_owner(owner)
+
+    def find_product(self, product_id):
+        return Product.find(product_id)
+
+    def find_product_in_wishlist(self, wishlist_id, product_id) -> tuple:
+        return Product.find_in_wishlist(wishlist_id, product_id)
+
+    def list_products(self, wishlist_id, name=None, sort=None, after=None, limit=None) -> list:
+        query = Product.find_matching(wishlist_id, name, sort, after)
+        return (query if limit is None else query.limit(limit)).all()
+
+    def read_products(self, wishlist_id, name=None, sort=None, after=None, limit=None) -> list:
+        return Product.find_rows(wishlist_id, name, sort, after, limit)
+
+    def create_product(self, product):
+        product.create()
+
+    def create_products(self, products):
+        db.session.add_all(products)
+        save_changes()
+
+    def update_product(self, product):
+        product.update()
+
+    def delete_product(self, product):
+        product.delete()
+
+    def upsert_product(self, wishlist_id, name, quantity):
+        return Product.upsert(wishlist_id, name, quantity)
+
+    def adjust_quantity(self, wishlist_id, product_id, delta):
+        return Product.adjust_quantity(wishlist_id, product_id, delta)
+
+    def search_products(self, term, fuzzy=False, limit=20, offset=0, threshold=0.3) -> list:
+        return Product.search(term, fuzzy=fuzzy, limit=limit, offset=offset, threshold=threshold)
+
+    def list_changes(self, after=None, limit=100) -> list:
+        return RecordChange.find_after(after, limit)
+
+    def clear(self):
+        db.session.query(Product).delete()
+        db.session.query(Wishlist).delete()
+        db.session.query(RecordChange).delete()
+        db.session.commit()
+
+
+def create_repository(kind: str) -> Repository:
+    """Returns a new repository for a STORAGE_BACKEND, sql, document or memory"""
+    # pylint: disable=import-outside-toplevel, cyclic-import
+    if kind == "sql":
+        return SqlRepository()
+    if kind == "document":
+        from service.document_repository import DocumentRepository
+
+        return DocumentRepository()
+    if kind == "memory":
+        from service.memory_repository import MemoryRepository
+
+        return MemoryRepository()
+    raise ValueError(f"Unknown storage backend {kind!r}, use sql, document or memory")
+
+
+repository = create_repository(app.config["STORAGE_BACKEND"])
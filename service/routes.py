@@ -3,14 +3,22 @@ Wishlist Service
 
 Wishlist service for shopping
 """
+# pylint: disable=too-many-lines
+import base64
+import json
 import secrets
 
 # from functools import wraps
-from datetime import date, datetime
-from flask import jsonify, request, abort
-from flask_restx import Resource, fields, reqparse  # , inputs
+from datetime import date
+from flask import Response, jsonify, request, abort, stream_with_context
+from flask_restx import Resource, fields, reqparse, inputs, marshal
 from service.common import status  # HTTP Status Codes
-from service.models import Product, Wishlist
+from service.common import admission, asset_cache, log_handlers
+from service.common.readiness import probe
+from service.common.admission import low_priority
+from service.common.job_runner import runner
+from service.models import DataValidationError, Job, Product, RecordChange, Wishlist, finder_flight
+from service.repository import repository
 
 
 # Import Flask application
@@ -20,12 +28,26 @@ BASE_URL = "/api/wishlists"
 
 
 ############################################################
-# Health Endpoint
+# Health Endpoints
 ############################################################
 @app.route("/health")
 def health():
-    """Health Status"""
-    return (jsonify(status="OK"), status.HTTP_200_OK)
+    """Liveness, answers as long as the process does"""
+    return (
+        jsonify(
+            status="OK",
+            single_flight=finder_flight.stats(),
+            admission=admission.controller.stats(),
+        ),
+        status.HTTP_200_OK,
+    )
+
+
+@app.route("/health/ready")
+def ready():
+    """Readiness, whether this process should be sent traffic"""
+    is_ready, details = probe.check()
+    return jsonify(details), status.HTTP_200_OK if is_ready else status.HTTP_503_SERVICE_UNAVAILABLE
 
 
 ######################################################################
@@ -34,7 +56,7 @@ def health():
 @app.route("/")
 def index():
     """Index page"""
-    return app.send_static_file("index.html")
+    return asset_cache.send_index()
 
 
 # Define the model so that the docs reflect what can be sent
@@ -63,6 +85,26 @@ product_model = api.inherit(
     },
 )
 
+upsert_product_model = api.model(
+    "ProductUpsert",
+    {
+        "name": fields.String(required=True, description="The name of the product"),
+        "quantity": fields.Integer(
+            required=True, min=1, description="The quantity to add to the product"
+        ),
+    },
+)
+
+quantity_change_model = api.model(
+    "QuantityChange",
+    {
+        "amount": fields.Integer(
+            required=True,
+            description="The amount to add to the quantity, negative to take away",
+        ),
+    },
+)
+
 create_wishlist_model = api.model(
     "Wishlist",
     {
@@ -88,6 +130,68 @@ wishlist_model = api.inherit(
             readOnly=True,
             description="The unique id assigned to the wishlist internally by service",
         ),
+        "product_count": fields.Integer(
+            readOnly=True, description="The number of products in the wishlist"
+        ),
+        "total_quantity": fields.Integer(
+            readOnly=True, description="The sum of the quantities of the products"
+        ),
+    },
+)
+
+wishlist_summary_model = api.model(
+    "WishlistSummary",
+    {
+        "id": fields.Integer(description="The id of the wishlist"),
+        "name": fields.String(description="The name of the wishlist"),
+        "owner": fields.String(description="The owner of the wishlist"),
+        "product_count": fields.Integer(description="The number of products"),
+        "total_quantity": fields.Integer(description="The sum of all quantities"),
+        "distinct_product_names": fields.Integer(
+            description="The number of different product names"
+        ),
+        "last_modified": fields.DateTime(
+            description="When the wishlist or one of its products last changed"
+        ),
+    },
+)
+
+change_model = api.model(
+    "Change",
+    {
+        "kind": fields.String(enum=[RecordChange.WISHLIST, RecordChange.PRODUCT], description="What was changed"),
+        "id": fields.Integer(description="The id of the wishlist or product"),
+        "wishlist_id": fields.Integer(description="The id of the wishlist, or of the wishlist of the product"),
+        "deleted": fields.Boolean(description="The record no longer exists"),
+        "changed_at": fields.DateTime(description="When the last change was written"),
+        "wishlist": fields.Nested(wishlist_model, allow_null=True, description="The wishlist as it is now"),
+        "product": fields.Nested(product_model, allow_null=True, description="The product as it is now"),
+    },
+)
+
+owner_summary_model = api.model(
+    "OwnerSummary",
+    {
+        "owner": fields.String(description="The owner of the wishlists"),
+        "wishlist_count": fields.Integer(description="The number of wishlists"),
+        "product_count": fields.Integer(description="The number of products"),
+        "total_quantity": fields.Integer(description="The sum of all quantities"),
+        "distinct_product_names": fields.Integer(
+            description="The number of different product names"
+        ),
+        "last_modified": fields.DateTime(
+            description="When a wishlist or one of its products last changed"
+        ),
+    },
+)
+
+product_search_model = api.inherit(
+    "ProductSearchResult",
+    product_model,
+    {
+        "wishlist_name": fields.String(description="The name of the wishlist"),
+        "owner": fields.String(description="The owner of the wishlist"),
+        "score": fields.Float(description="The similarity of a fuzzy match"),
     },
 )
 
@@ -100,24 +204,209 @@ wishlist_args.add_argument(
     "owner", type=str, location="args", required=False, help="List Wishlists by owner"
 )
 wishlist_args.add_argument(
-    "start",
+    "name_prefix",
     type=str,
     location="args",
     required=False,
-    help="List Pets by start-date filter",
+    help="List Wishlists whose name starts with this",
+)
+wishlist_args.add_argument(
+    "start",
+    type=inputs.date,
+    location="args",
+    required=False,
+    help="List Wishlists created from this date",
 )
 wishlist_args.add_argument(
     "end",
+    type=inputs.date,
+    location="args",
+    required=False,
+    help="List Wishlists created up to this date",
+)
+wishlist_args.add_argument(
+    "min_items",
+    type=int,
+    location="args",
+    required=False,
+    help="List Wishlists with at least this many products, largest first",
+)
+wishlist_args.add_argument(
+    "max_items",
+    type=int,
+    location="args",
+    required=False,
+    help="List Wishlists with at most this many products, largest first",
+)
+
+
+def add_page_arguments(parser, sortable):
+    """Adds the sort, limit and cursor arguments of a paginated listing"""
+    parser.add_argument(
+        "sort",
+        type=str,
+        location="args",
+        required=False,
+        help=f"Comma separated {', '.join(sortable)}, a leading - sorts descending",
+    )
+    parser.add_argument(
+        "limit",
+        type=inputs.int_range(1, 1000),
+        location="args",
+        required=False,
+        help="The most records on a page, the Link header points to the next",
+    )
+    parser.add_argument(
+        "cursor",
+        type=str,
+        location="args",
+        required=False,
+        help="Where the page starts, as given by the Link header of the previous",
+    )
+
+
+add_page_arguments(wishlist_args, Wishlist.SORTABLE)
+wishlist_args.add_argument(
+    "count",
     type=str,
     location="args",
     required=False,
-    help="List Pets by end-date filter",
+    choices=("exact", "estimated", "none"),
+    help="How to count the matches in X-Total-Count, none by default on GET "
+    "and exact on HEAD. estimated uses the planner statistics on large tables",
+)
+wishlist_args.add_argument(
+    "stream",
+    type=inputs.boolean,
+    location="args",
+    default=False,
+    help="Send every match as a JSON array encoded while it is read, without a limit or cursor",
+)
+
+delete_args = reqparse.RequestParser()
+delete_args.add_argument(
+    "id", type=int, location="args", action="append", help="Delete Wishlists by id, repeatable"
+)
+delete_args.add_argument(
+    "owner", type=str, location="args", required=False, help="Delete Wishlists by owner"
+)
+delete_args.add_argument(
+    "name", type=str, location="args", required=False, help="Delete Wishlists by name"
+)
+delete_args.add_argument(
+    "start", type=inputs.date, location="args", required=False, help="Delete Wishlists created from this date"
+)
+delete_args.add_argument(
+    "end", type=inputs.date, location="args", required=False, help="Delete Wishlists created up to this date"
+)
+delete_args.add_argument(
+    "all",
+    type=inputs.boolean,
+    location="args",
+    default=False,
+    help="Delete every Wishlist, required when no other filter is given",
+)
+
+bulk_delete_model = api.model(
+    "BulkDelete",
+    {"deleted": fields.Integer(description="The number of wishlists removed")},
+)
+
+job_model = api.model(
+    "Job",
+    {
+        "id": fields.Integer(readOnly=True, description="The id of the job"),
+        "kind": fields.String(description="The operation the job runs"),
+        "status": fields.String(
+            description="queued, running, succeeded, failed or cancelled"
+        ),
+        "progress": fields.Integer(description="The number of items done so far"),
+        "total": fields.Integer(description="The number of items to do, if known"),
+        "result": fields.Raw(description="What the job produced once it succeeded"),
+        "error": fields.String(description="Why the job failed"),
+        "attempts": fields.Integer(description="How many times a worker started the job"),
+        "cancel_requested": fields.Boolean(description="Whether the job was asked to stop"),
+        "created_at": fields.DateTime(description="When the job was queued"),
+        "finished_at": fields.DateTime(description="When the job ended"),
+    },
+)
+
+import_model = api.model(
+    "WishlistImport",
+    {
+        "wishlists": fields.List(
+            fields.Nested(create_wishlist_model),
+            required=True,
+            description="The wishlists to create",
+        ),
+    },
+)
+
+logging_model = api.model(
+    "LoggingSettings",
+    {
+        "levels": fields.Raw(description="The level of each logger, e.g. {\"service.models\": \"DEBUG\"}"),
+        "sampling": fields.Raw(description="The share (0 to 1) of info and debug records kept per logger"),
+    },
+)
+
+copy_args = reqparse.RequestParser()
+copy_args.add_argument(
+    "async",
+    type=inputs.boolean,
+    location="args",
+    default=False,
+    help="Copy in the background even when the wishlist is small",
+)
+
+summary_args = reqparse.RequestParser()
+summary_args.add_argument(
+    "owner", type=str, location="args", required=True, help="Summarize Wishlists of an owner"
+)
+
+change_args = reqparse.RequestParser()
+change_args.add_argument(
+    "since",
+    type=str,
+    location="args",
+    required=False,
+    help="Where the feed continues, as given by the Link header of the last poll; from the start without it",
+)
+change_args.add_argument(
+    "limit",
+    type=inputs.int_range(1, 1000),
+    location="args",
+    default=100,
+    help="The most changes to return",
+)
+
+search_args = reqparse.RequestParser()
+search_args.add_argument(
+    "q", type=str, location="args", required=True, help="The product name to look for"
+)
+search_args.add_argument(
+    "fuzzy",
+    type=inputs.boolean,
+    location="args",
+    default=False,
+    help="Rank similar names instead of matching a substring",
+)
+search_args.add_argument(
+    "page", type=inputs.positive, location="args", default=1, help="The page number"
+)
+search_args.add_argument(
+    "per_page",
+    type=inputs.int_range(1, 100),
+    location="args",
+    default=20,
+    help="The number of results per page",
 )
 
 product_args = reqparse.RequestParser()
 product_args.add_argument(
     "name", type=str, location="args", required=False, help="List Products by name"
 )
+add_page_arguments(product_args, Product.SORTABLE)
 
 
 ######################################################################
@@ -158,45 +447,80 @@ class WishlistCollection(Resource):
     APIs:
     GET     /wishlists  List all wishlists
     POST    /wishlists  Create a wishlist
+    DELETE  /wishlists  Delete the wishlists matching a filter
     """
 
     # ------------------------------------------------------------------
     # LIST ALL WISHLISTS
     # ------------------------------------------------------------------
+    @low_priority
     @api.doc("list_wishlists")
     @api.expect(wishlist_args, validate=True)
-    @api.marshal_list_with(wishlist_model)
+    @api.response(400, "A streamed listing was given a limit or cursor")
+    @api.response(200, "Success", [wishlist_model])
     def get(self):
-        """Returns all of the wishlists. If there is a date filter, return filtered wishlists"""
+        """Returns the wishlists matching every filter given, all of them without filters"""
         app.logger.info("Request for listing all wishlists")
 
-        # Get query args
         args = wishlist_args.parse_args()
-        owner = args["owner"]
-        start = args["start"]
-        end = args["end"]
-        name = args["name"]
-
-        # Process the query string if any
-
-        if owner:
-            accounts = Wishlist.find_by_owner(owner)
-        elif name:
-            accounts = Wishlist.find_by_name(name)
-        elif start or end:
-            # filter by start and end date
-            start_date = None
-            end_date = None
-            if start:
-                start_date = datetime.strptime(start, "%Y-%m-%d").date()
-            if end:
-                end_date = datetime.strptime(end, "%Y-%m-%d").date()
-            accounts = Wishlist.filter_by_date(start_date, end_date)
-        else:
-            accounts = Wishlist.all()
+        criteria = wishlist_criteria(args)
+        sort = Wishlist.listing_sort(criteria, split_sort(args["sort"]))
+        if args["stream"]:
+            if args["limit"] is not None or args["cursor"]:
+                abort(status.HTTP_400_BAD_REQUEST, "A streamed listing has every wishlist, it takes no limit or cursor")
+            headers = count_headers(criteria, args["count"] or "none")
+            return stream_json_array(repository.stream_wishlists(criteria, sort), wishlist_model, headers)
+
+        after = decode_cursor(args)
+        accounts, headers = paginate(
+            lambda limit: repository.read_wishlists(criteria, sort, after, limit), sort, args, WishlistCollection
+        )
+        headers.update(count_headers(criteria, args["count"] or "none"))
 
         results = [account.serialize() for account in accounts]
-        return results, status.HTTP_200_OK
+        return marshal(results, wishlist_model), status.HTTP_200_OK, headers
+
+    # ------------------------------------------------------------------
+    # COUNT WISHLISTS
+    # ------------------------------------------------------------------
+    @api.doc("count_wishlists")
+    @api.expect(wishlist_args, validate=True)
+    @api.response(200, "The count is in the X-Total-Count header")
+    def head(self):
+        """Counts the wishlists matching the filters in X-Total-Count without listing them"""
+        app.logger.info("Request for counting wishlists")
+        args = wishlist_args.parse_args()
+        headers = count_headers(wishlist_criteria(args), args["count"] or "exact")
+        return None, status.HTTP_200_OK, headers
+
+    # ------------------------------------------------------------------
+    # DELETE WISHLISTS BY FILTER
+    # ------------------------------------------------------------------
+    @low_priority
+    @api.doc("delete_wishlists", security="apikey")
+    @api.response(400, "No filter was given")
+    @api.expect(delete_args, validate=True)
+    @api.marshal_with(bulk_delete_model)
+    def delete(self):
+        """Deletes the wishlists matching all of the filters with their products"""
+        args = delete_args.parse_args()
+        criteria = {
+            "ids": args["id"],
+            "owner": args["owner"],
+            "name": args["name"],
+            "start": args["start"] and args["start"].date(),
+            "end": args["end"] and args["end"].date(),
+        }
+        criteria = {key: value for key, value in criteria.items() if value is not None}
+        if not criteria and not args["all"]:
+            abort(
+                status.HTTP_400_BAD_REQUEST,
+                "Give a filter, or all=true to delete every wishlist",
+            )
+        app.logger.info("Request to delete wishlists matching %s", criteria)
+        deleted = repository.delete_wishlists(criteria)
+        app.logger.info("Deleted %d wishlists", deleted)
+        return {"deleted": deleted}, status.HTTP_200_OK
 
     # ------------------------------------------------------------------
     # CREATE A NEW WISHLIST
@@ -211,7 +535,7 @@ class WishlistCollection(Resource):
         app.logger.info("Request for creating a wishlist")
         new_list = Wishlist()
         new_list.deserialize(api.payload)
-        new_list.create()
+        repository.create_wishlist(new_list)
         message = new_list.serialize()
         app.logger.info("Wishlist created with id: %d", message["id"])
 
@@ -235,6 +559,7 @@ class WishlistResource(Resource):
     Allows the manipulation of a single Wishlist
     GET /wishlist{wishlist_id} - Returns a Wishlist based on it's id
     PUT /wishlist{wishlist_id} - Update a Wishlist with the id
+    PATCH /wishlist{wishlist_id} - Change some fields of a Wishlist with the id
     DELETE /wishlist{wishlist_id} -  Deletes a Wishlist with the id
     """
 
@@ -251,7 +576,7 @@ class WishlistResource(Resource):
         This endpoint will return a Wishlist based on it's id
         """
         app.logger.info("Request to Retrieve a wishlist with id [%s]", wishlist_id)
-        wishlist = Wishlist.find(wishlist_id)
+        wishlist = repository.find_wishlist(wishlist_id)
         if not wishlist:
             abort(
                 status.HTTP_404_NOT_FOUND,
@@ -272,10 +597,12 @@ class WishlistResource(Resource):
         """
         Update a Wishlist
 
-        This endpoint will update a Wishlist based the body that is posted
+        This endpoint will update a Wishlist based the body that is posted.
+        The products are matched to the current ones by id: entries without an
+        id are added, and products left out are deleted.
         """
         app.logger.info("Request to Update a wishlist with id [%s]", wishlist_id)
-        wishlist = Wishlist.find(wishlist_id)
+        wishlist = repository.find_wishlist(wishlist_id)
         if not wishlist:
             abort(
                 status.HTTP_404_NOT_FOUND,
@@ -284,8 +611,33 @@ class WishlistResource(Resource):
         app.logger.debug("Payload = %s", api.payload)
         data = api.payload
         wishlist.deserialize(data)
-        wishlist.id = wishlist_id
-        wishlist.update()
+        repository.update_wishlist(wishlist)
+        return wishlist.serialize(), status.HTTP_200_OK
+
+    # ------------------------------------------------------------------
+    # PATCH AN EXISTING WISHLIST
+    # ------------------------------------------------------------------
+    @api.doc("patch_wishlists", security="apikey")
+    @api.response(404, "Wishlist not found")
+    @api.response(400, "The patch was not valid")
+    @api.marshal_with(wishlist_model)
+    def patch(self, wishlist_id):
+        """
+        Patch a Wishlist
+
+        This endpoint applies a JSON Merge Patch and only writes what changed.
+        The products of the patch are matched to the current ones by id.
+        """
+        app.logger.info("Request to Patch a wishlist with id [%s]", wishlist_id)
+        wishlist = repository.find_wishlist(wishlist_id)
+        if not wishlist:
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                f"Wishlist with id '{wishlist_id}' could not be found.",
+            )
+        app.logger.debug("Patch = %s", api.payload)
+        wishlist.patch(api.payload)
+        repository.update_wishlist(wishlist)
         return wishlist.serialize(), status.HTTP_200_OK
 
     # ------------------------------------------------------------------
@@ -301,14 +653,113 @@ class WishlistResource(Resource):
         This endpoint will delete a Wishlist based the id specified in the path
         """
         app.logger.info("Request to Update a wishlist with id [%s]", wishlist_id)
-        wishlist = Wishlist.find(wishlist_id)
+        wishlist = repository.find_wishlist(wishlist_id)
         if wishlist:
-            wishlist.delete()
+            repository.delete_wishlist(wishlist)
             app.logger.info("Wishlist with id [%s] was deleted", wishlist_id)
 
         return "", status.HTTP_204_NO_CONTENT
 
 
+######################################################################
+#  PATH: /wishlists/summary
+######################################################################
+@api.route("/wishlists/summary", strict_slashes=False)
+class OwnerSummary(Resource):
+    """Aggregate figures over all the wishlists of an owner
+
+    GET /wishlists/summary?owner={owner} - Returns the totals of an owner
+    """
+
+    @api.doc("summarize_owner")
+    @api.expect(summary_args, validate=True)
+    @api.marshal_with(owner_summary_model)
+    def get(self):
+        """
+        Summarize the wishlists of an owner
+
+        The figures are computed by the database without loading any product
+        """
+        args = summary_args.parse_args()
+        app.logger.info("Request for the summary of owner [%s]", args["owner"])
+        return repository.summarize_owner(args["owner"]), status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /wishlists/changes
+######################################################################
+@api.route("/wishlists/changes", strict_slashes=False)
+class ChangeFeed(Resource):
+    """The Wishlists and Products created, updated and deleted since a cursor
+
+    GET /wishlists/changes?since={cursor} - Returns the next changes
+    """
+
+    @api.doc("list_changes")
+    @api.expect(change_args, validate=True)
+    @api.response(400, "The cursor is not valid")
+    @api.response(501, "The storage backend does not record changes")
+    @api.marshal_list_with(change_model)
+    def get(self):
+        """
+        Returns the changes after a cursor in the order they were committed
+
+        Each record changed since appears once, as it is now or as a
+        tombstone. The Link header holds the cursor of the next poll, also
+        when no change came; fewer changes than the limit mean the feed has
+        caught up.
+        """
+        args = change_args.parse_args()
+        app.logger.info("Request for the changes since %s", args["since"])
+        after = None
+        if args["since"]:
+            try:
+                after = json.loads(base64.urlsafe_b64decode(args["since"].encode("ascii")))["after"]
+            except (ValueError, TypeError, KeyError) as error:
+                abort(status.HTTP_400_BAD_REQUEST, f"Invalid cursor: {error}")
+        try:
+            changes = repository.list_changes(after, args["limit"])
+        except NotImplementedError as error:
+            abort(status.HTTP_501_NOT_IMPLEMENTED, str(error))
+
+        params = request.args.to_dict()
+        if changes:
+            params["since"] = encode_cursor({"after": changes[-1].sort_values(None)})
+        next_url = api.url_for(ChangeFeed, **params, _external=True)
+        results = [change.serialize() for change in changes]
+        return results, status.HTTP_200_OK, {"Link": f'<{next_url}>; rel="next"'}
+
+
+######################################################################
+#  PATH: /wishlists/{wishlist_id}/summary
+######################################################################
+@api.route("/wishlists/<int:wishlist_id>/summary", strict_slashes=False)
+@api.param("wishlist_id", "The Wishlist identifier")
+class WishlistSummary(Resource):
+    """Aggregate figures of a single wishlist
+
+    GET /wishlists/{wishlist_id}/summary - Returns the totals of a Wishlist
+    """
+
+    @api.doc("summarize_wishlist")
+    @api.response(404, "Wishlist not found")
+    @api.marshal_with(wishlist_summary_model)
+    def get(self, wishlist_id):
+        """
+        Summarize a single wishlist
+
+        The figures are computed by the database without loading any product
+        """
+        app.logger.info("Request for the summary of wishlist [%s]", wishlist_id)
+        summary = repository.summarize_wishlist(wishlist_id)
+        if not summary:
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                f"Wishlist with id '{wishlist_id}' could not be found.",
+            )
+        return summary, status.HTTP_200_OK
+
+
 ######################################################################
 # PATH: /wishlists/<int:wishlist_id>/products
 ######################################################################
@@ -336,7 +787,7 @@ class ProductCollection(Resource):
         )
 
         # See if the wishlist exists and abort if it doesn't
-        wishlist = Wishlist.find(wishlist_id)
+        wishlist = repository.find_wishlist(wishlist_id)
         if not wishlist:
             abort(
                 status.HTTP_404_NOT_FOUND,
@@ -345,13 +796,18 @@ class ProductCollection(Resource):
 
         # Get query args
         args = product_args.parse_args()
-        if args["name"]:
-            products = wishlist.find_product_by_name(args["name"])
-            results = [product.serialize() for product in products]
-        else:
-            results = [product.serialize() for product in wishlist.products]
+        sort = split_sort(args["sort"])
+        after = decode_cursor(args)
+        products, headers = paginate(
+            lambda limit: repository.read_products(wishlist.id, args["name"], sort, after, limit),
+            sort,
+            args,
+            ProductCollection,
+            wishlist_id=wishlist.id,
+        )
+        results = [product.serialize() for product in products]
 
-        return results, status.HTTP_200_OK
+        return results, status.HTTP_200_OK, headers
 
     # ------------------------------------------------------------------
     #  CREATE a product in the wishlist
@@ -369,7 +825,7 @@ class ProductCollection(Resource):
         """
         app.logger.info("Request to create a product in wishlist %d", wishlist_id)
 
-        wishlist = Wishlist.find(wishlist_id)
+        wishlist = repository.find_wishlist(wishlist_id)
         if not wishlist:
             abort(
                 status.HTTP_404_NOT_FOUND,
@@ -382,10 +838,10 @@ class ProductCollection(Resource):
             info["wishlist_id"] = wishlist.id  # Update wishlist_id if not consistent
         new_product.deserialize(info)
         new_product.wishlist = wishlist
-        new_product.create()
+        repository.create_product(new_product)
 
         # wishlist.products.append(new_product)
-        wishlist.update()
+        repository.update_wishlist(wishlist)
 
         # Return response
         message = new_product.serialize()
@@ -412,6 +868,7 @@ class ProductResource(Resource):
     Allows the manipulation of a single Product in one wishlist
     GET - RETRIEVE A PRODUCT in a wishlist
     PUT - UPDATE a product in the wishlist
+    PATCH - CHANGE some fields of a product in the wishlist
     DELETE - DELETE a product in the wishlist
     """
 
@@ -428,16 +885,11 @@ class ProductResource(Resource):
         This endpoint returns just an product
         """
         app.logger.info(
-            "Request to update Product %d in Wishlist id: %d", product_id, wishlist_id
+            "Request to get Product %d in Wishlist id: %d", product_id, wishlist_id
         )
 
         # See if the product exists and abort if it doesn't
-        product = Product.find(product_id)
-        if not product:
-            abort(
-                status.HTTP_404_NOT_FOUND,
-                f"Product with id '{product_id}' could not be found.",
-            )
+        product = find_product_or_abort(wishlist_id, product_id)
 
         return product.serialize(), status.HTTP_200_OK
 
@@ -457,26 +909,8 @@ class ProductResource(Resource):
             "Request to update Product %d in Wishlist id: %d", product_id, wishlist_id
         )
 
-        # check the wishlist
-        wishlist = Wishlist.find(wishlist_id)
-        if not wishlist:
-            abort(
-                status.HTTP_404_NOT_FOUND,
-                f"Wishlist with id {wishlist_id} not exist",
-            )
-        # check the product
-        product = Product.find(product_id)
-        if not product:
-            abort(
-                status.HTTP_404_NOT_FOUND,
-                f"Product with id '{product_id}' not exist",
-            )
-        # check if the wishlist contains the product
-        if product not in wishlist.products:
-            abort(
-                status.HTTP_400_BAD_REQUEST,
-                f"Wishlist {wishlist_id} does not contain Product {product_id}",
-            )
+        # check the wishlist and the product in one query
+        product = find_product_or_abort(wishlist_id, product_id)
 
         data = api.payload
         if str(data["wishlist_id"]) != str(wishlist_id):
@@ -485,7 +919,35 @@ class ProductResource(Resource):
                 "Should not change the wishlist a product belongs to",
             )
         product.deserialize(data)
-        product.update()
+        repository.update_product(product)
+
+        return product.serialize(), status.HTTP_200_OK
+
+    # ------------------------------------------------------------------
+    # PATCH a product in the wishlist
+    # ------------------------------------------------------------------
+    @api.doc("patch_product")
+    @api.response(404, "product not found")
+    @api.response(400, "The patch was not valid")
+    @api.marshal_with(product_model)
+    def patch(self, wishlist_id, product_id):
+        """
+        Patch a product
+
+        This endpoint applies a JSON Merge Patch to the name and quantity of a product
+        """
+        app.logger.info(
+            "Request to patch Product %d in Wishlist id: %d", product_id, wishlist_id
+        )
+        product = find_product_or_abort(wishlist_id, product_id)
+        data = api.payload
+        if isinstance(data, dict) and data.get("wishlist_id", wishlist_id) != wishlist_id:
+            abort(
+                status.HTTP_409_CONFLICT,
+                "Should not change the wishlist a product belongs to",
+            )
+        product.patch(data)
+        repository.update_product(product)
 
         return product.serialize(), status.HTTP_200_OK
 
@@ -501,19 +963,99 @@ class ProductResource(Resource):
         This endpoint will delete a product based the id specified in the path
         """
         app.logger.info("Request to delete a product in wishlist %d", wishlist_id)
-        wishlist = Wishlist.find(wishlist_id)
-        if not wishlist:
+        wishlist_found, product = repository.find_product_in_wishlist(wishlist_id, product_id)
+        if not wishlist_found:
             abort(
                 status.HTTP_404_NOT_FOUND,
                 f"Wishlist {wishlist_id} not exist",
             )
-        product = Product.find(product_id)
         if product:
-            product.delete()
+            repository.delete_product(product)
 
         return "", status.HTTP_204_NO_CONTENT
 
 
+######################################################################
+# PATH: /wishlists/<int:wishlist_id>/products/upsert
+######################################################################
+@api.route("/wishlists/<int:wishlist_id>/products/upsert", strict_slashes=False)
+@api.param("wishlist_id", "The Wishlist id")
+class ProductUpsert(Resource):
+    """
+    ProductUpsert class
+
+    Adds a product to a wishlist by name in a single statement
+    POST - create the product, or add to its quantity when the name is taken
+    """
+
+    @api.doc("upsert_product")
+    @api.response(404, "Wishlist not found")
+    @api.expect(upsert_product_model, validate=True)
+    @api.marshal_with(product_model)
+    def post(self, wishlist_id):
+        """
+        Add a product by name
+
+        Adds the quantity to the product with the same name, or creates it
+        """
+        data = api.payload
+        app.logger.info("Request to upsert %s in wishlist %d", data["name"], wishlist_id)
+        product = repository.upsert_product(wishlist_id, data["name"], data["quantity"])
+        if not product:
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                f"Wishlist {wishlist_id} not exist",
+            )
+        location_url = api.url_for(
+            ProductResource,
+            wishlist_id=wishlist_id,
+            product_id=product["id"],
+            _external=True,
+        )
+        return product, status.HTTP_200_OK, {"Location": location_url}
+
+
+######################################################################
+# PATH: /wishlists/<int:wishlist_id>/products/<int:product_id>/quantity
+######################################################################
+@api.route(
+    "/wishlists/<int:wishlist_id>/products/<int:product_id>/quantity",
+    strict_slashes=False,
+)
+@api.doc(params={"wishlist_id": "The Wishlist id", "product_id": "The Product id"})
+class ProductQuantity(Resource):
+    """
+    ProductQuantity class
+
+    Changes the quantity of a product without reading it first
+    POST - add to or take away from the quantity
+    """
+
+    @api.doc("change_product_quantity")
+    @api.response(404, "product not found")
+    @api.response(409, "The quantity would drop below zero")
+    @api.expect(quantity_change_model, validate=True)
+    @api.marshal_with(product_model)
+    def post(self, wishlist_id, product_id):
+        """
+        Change the quantity of a product
+
+        The change is applied in the database so concurrent changes all count
+        """
+        amount = api.payload["amount"]
+        app.logger.info(
+            "Request to change quantity of Product %d by %d", product_id, amount
+        )
+        product = repository.adjust_quantity(wishlist_id, product_id, amount)
+        if not product:
+            find_product_or_abort(wishlist_id, product_id)
+            abort(
+                status.HTTP_409_CONFLICT,
+                f"Quantity of Product {product_id} cannot drop below zero",
+            )
+        return product, status.HTTP_200_OK
+
+
 ######################################################################
 # PATH: /wishlists/<int:wishlist_id>/copy
 ######################################################################
@@ -530,19 +1072,29 @@ class WishlistCopy(Resource):
     # ------------------------------------------------------------------
     # COPY AN EXISTING Wishlist
     # ------------------------------------------------------------------
-    @api.doc("get_wishlists")
+    @api.doc("copy_wishlists")
     @api.response(404, "Wishlist not found")
-    @api.marshal_with(wishlist_model)
+    @api.response(201, "Wishlist copied", wishlist_model)
+    @api.response(202, "Copy queued as a background job", job_model)
+    @api.expect(copy_args, validate=True)
     def post(self, wishlist_id):
         """
         COPY AN EXISTING Wishlist with an id
+
+        Large wishlists, or any with async=true, are copied by a background
+        job and the response points to it
         """
-        old_wishlist = Wishlist.find(wishlist_id)
+        args = copy_args.parse_args()
+        old_wishlist = repository.find_wishlist(wishlist_id)
         if not old_wishlist:
             abort(
                 status.HTTP_404_NOT_FOUND,
                 f"Wishlist {wishlist_id} not exist",
             )
+        if args["async"] or old_wishlist.product_count > app.config["COPY_ASYNC_THRESHOLD"]:
+            app.logger.info("Queueing the copy of Wishlist %s", wishlist_id)
+            return queue_job("copy_wishlist", {"wishlist_id": wishlist_id}, old_wishlist.product_count)
+
         old = old_wishlist.serialize()
 
         new = {}
@@ -550,17 +1102,12 @@ class WishlistCopy(Resource):
             if key not in ["id", "name", "products"]:
                 new[key] = val
         new["name"] = old["name"] + " COPY"
-        new["products"] = []
+        new["products"] = old["products"]
         new["date_joined"] = str(date.today())
+        # the products are created with the wishlist, which gives them its id
         new_list = Wishlist()
         new_list.deserialize(new)
-        new_list.create()
-
-        for product in old["products"]:
-            product["wishlist_id"] = new_list.id
-            new_product = Product()
-            new_product.deserialize(product)
-            new_product.create()
+        repository.create_wishlist(new_list)
 
         # location_url = url_for("get_wishlists", wishlist_id=new_list.id, _external=True)
         location_url = api.url_for(
@@ -568,17 +1115,318 @@ class WishlistCopy(Resource):
         )
 
         return (
-            new_list.serialize(),
+            marshal(new_list.serialize(), wishlist_model),
             status.HTTP_201_CREATED,
             {"Location": location_url},
         )
 
 
+######################################################################
+# PATH: /wishlists/import
+######################################################################
+@api.route("/wishlists/import", strict_slashes=False)
+class WishlistImport(Resource):
+    """
+    WishlistImport class
+
+    Creates many wishlists in the background
+    POST /wishlists/import - Queues a job creating the posted wishlists
+    """
+
+    @api.doc("import_wishlists", security="apikey")
+    @api.response(400, "The posted data was not valid")
+    @api.expect(import_model)
+    @api.response(202, "Import queued as a background job", job_model)
+    def post(self):
+        """
+        Import Wishlists
+
+        Every wishlist is checked before the job is queued, so a bad one
+        is reported here rather than in the middle of the import
+        """
+        check_content_type("application/json")
+        items = (api.payload or {}).get("wishlists")
+        if not isinstance(items, list):
+            abort(status.HTTP_400_BAD_REQUEST, "Invalid import: wishlists must be a list")
+        for position, item in enumerate(items):
+            try:
+                Wishlist().deserialize(item)
+            except (DataValidationError, AttributeError, ValueError) as error:
+                abort(status.HTTP_400_BAD_REQUEST, f"Wishlist {position}: {error}")
+        app.logger.info("Queueing the import of %d wishlists", len(items))
+        return queue_job("import_wishlists", {"wishlists": items}, len(items))
+
+
+######################################################################
+# PATH: /jobs/{job_id}
+######################################################################
+@api.route("/jobs/<int:job_id>")
+@api.param("job_id", "The Job identifier")
+class JobResource(Resource):
+    """
+    JobResource class
+
+    Follows a background job
+    GET /jobs/{job_id} - Returns the status, progress and result of a Job
+    DELETE /jobs/{job_id} - Cancels a Job
+    """
+
+    @api.doc("get_jobs")
+    @api.response(404, "Job not found")
+    @api.marshal_with(job_model)
+    def get(self, job_id):
+        """Retrieve a single Job"""
+        app.logger.info("Request to Retrieve a job with id [%s]", job_id)
+        return find_job_or_abort(job_id).serialize(), status.HTTP_200_OK
+
+    @api.doc("cancel_jobs", security="apikey")
+    @api.response(404, "Job not found")
+    @api.response(409, "Job already finished")
+    @api.marshal_with(job_model)
+    def delete(self, job_id):
+        """
+        Cancel a Job
+
+        A queued job is cancelled at once, a running one stops at its next
+        checkpoint and keeps the work committed before it
+        """
+        app.logger.info("Request to Cancel a job with id [%s]", job_id)
+        job = find_job_or_abort(job_id)
+        if not job.cancel():
+            abort(status.HTTP_409_CONFLICT, f"Job {job_id} already {job.status}")
+        return job.serialize(), status.HTTP_200_OK
+
+
+######################################################################
+# PATH: /logging
+######################################################################
+@api.route("/logging", strict_slashes=False)
+class LoggingSettings(Resource):
+    """
+    LoggingSettings class
+
+    Changes logging without a restart, in the process serving the request
+    GET /logging - Returns the logger levels and sampling rates
+    PUT /logging - Changes the logger levels and sampling rates given
+    """
+
+    @api.doc("get_logging")
+    @api.marshal_with(logging_model)
+    def get(self):
+        """Retrieve the logging settings"""
+        return log_handlers.logging_settings(app), status.HTTP_200_OK
+
+    @api.doc("change_logging", security="apikey")
+    @api.response(400, "The posted settings were not valid")
+    @api.expect(logging_model)
+    @api.marshal_with(logging_model)
+    def put(self):
+        """
+        Change the logging settings
+
+        Loggers and rates left out keep their settings
+        """
+        check_content_type("application/json")
+        data = api.payload or {}
+        try:
+            log_handlers.change_settings(data.get("levels"), data.get("sampling"))
+        except (AttributeError, TypeError, ValueError) as error:
+            abort(status.HTTP_400_BAD_REQUEST, f"Invalid logging settings: {error}")
+        app.logger.warning("Logging changed to %s", data)
+        return log_handlers.logging_settings(app), status.HTTP_200_OK
+
+
+######################################################################
+# PATH: /products/search
+######################################################################
+@api.route("/products/search", strict_slashes=False)
+class ProductSearch(Resource):
+    """
+    ProductSearch class
+
+    Finds products by name across every wishlist
+    GET /products/search?q={name} - Returns a page of matching products
+    """
+
+    @low_priority
+    @api.doc("search_products")
+    @api.expect(search_args, validate=True)
+    @api.marshal_list_with(product_search_model)
+    def get(self):
+        """
+        Search products by name
+
+        Matches a substring of the name, or similar names when fuzzy is set
+        """
+        args = search_args.parse_args()
+        app.logger.info("Request to search products for [%s]", args["q"])
+        per_page = args["per_page"]
+        offset = (args["page"] - 1) * per_page
+        results = repository.search_products(
+            args["q"],
+            fuzzy=args["fuzzy"],
+            limit=per_page + 1,
+            offset=offset,
+            threshold=app.config["SEARCH_SIMILARITY"],
+        )
+        headers = {}
+        if len(results) > per_page:
+            results = results[:per_page]
+            next_url = api.url_for(
+                ProductSearch,
+                q=args["q"],
+                fuzzy=str(args["fuzzy"]).lower(),
+                page=args["page"] + 1,
+                per_page=per_page,
+                _external=True,
+            )
+            headers["Link"] = f'<{next_url}>; rel="next"'
+        return results, status.HTTP_200_OK, headers
+
+
 ######################################################################
 #  U T I L I T Y   F U N C T I O N S
 ######################################################################
 
 
+def find_product_or_abort(wishlist_id, product_id):
+    """Returns a product of a wishlist or aborts with the reason it is missing"""
+    wishlist_found, product = repository.find_product_in_wishlist(wishlist_id, product_id)
+    if not wishlist_found:
+        abort(
+            status.HTTP_404_NOT_FOUND,
+            f"Wishlist with id {wishlist_id} not exist",
+        )
+    if not product:
+        abort(
+            status.HTTP_404_NOT_FOUND,
+            f"Product with id '{product_id}' not exist in Wishlist {wishlist_id}",
+        )
+    return product
+
+
+def wishlist_criteria(args):
+    """Returns the criteria of a Wishlist listing given in the query string"""
+    criteria = {
+        "owner": args["owner"],
+        "name": args["name"],
+        "name_prefix": args["name_prefix"],
+        "start": args["start"] and args["start"].date(),
+        "end": args["end"] and args["end"].date(),
+        "min_items": args["min_items"],
+        "max_items": args["max_items"],
+    }
+    return {key: value for key, value in criteria.items() if value is not None}
+
+
+def count_headers(criteria, mode):
+    """Returns the X-Total-Count header of a listing counted as asked"""
+    if mode == "none":
+        return {}
+    total = repository.count_wishlists(criteria, estimated=mode == "estimated")
+    return {"X-Total-Count": str(total)}
+
+
+def split_sort(value):
+    """Splits a sort argument such as -date_joined,name into its keys"""
+    if not value:
+        return []
+    return [key.strip() for key in value.split(",") if key.strip()]
+
+
+def decode_cursor(args):
+    """Returns the sort values a cursor argument continues after, or None
+
+    A cursor is only valid with the sort it was made for.
+    """
+    if not args["cursor"]:
+        return None
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(args["cursor"].encode("ascii")))
+        sort, after = cursor["sort"], cursor["after"]
+    except (ValueError, TypeError, KeyError) as error:
+        abort(status.HTTP_400_BAD_REQUEST, f"Invalid cursor: {error}")
+    if sort != (args["sort"] or ""):
+        abort(status.HTTP_400_BAD_REQUEST, "Invalid cursor: it was made for another sort")
+    return after
+
+
+def encode_cursor(cursor):
+    """Returns a cursor as the opaque string of a query argument"""
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode("ascii")
+
+
+def paginate(fetch, sort, args, resource, **values):
+    """Returns a page of a sorted listing and the Link header to the next one
+
+    fetch returns the records of the listing given the most to return.
+    Without a limit every record is returned. With one, a record more is
+    read to know whether a next page exists, and its cursor holds the sort
+    values of the last record so the next query seeks past it on the index.
+    """
+    if args["limit"] is None:
+        return fetch(None), {}
+    records = fetch(args["limit"] + 1)
+    if len(records) <= args["limit"]:
+        return records, {}
+    records = records[: args["limit"]]
+    cursor = {"sort": args["sort"] or "", "after": records[-1].sort_values(sort)}
+    params = request.args.to_dict()
+    params["cursor"] = encode_cursor(cursor)
+    next_url = api.url_for(resource, **values, **params, _external=True)
+    return records, {"Link": f'<{next_url}>; rel="next"'}
+
+
+def stream_json_array(records, model, headers):
+    """Returns a response encoding the records as a JSON array while they are read
+
+    Each record is marshalled and encoded like the buffered listings of
+    flask-restx, so the body is the same bytes, and the encoded text is sent
+    every STREAM_CHUNK_SIZE bytes. The generator only reads the next records
+    when the server asks for more of the body, so a slow client holds back
+    the cursor instead of the records piling up in memory. The status and
+    headers are sent before the first record is read.
+    """
+    settings = app.config.get("RESTX_JSON", {})
+    chunk_size = app.config["STREAM_CHUNK_SIZE"]
+
+    def generate():
+        chunk, separator = ["["], ""
+        size = 1
+        for record in records:
+            encoded = separator + json.dumps(marshal(record.serialize(), model), **settings)
+            chunk.append(encoded)
+            size += len(encoded)
+            separator = ", "
+            if size >= chunk_size:
+                yield "".join(chunk)
+                chunk, size = [], 0
+        chunk.append("]\n")
+        yield "".join(chunk)
+
+    return Response(stream_with_context(generate()), status.HTTP_200_OK, headers, mimetype="application/json")
+
+
+def find_job_or_abort(job_id):
+    """Returns a Job or aborts with 404 Not Found"""
+    job = Job.find(job_id)
+    if not job:
+        abort(status.HTTP_404_NOT_FOUND, f"Job with id '{job_id}' not exist")
+    return job
+
+
+def queue_job(kind, params, total=None):
+    """Queues a background Job and returns the 202 Accepted response for it"""
+    job = Job.submit(kind, params, total)
+    runner.wake()
+    location_url = api.url_for(JobResource, job_id=job.id, _external=True)
+    return (
+        marshal(job.serialize(), job_model),
+        status.HTTP_202_ACCEPTED,
+        {"Location": location_url},
+    )
+
+
 def check_content_type(media_type):
     """Checks that the media type is correct"""
     content_type = request.headers.get("Content-Type")
@@ -16,10 +16,21 @@
 Test Factory to make fake objects for testing
 """
 from datetime import date
+from unittest.mock import patch
 import factory
-from factory.fuzzy import FuzzyChoice, FuzzyDate
+from factory.fuzzy import FuzzyDate
+from service import jobs, routes
 from service.models import Wishlist, Product
 
+# The Wishlists the repository tests start from: name, owner, date joined
+# and the names of their Products
+SAMPLE_WISHLISTS = [
+    ("books", "ann", date(2020, 1, 1), ["novel", "atlas"]),
+    ("bikes", "bob", date(2021, 6, 1), []),
+    ("boots", "ann", date(2022, 3, 1), ["left"]),
+    ("cups", None, date(2021, 1, 1), []),
+]
+
 
 class WishlistFactory(factory.Factory):
     """Creates fake Wishlists"""
@@ -58,6 +69,48 @@ class ProductFactory(factory.Factory):
 
     id = factory.Sequence(lambda n: n)
     # wishlist_id = None
-    name = FuzzyChoice(choices=["home", "work", "other"])
+    # names are unique within a wishlist
+    name = factory.Sequence(lambda n: f"{['home', 'work', 'other'][n % 3]} {n}")
     quantity = factory.Sequence(lambda n: n % 10)
     wishlist = factory.SubFactory(WishlistFactory)
+
+
+def new_wishlist(name, owner, joined, products=()):
+    """Returns a Wishlist that is not saved yet"""
+    wishlist = Wishlist(name=name, owner=owner, date_joined=joined)  # pylint: disable=unexpected-keyword-arg
+    for product_name in products:
+        wishlist.products.append(Product(name=product_name, quantity=2))  # pylint: disable=unexpected-keyword-arg
+    return wishlist
+
+
+def create_samples(repository) -> list:
+    """Creates the SAMPLE_WISHLISTS in a repository and returns their ids"""
+    ids = []
+    for name, owner, joined, products in SAMPLE_WISHLISTS:
+        wishlist = new_wishlist(name, owner, joined, products)
+        repository.create_wishlist(wishlist)
+        ids.append(wishlist.id)
+    return ids
+
+
+class RepositoryRoutesMixin:
+    """Runs the tests of a server test case on a new repository_class,
+    patched in as the repository of the routes and the jobs"""
+
+    repository_class = None
+
+    @classmethod
+    def setUpClass(cls):  # pylint: disable=invalid-name
+        """This runs once before the entire test suite"""
+        super().setUpClass()
+        repository = cls.repository_class()  # pylint: disable=not-callable
+        cls.patches = [patch.object(routes, "repository", repository), patch.object(jobs, "repository", repository)]
+        for patcher in cls.patches:
+            patcher.start()
+
+    @classmethod
+    def tearDownClass(cls):  # pylint: disable=invalid-name
+        """This runs once after the entire test suite"""
+        for patcher in cls.patches:
+            patcher.stop()
+        super().tearDownClass()
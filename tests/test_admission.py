@@ -0,0 +1,113 @@
+"""
+Test cases for admission control
+"""
+import threading
+from unittest import TestCase
+from service import app
+from service.common import status
+from service.common.admission import AdaptiveLimit, AdmissionController, NORMAL, LOW, controller
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestAdaptiveLimit(TestCase):
+    """Adaptive Limit Tests"""
+
+    def test_additive_increase(self):
+        """It should grow the limit while saturated requests are fast"""
+        limit = AdaptiveLimit(NORMAL, 4, 1, 8)
+        for _ in range(4):
+            limit.in_flight = 4
+            limit.complete(0.01, 0.25, 1.0)
+        self.assertAlmostEqual(limit.limit, 5, delta=0.1)
+        limit.complete(0.01, 0.25, 1.0)  # not saturated, nothing to learn
+        self.assertAlmostEqual(limit.limit, 5, delta=0.1)
+
+    def test_multiplicative_decrease(self):
+        """It should shrink the limit once per round trip when slow"""
+        limit = AdaptiveLimit(NORMAL, 8, 1, 32)
+        limit.in_flight = 3
+        limit.complete(1.0, 0.25, 10.0)
+        limit.complete(1.0, 0.25, 10.5)
+        self.assertEqual(limit.limit, 6)
+        limit.complete(1.0, 0.25, 11.0)
+        self.assertEqual(limit.limit, 4.5)
+        for now in range(20, 40):
+            limit.in_flight = 1
+            limit.complete(1.0, 0.25, now)
+        self.assertEqual(limit.limit, 1)
+
+
+class TestAdmissionController(TestCase):
+    """Admission Controller Tests"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.controller = AdmissionController(limit=2, max_limit=4, queue_timeout=0.2)
+
+    def test_sheds_over_limit(self):
+        """It should shed a request when the queue budget runs out"""
+        self.assertTrue(self.controller.acquire("list"))
+        self.assertTrue(self.controller.acquire("list"))
+        self.assertFalse(self.controller.acquire("list"))
+        self.assertFalse(self.controller.acquire("list", waited=1.0))
+        self.assertEqual(self.controller.stats()["list"]["shed"], 2)
+        self.controller.release("list", 0.01)
+        self.assertTrue(self.controller.acquire("list"))
+
+    def test_queued_request_is_admitted(self):
+        """It should admit a queued request when a slot frees up"""
+        self.controller.queue_timeout = 5
+        self.controller.acquire("get")
+        self.controller.acquire("get")
+        timer = threading.Timer(0.05, self.controller.release, ("get", 0.01))
+        timer.start()
+        self.assertTrue(self.controller.acquire("get"))
+        timer.join()
+
+    def test_low_priority_yields(self):
+        """It should start low priority routes smaller and let normal ones go first"""
+        self.assertEqual(self.controller.limiter("list", LOW).limit, 1)
+        self.controller.acquire("get")
+        self.controller.acquire("get")
+        waiter = threading.Thread(target=self.controller.acquire, args=("get",))
+        waiter.start()
+        while not self.controller._waiting[NORMAL]:  # pylint: disable=protected-access
+            threading.Event().wait(0.01)
+        self.assertFalse(self.controller.acquire("list", LOW))
+        self.controller.release("get", 0.01)
+        waiter.join()
+
+
+class TestAdmissionRoutes(TestCase):
+    """Admission Control Route Tests"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.client = app.test_client()
+        self.queue_timeout = controller.queue_timeout
+        controller.queue_timeout = 0.05
+
+    def tearDown(self):
+        """This runs after each test"""
+        controller.queue_timeout = self.queue_timeout
+
+    def test_shed_with_retry_after(self):
+        """It should answer 503 with Retry-After when a route is full"""
+        route = "GET wishlist_collection"
+        limiter = controller.limiter(route, LOW)
+        busy = max(1, int(limiter.limit))
+        limiter.in_flight += busy
+        try:
+            resp = self.client.get("/api/wishlists")
+        finally:
+            limiter.in_flight -= busy
+        self.assertEqual(resp.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertGreaterEqual(int(resp.headers["Retry-After"]), 1)
+        self.assertEqual(resp.get_json()["error"], "Service Unavailable")
+
+        # health checks are never limited
+        resp = self.client.get("/health")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertGreaterEqual(resp.get_json()["admission"][route]["shed"], 1)
@@ -0,0 +1,127 @@
+"""
+Test cases for the cached static assets and Swagger specification
+"""
+import gzip
+import json
+import logging
+from unittest import TestCase
+from service import app
+from service.common import status
+from service.common.asset_cache import assets, CachedAsset
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestAssetCache(TestCase):
+    """Asset Cache Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+
+    def setUp(self):
+        """This runs before each test"""
+        assets.clear()
+        self.client = app.test_client()
+
+    def test_index_fingerprints_assets(self):
+        """It should rewrite static urls in the index page with content hashes"""
+        resp = self.client.get("/")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["Cache-Control"], "no-cache")
+        digest = assets.static["js/rest_api.js"].digest
+        self.assertIn(f"/static/js/rest_api.js?v={digest}", resp.get_data(as_text=True))
+
+    def test_index_gzip(self):
+        """It should send the precompressed index page when gzip is accepted"""
+        resp = self.client.get("/", headers={"Accept-Encoding": "gzip, deflate"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(resp.headers["Vary"], "Accept-Encoding")
+        self.assertIn(b"<html>", gzip.decompress(resp.data))
+
+    def test_gzip_refused(self):
+        """It should send the identity encoding when gzip has a zero quality"""
+        resp = self.client.get("/", headers={"Accept-Encoding": "gzip;q=0"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertIn(b"<html>", resp.data)
+
+    def test_static_immutable_with_hash(self):
+        """It should cache a static file forever when the url has its hash"""
+        asset = assets.static["css/cerulean_bootstrap.min.css"]
+        resp = self.client.get(
+            f"/static/css/cerulean_bootstrap.min.css?v={asset.digest}"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertIn("immutable", resp.headers["Cache-Control"])
+        self.assertIn(f"max-age={app.config['ASSET_MAX_AGE']}", resp.headers["Cache-Control"])
+
+    def test_static_stale_hash(self):
+        """It should require revalidation when the url hash is stale"""
+        resp = self.client.get("/static/css/cerulean_bootstrap.min.css?v=old")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["Cache-Control"], "no-cache")
+
+    def test_encoding_preferences(self):
+        """It should send the acceptable encoding with the highest quality"""
+        resp = self.client.get("/", headers={"Accept-Encoding": "identity, gzip;q=0.5"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+        resp = self.client.get("/", headers={"Accept-Encoding": "gzip;q=1, br;q=0.1"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        resp = self.client.get("/", headers={"Accept-Encoding": "*"})
+        self.assertIn(resp.headers["Content-Encoding"], ("br", "gzip"))
+
+    def test_etag_per_encoding(self):
+        """It should give each encoding its own ETag and revalidate any of them"""
+        identity = self.client.get("/", headers={"Accept-Encoding": "identity"}).headers["ETag"]
+        gzipped = self.client.get("/", headers={"Accept-Encoding": "gzip"}).headers["ETag"]
+        self.assertNotEqual(identity, gzipped)
+        self.assertFalse(gzipped.startswith("W/"))
+        resp = self.client.get("/", headers={"Accept-Encoding": "identity", "If-None-Match": gzipped})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.headers["ETag"], identity)
+
+    def test_static_not_modified(self):
+        """It should answer 304 when the ETag still matches"""
+        resp = self.client.get("/static/js/rest_api.js")
+        etag = resp.headers["ETag"]
+        resp = self.client.get("/static/js/rest_api.js", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.data, b"")
+
+    def test_static_not_found(self):
+        """It should not find a static file that does not exist"""
+        resp = self.client.get("/static/js/nothing.js")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_images_not_compressed(self):
+        """It should not compress images"""
+        asset = assets.static["images/newapp-icon.png"]
+        self.assertEqual(list(asset.variants), ["identity"])
+
+    def test_swagger_spec_cached(self):
+        """It should encode the Swagger specification only once"""
+        resp = self.client.get("/api/swagger.json", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        spec = json.loads(gzip.decompress(resp.data))
+        self.assertIn("/wishlists", spec["paths"])
+        etag = resp.headers["ETag"]
+        resp = self.client.get("/api/swagger.json", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_apidocs(self):
+        """It should render the Swagger UI page"""
+        resp = self.client.get("/apidocs")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertIn(b"swagger", resp.data.lower())
+
+    def test_small_asset_not_compressed(self):
+        """It should not keep a gzip variant that is larger than the data"""
+        with app.test_request_context():
+            asset = CachedAsset(b"{}", "application/json")
+        self.assertNotIn("gzip", asset.variants)
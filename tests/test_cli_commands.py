@@ -5,7 +5,8 @@ import os
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 from click.testing import CliRunner
-from service.common.cli_commands import db_create
+from service.common.cli_commands import db_create, db_counters, db_upgrade
+from service.models import DataValidationError
 
 
 class TestFlaskCLI(TestCase):
@@ -21,3 +22,36 @@ class TestFlaskCLI(TestCase):
         with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
             result = self.runner.invoke(db_create)
             self.assertEqual(result.exit_code, 0)
+
+    @patch('service.common.cli_commands.upgrade_schema')
+    @patch('service.common.cli_commands.db')
+    def test_db_upgrade(self, db_mock, upgrade_mock):  # pylint: disable=unused-argument
+        """It should print the changes of the schema upgrade"""
+        upgrade_mock.return_value = ["Added column wishlist.product_count"]
+        result = self.runner.invoke(db_upgrade)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Added column wishlist.product_count", result.output)
+        upgrade_mock.assert_called_once()
+        upgrade_mock.side_effect = DataValidationError("duplicates")
+        result = self.runner.invoke(db_upgrade)
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("Nothing was changed: duplicates", result.output)
+
+    @patch('service.common.cli_commands.Wishlist')
+    def test_db_counters(self, wishlist_mock):
+        """It should rebuild the wishlist counters"""
+        wishlist_mock.rebuild_counters.return_value = 2
+        result = self.runner.invoke(db_counters)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("2 wishlists", result.output)
+
+    @patch('service.common.cli_commands.Wishlist')
+    def test_db_counters_verify(self, wishlist_mock):
+        """It should fail verification when counters are wrong"""
+        wishlist_mock.counter_mismatches.return_value = []
+        result = self.runner.invoke(db_counters, ["--verify"])
+        self.assertEqual(result.exit_code, 0)
+        wishlist_mock.counter_mismatches.return_value = [1, 5]
+        result = self.runner.invoke(db_counters, ["--verify"])
+        self.assertEqual(result.exit_code, 1)
+        wishlist_mock.rebuild_counters.assert_not_called()
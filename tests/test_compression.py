@@ -0,0 +1,83 @@
+"""
+Test cases for response compression
+"""
+import gzip
+from unittest import TestCase
+from unittest.mock import patch
+from flask import Response
+from service import app
+from service.common import compression, status
+
+BASE_URL = "/api/wishlists"
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestCompression(TestCase):
+    """Response Compression Tests"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.client = app.test_client()
+        self.min_size = app.config["COMPRESSION_MIN_SIZE"]
+
+    def tearDown(self):
+        """This runs after each test"""
+        app.config["COMPRESSION_MIN_SIZE"] = self.min_size
+
+    def test_compress_large_response(self):
+        """It should gzip a response larger than the threshold"""
+        app.config["COMPRESSION_MIN_SIZE"] = 0
+        resp = self.client.get(BASE_URL, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", resp.headers["Vary"])
+        self.assertEqual(int(resp.headers["Content-Length"]), len(resp.data))
+        self.assertTrue(gzip.decompress(resp.data).startswith(b"["))
+
+    def test_skip_small_response(self):
+        """It should not compress responses under the threshold"""
+        app.config["COMPRESSION_MIN_SIZE"] = 1 << 20
+        resp = self.client.get(BASE_URL, headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+
+    def test_skip_list_and_identity(self):
+        """It should honour the skip list and clients without gzip"""
+        app.config["COMPRESSION_MIN_SIZE"] = 0
+        resp = self.client.get("/health", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+        resp = self.client.get(BASE_URL, headers={"Accept-Encoding": "identity"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+
+    def test_select_encoding_quality(self):
+        """It should pick the accepted encoding with the highest quality"""
+        with patch.object(compression, "brotli", object()):  # as if it were installed
+            for accept, encoding in (
+                ("gzip;q=1, br;q=0.1", "gzip"),
+                ("gzip;q=0.5, br", "br"),
+                ("gzip, br", "br"),
+                ("identity, gzip;q=0.5", None),
+                ("br;q=0, gzip;q=0", None),
+            ):
+                with app.test_request_context(headers={"Accept-Encoding": accept}):
+                    self.assertEqual(compression.select_encoding(), encoding, accept)
+        with patch.object(compression, "brotli", None):
+            with app.test_request_context(headers={"Accept-Encoding": "br, gzip;q=0.1"}):
+                self.assertEqual(compression.select_encoding(), "gzip")
+
+    def test_compress_stream(self):
+        """It should compress a streamed response chunk by chunk"""
+        chunks = [b"[", b'{"name": "list"}', ",", b'{"name": "other"}', b"]"]
+        with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+            resp = compression.compress_response(
+                Response(iter(chunks), mimetype="application/json")
+            )
+            self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+            self.assertNotIn("Content-Length", resp.headers)
+            parts = list(resp.response)
+        # every chunk is flushed so it can be decoded as soon as it arrives
+        self.assertEqual(len(parts), len(chunks) + 1)
+        self.assertEqual(gzip.decompress(b"".join(parts)), b''.join(
+            chunk if isinstance(chunk, bytes) else chunk.encode() for chunk in chunks
+        ))
@@ -0,0 +1,126 @@
+"""
+Test cases for the document repository
+"""
+import logging
+from datetime import date
+from unittest import TestCase
+from service import app
+from service.document_repository import DocumentRepository, documents
+from service.models import DataValidationError, Product, db
+from service.repository import DataConflictError, create_repository
+from tests import test_routes
+from tests.factories import RepositoryRoutesMixin, create_samples, new_wishlist
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestDocumentRepository(TestCase):
+    """Document Repository Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+
+    def setUp(self):
+        """This runs before each test"""
+        self.repository = DocumentRepository()
+        self.repository.clear()
+        self.ids = create_samples(self.repository)
+
+    def tearDown(self):
+        """This runs after each test"""
+        db.session.remove()
+
+    def _listed(self, criteria, sort=None):
+        return [wishlist.id for wishlist in self.repository.list_wishlists(criteria, sort)]
+
+    def test_create_wishlist(self):
+        """It should store a Wishlist and its Products as one document"""
+        wishlist = self.repository.find_wishlist(str(self.ids[0]))
+        self.assertEqual(wishlist.name, "books")
+        self.assertEqual([product.name for product in wishlist.products], ["novel", "atlas"])
+        self.assertEqual({product.wishlist_id for product in wishlist.products}, {wishlist.id})
+        self.assertEqual((wishlist.product_count, wishlist.total_quantity), (2, 4))
+        body = db.session.execute(documents.select().where(documents.c.id == wishlist.id)).one().body
+        self.assertEqual([item["name"] for item in body["products"]], ["novel", "atlas"])
+        self.assertIsNone(self.repository.find_wishlist("books"))
+        self.assertRaises(
+            DataConflictError, self.repository.create_wishlist, new_wishlist("x", "y", date.today(), ["a", "a"])
+        )
+
+    def test_listings(self):
+        """It should filter, sort and page on the members of the documents"""
+        books, bikes, boots, cups = self.ids  # pylint: disable=unbalanced-tuple-unpacking
+        self.assertEqual([w.id for w in self.repository.find_by_owner("ann")], [books, boots])
+        self.assertEqual([w.id for w in self.repository.find_by_name("bikes")], [bikes])
+        self.assertEqual(self._listed({"name_prefix": "boot", "owner": "ann"}), [boots])
+        self.assertEqual(self._listed({"start": date(2021, 1, 1), "end": date(2021, 6, 1)}), [bikes, cups])
+        self.assertEqual(self._listed({"min_items": 1}), [books, boots])
+        self.assertEqual(self.repository.count_wishlists({"owner": "ann"}), 2)
+        self.assertEqual(self._listed({}, ["-date_joined"]), [boots, bikes, cups, books])
+        after = self.repository.list_wishlists({}, ["-date_joined"], limit=2)[-1].sort_values(["-date_joined"])
+        self.assertEqual([w.id for w in self.repository.list_wishlists({}, ["-date_joined"], after)], [cups, books])
+        self.assertRaises(DataValidationError, self.repository.list_wishlists, {}, ["name"], [1])
+        self.assertRaises(DataValidationError, self.repository.filter_by_date, date(2022, 1, 1), date(2021, 1, 1))
+
+    def test_product_changes(self):
+        """It should rewrite the document with the changes of its Products"""
+        wishlist = self.repository.find_wishlist(self.ids[0])
+        novel, atlas = wishlist.products
+        novel.name, atlas.name = "atlas", "novel"
+        wishlist.products.append(Product(name="map", quantity=5))  # pylint: disable=unexpected-keyword-arg
+        wishlist.owner = "cat"
+        self.repository.update_wishlist(wishlist)
+        names = [product.name for product in self.repository.list_products(wishlist.id, sort=["name"])]
+        self.assertEqual(names, ["atlas", "map", "novel"])
+        self.assertEqual(self._listed({"owner": "cat"}), [wishlist.id])
+
+        wishlist.products.remove(novel)
+        self.repository.update_wishlist(wishlist)
+        summary = self.repository.summarize_wishlist(wishlist.id)
+        self.assertEqual((summary["product_count"], summary["total_quantity"]), (2, 7))
+
+        atlas.name = "map"
+        self.assertRaises(DataConflictError, self.repository.update_product, atlas)
+        db.session.rollback()
+        self.assertIsNone(self.repository.adjust_quantity(wishlist.id, atlas.id, -3))
+        self.assertEqual(self.repository.upsert_product(wishlist.id, "map", 1)["quantity"], 6)
+        self.assertIsNone(self.repository.upsert_product(0, "map", 1))
+
+    def test_find_product(self):
+        """It should find an embedded Product by its id from any Wishlist"""
+        left = self.repository.find_wishlist(self.ids[2]).products[0]
+        self.assertEqual(self.repository.find_product(left.id).name, "left")
+        found, product = self.repository.find_product_in_wishlist(self.ids[2], left.id)
+        self.assertEqual((found, product.name), (True, "left"))
+        self.assertEqual(self.repository.find_product_in_wishlist(self.ids[0], left.id), (True, None))
+        self.assertEqual(self.repository.find_product_in_wishlist(0, left.id), (False, None))
+        self.assertIsNone(self.repository.find_product(0))
+
+        left.wishlist_id = self.ids[1]
+        self.repository.update_product(left)
+        self.assertEqual([p.name for p in self.repository.find_wishlist(self.ids[1]).products], ["left"])
+        self.assertEqual(self.repository.find_wishlist(self.ids[2]).products, [])
+
+    def test_search_and_delete(self):
+        """It should search the embedded product names and delete documents"""
+        results = self.repository.search_products("ATL")
+        self.assertEqual([(r["name"], r["wishlist_name"], r["owner"]) for r in results], [("atlas", "books", "ann")])
+        self.assertEqual([r["name"] for r in self.repository.search_products("atlsa", fuzzy=True, threshold=0.1)], ["atlas"])
+        self.assertEqual(self.repository.search_products("2020"), [])
+        self.assertEqual(self.repository.delete_wishlists({"owner": "ann"}), 2)
+        self.assertEqual(self.repository.search_products("atlas"), [])
+        self.assertEqual(self.repository.summarize_owner("ann")["wishlist_count"], 0)
+
+    def test_create_repository(self):
+        """It should build the repository of the document backend"""
+        self.assertIsInstance(create_repository("document"), DocumentRepository)
+
+
+class TestDocumentRoutes(RepositoryRoutesMixin, test_routes.TestWishlistServer):
+    """REST API Server Tests on the document repository"""
+
+    repository_class = DocumentRepository
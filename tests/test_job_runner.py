@@ -0,0 +1,204 @@
+"""
+Test cases for the background jobs
+"""
+import logging
+import threading
+from datetime import timedelta
+from unittest import TestCase
+from unittest.mock import patch
+from service import app, jobs
+from service.common.job_runner import JobRunner, runner
+from service.models import Job, JobLost, Wishlist, db, utcnow
+from tests.factories import WishlistFactory, ProductFactory
+
+
+class Crash(Exception):
+    """Stands for a worker dying in the middle of a job"""
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestJobRunner(TestCase):
+    """Job Runner Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+        runner.stop()  # the tests run the jobs themselves
+
+    def setUp(self):
+        """This runs before each test"""
+        db.session.query(Job).delete()
+        db.session.query(Wishlist).delete()
+        db.session.commit()
+
+    def tearDown(self):
+        """This runs after each test"""
+        db.session.remove()
+
+    def _wishlist(self, products):
+        """Creates a wishlist with products and returns its id"""
+        wishlist = WishlistFactory()
+        wishlist.create()
+        for _ in range(products):
+            ProductFactory(wishlist=wishlist).create()
+        return wishlist.id
+
+    def _copies(self, wishlist_id):
+        """Returns the copies of a wishlist"""
+        name = Wishlist.find(wishlist_id).name + " COPY"
+        return Wishlist.find_by_name(name).all()
+
+    def test_copy_wishlist(self):
+        """It should copy a Wishlist in a job"""
+        wishlist_id = self._wishlist(3)
+        job = Job.submit("copy_wishlist", {"wishlist_id": wishlist_id})
+        self.assertEqual(runner.run_pending(), 1)
+
+        job = Job.find(job.id)
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual((job.progress, job.total, job.attempts), (3, 3, 1))
+        copy = Wishlist.find(job.result["wishlist_id"])
+        self.assertEqual(copy.product_count, 3)
+        self.assertEqual(
+            sorted(product.name for product in copy.products),
+            sorted(product.name for product in Wishlist.find(wishlist_id).products),
+        )
+        self.assertEqual(runner.run_pending(), 0)
+
+    def test_resume_after_crash(self):
+        """It should resume a Job from its checkpoint once its worker is gone"""
+        wishlist_id = self._wishlist(5)
+        submitted = Job.submit("copy_wishlist", {"wishlist_id": wishlist_id})
+        job = Job.claim("dead:1", runner.stale_after)
+        saves = []
+        save_progress = Job.save_progress
+
+        def crash_after_first_batch(self, progress, checkpoint=None, **kwargs):
+            save_progress(self, progress, checkpoint, **kwargs)
+            saves.append(progress)
+            if progress:
+                raise Crash()
+
+        with patch.object(jobs, "JOB_BATCH_SIZE", 2), patch.object(Job, "save_progress", crash_after_first_batch):
+            self.assertRaises(Crash, jobs.copy_wishlist, job)
+        self.assertEqual(saves, [0, 2])
+        db.session.rollback()
+
+        # nobody picks it up while the heartbeat is fresh
+        self.assertEqual(runner.run_pending(), 0)
+        job.heartbeat_at = utcnow() - timedelta(seconds=runner.stale_after + 1)
+        db.session.commit()
+        with patch.object(jobs, "JOB_BATCH_SIZE", 2):
+            self.assertEqual(runner.run_pending(), 1)
+
+        job = Job.find(submitted.id)
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.attempts, 2)
+        copies = self._copies(wishlist_id)
+        self.assertEqual(len(copies), 1)
+        self.assertEqual(copies[0].product_count, 5)
+
+    def test_lost_job(self):
+        """It should not let a worker write to a Job another one has claimed since"""
+        wishlist_id = self._wishlist(3)
+        submitted = Job.submit("copy_wishlist", {"wishlist_id": wishlist_id})
+        job = Job.claim("slow:1", runner.stale_after)
+        # the heartbeat goes stale while the first worker is still alive
+        db.session.execute(
+            Job.__table__.update().values(heartbeat_at=utcnow() - timedelta(seconds=runner.stale_after + 1))
+        )
+        db.session.commit()
+        self.assertEqual(runner.run_pending(), 1)
+
+        self.assertRaises(JobLost, job.save_progress, 1, {"new_id": 0, "last_product_id": 0})
+        self.assertRaises(JobLost, job.fail, "too late")
+        db.session.expire_all()
+        job = Job.find(submitted.id)
+        self.assertEqual((job.status, job.worker, job.attempts), (Job.SUCCEEDED, runner.name, 2))
+        self.assertEqual(job.progress, 3)
+        self.assertEqual(len(self._copies(wishlist_id)), 1)
+
+    def test_import_wishlists(self):
+        """It should create the Wishlists of an import"""
+        items = [WishlistFactory().serialize() for _ in range(5)]
+        job = Job.submit("import_wishlists", {"wishlists": items})
+        with patch.object(jobs, "JOB_BATCH_SIZE", 2):
+            runner.run_pending()
+        job = Job.find(job.id)
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.result, {"imported": 5})
+        self.assertEqual(job.checkpoint, {"done": 5})
+        self.assertEqual(len(Wishlist.all()), 5)
+
+    def test_cancel_queued_job(self):
+        """It should cancel a queued Job before it runs"""
+        job = Job.submit("copy_wishlist", {"wishlist_id": self._wishlist(1)})
+        self.assertTrue(job.cancel())
+        self.assertEqual(job.status, Job.CANCELLED)
+        self.assertEqual(runner.run_pending(), 0)
+        self.assertFalse(job.cancel())
+
+    def test_cancel_running_job(self):
+        """It should stop a running Job at its next checkpoint"""
+        wishlist_id = self._wishlist(2)
+        job = Job.submit("copy_wishlist", {"wishlist_id": wishlist_id})
+        job = Job.claim("worker:1", runner.stale_after)
+        self.assertTrue(job.cancel())
+        self.assertEqual(job.status, Job.RUNNING)
+        runner.run(job.id)
+
+        db.session.expire_all()
+        job = Job.find(job.id)
+        self.assertEqual(job.status, Job.CANCELLED)
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(job.progress, 0)
+
+    def test_failed_job(self):
+        """It should record why a Job failed"""
+        job = Job.submit("copy_wishlist", {"wishlist_id": 0})
+        runner.run_pending()
+        job = Job.find(job.id)
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn("not exist", job.error)
+
+        job = Job.submit("unknown", {})
+        runner.run_pending()
+        self.assertEqual(Job.find(job.id).status, Job.FAILED)
+
+    def test_give_up_after_attempts(self):
+        """It should fail a Job that keeps killing its workers"""
+        job = Job.submit("copy_wishlist", {"wishlist_id": self._wishlist(1)})
+        job.attempts = runner.max_attempts
+        db.session.commit()
+        runner.run_pending()
+        job = Job.find(job.id)
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn("gave up", job.error)
+
+    def test_claim_once(self):
+        """It should let a single worker claim a Job"""
+        Job.submit("copy_wishlist", {"wishlist_id": 0})
+        self.assertIsNotNone(Job.claim("worker:1", runner.stale_after))
+        self.assertIsNone(Job.claim("worker:2", runner.stale_after))
+
+    def test_threads(self):
+        """It should run queued Jobs on its threads"""
+        threaded = JobRunner(app, workers=1, poll_interval=0.05)
+        threaded.handlers = runner.handlers
+        threaded.start()
+        try:
+            job = Job.submit("copy_wishlist", {"wishlist_id": self._wishlist(2)})
+            threaded.wake()
+            for _ in range(200):
+                db.session.expire_all()
+                if job.status in Job.FINISHED:
+                    break
+                threading.Event().wait(0.05)
+        finally:
+            threaded.stop()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(Wishlist.find(job.result["wishlist_id"]).product_count, 2)
@@ -0,0 +1,119 @@
+"""
+Test cases for the logging pipeline
+"""
+import json
+import logging
+import sys
+from types import SimpleNamespace
+from unittest import TestCase
+from service.common import log_handlers
+from service.common.log_handlers import JsonFormatter, SamplingFilter, parse_rates
+
+
+class ListHandler(logging.Handler):
+    """Keeps the formatted records in a list"""
+
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestLogHandlers(TestCase):
+    """Logging Pipeline Tests"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.rates = dict(log_handlers.sampler.rates)
+        self.pipeline = log_handlers.pipeline
+        self.target = ListHandler()
+        logging.getLogger("test.gunicorn").handlers = [self.target]
+        self.app = SimpleNamespace(
+            logger=logging.getLogger("test.app"),
+            config={"LOG_FORMAT": "json", "LOG_LEVEL": "INFO", "LOG_ASYNC": True, "LOG_SAMPLING": ""},
+        )
+
+    def tearDown(self):
+        """This runs after each test"""
+        if log_handlers.pipeline is not self.pipeline:
+            log_handlers.pipeline.stop()
+        log_handlers.pipeline = self.pipeline
+        log_handlers.sampler.rates = self.rates
+        logging.getLogger("test.app.models").setLevel(logging.NOTSET)
+
+    def _record(self, name="test", level=logging.INFO, msg="Processing %s", args=("x",)):
+        return logging.LogRecord(name, level, __file__, 1, msg, args, None)
+
+    def test_json_formatter(self):
+        """It should format a record as a line of JSON"""
+        formatter = JsonFormatter()
+        entry = json.loads(formatter.format(self._record()))
+        self.assertEqual(entry["level"], "INFO")
+        self.assertEqual(entry["logger"], "test")
+        self.assertEqual(entry["message"], "Processing x")
+        exc_info = None
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            exc_info = sys.exc_info()
+        record = logging.LogRecord("test", logging.ERROR, __file__, 1, "failed", None, exc_info)
+        line = formatter.format(record)
+        self.assertNotIn("\n", line)
+        self.assertIn("ValueError: boom", json.loads(line)["exception"])
+
+    def test_parse_rates(self):
+        """It should parse the sampling setting"""
+        self.assertEqual(parse_rates(""), {})
+        self.assertEqual(parse_rates("service.models=0.1, test=1"), {"service.models": 0.1, "test": 1.0})
+        self.assertRaises(ValueError, parse_rates, "service=often")
+
+    def test_sampling(self):
+        """It should keep one in 1/rate info records per message"""
+        sampler = SamplingFilter({"test": 0.25, "test.quiet": 0})
+        kept = [sampler.filter(self._record()) for _ in range(8)]
+        self.assertEqual(kept, [True, False, False, False] * 2)
+        self.assertTrue(sampler.filter(self._record(msg="Other %s")))
+        self.assertTrue(sampler.filter(self._record(level=logging.WARNING)))
+        self.assertFalse(sampler.filter(self._record(name="test.quiet")))
+        self.assertTrue(sampler.filter(self._record(name="test.quiet", level=logging.ERROR)))
+        self.assertEqual(sampler.rate("test.child"), 0.25)
+        self.assertTrue(sampler.filter(self._record(name="other")))
+
+    def test_async_pipeline(self):
+        """It should write the records from the listener thread"""
+        log_handlers.init_logging(self.app, "test.gunicorn")
+        self.assertIsInstance(self.app.logger.handlers[0], log_handlers.LocalQueueHandler)
+        argument = ["mutable"]
+        logging.getLogger("test.app.models").info("Processing %s", argument)
+        argument.append("changed")
+        log_handlers.pipeline.stop()
+        entries = [json.loads(line) for line in self.target.lines]
+        self.assertEqual(entries[-1]["message"], "Processing ['mutable']")
+        self.assertEqual(entries[-1]["logger"], "test.app.models")
+
+    def test_sync_text(self):
+        """It should write text records in the calling thread when not async"""
+        self.app.config.update(LOG_FORMAT="text", LOG_ASYNC=False, LOG_SAMPLING="test.app.models=0.5")
+        log_handlers.init_logging(self.app, "test.gunicorn")
+        self.assertEqual(self.app.logger.handlers, [self.target])
+        for _ in range(4):
+            logging.getLogger("test.app.models").info("Processing")
+        self.assertEqual(sum("Processing" in line for line in self.target.lines), 2)
+        self.assertTrue(self.target.lines[-1].startswith("["))
+
+    def test_change_settings(self):
+        """It should change levels and rates at runtime"""
+        log_handlers.init_logging(self.app, "test.gunicorn")
+        log_handlers.change_settings({"test.app.models": "debug"}, {"test.app.models": 0.5})
+        settings = log_handlers.logging_settings(self.app)
+        self.assertEqual(settings["levels"]["test.app"], "INFO")
+        self.assertEqual(settings["levels"]["test.app.models"], "DEBUG")
+        self.assertEqual(settings["sampling"], {"test.app.models": 0.5})
+        self.assertRaises(ValueError, log_handlers.change_settings, {"test.app": "LOUD"})
+        self.assertRaises(ValueError, log_handlers.change_settings, None, {"test.app": 2})
+        self.assertEqual(self.app.logger.level, logging.INFO)
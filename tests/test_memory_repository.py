@@ -0,0 +1,115 @@
+"""
+Test cases for the in-memory repository
+"""
+from datetime import date
+from unittest import TestCase
+from service.memory_repository import MemoryRepository
+from service.models import DataValidationError, Product
+from service.repository import DataConflictError, create_repository
+from tests import test_routes
+from tests.factories import RepositoryRoutesMixin, create_samples, new_wishlist
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestMemoryRepository(TestCase):
+    """In-Memory Repository Tests"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.repository = MemoryRepository()
+        self.ids = create_samples(self.repository)
+
+    def _listed(self, criteria, sort=None):
+        return [wishlist.id for wishlist in self.repository.list_wishlists(criteria, sort)]
+
+    def test_create_wishlist(self):
+        """It should give a new Wishlist and its Products ids and counters"""
+        wishlist = self.repository.find_wishlist(str(self.ids[0]))
+        self.assertEqual(wishlist.name, "books")
+        self.assertEqual([product.name for product in wishlist.products], ["novel", "atlas"])
+        self.assertEqual((wishlist.product_count, wishlist.total_quantity), (2, 4))
+        self.assertIsNone(self.repository.find_wishlist("books"))
+        self.assertRaises(
+            DataConflictError, self.repository.create_wishlist, new_wishlist("x", "y", date.today(), ["a", "a"])
+        )
+
+    def test_secondary_indexes(self):
+        """It should find Wishlists by owner, name, date range and name prefix"""
+        books, bikes, boots, cups = self.ids  # pylint: disable=unbalanced-tuple-unpacking
+        self.assertEqual([w.id for w in self.repository.find_by_owner("ann")], [books, boots])
+        self.assertEqual([w.id for w in self.repository.find_by_name("bikes")], [bikes])
+        self.assertEqual(
+            [w.id for w in self.repository.filter_by_date(date(2021, 1, 1), date(2021, 6, 1))], [cups, bikes]
+        )
+        self.assertEqual(self._listed({"name_prefix": "b"}), [books, bikes, boots])
+        self.assertEqual(self._listed({"name_prefix": "bo", "owner": "ann"}), [books, boots])
+        self.assertEqual(self._listed({"owner": "ann", "start": date(2021, 1, 1)}), [boots])
+        self.assertEqual(self._listed({"ids": [cups, 0]}), [cups])
+        self.assertEqual(self._listed({"min_items": 1}), [books, boots])
+        self.assertEqual(self.repository.count_wishlists({"end": date(2021, 1, 1)}), 2)
+        self.assertRaises(
+            DataValidationError, self.repository.filter_by_date, date(2022, 1, 1), date(2021, 1, 1)
+        )
+
+    def test_update_reindexes(self):
+        """It should move an updated Wishlist in its indexes"""
+        wishlist = self.repository.find_wishlist(self.ids[1])
+        wishlist.owner = "ann"
+        wishlist.date_joined = date(2019, 1, 1)
+        self.repository.update_wishlist(wishlist)
+        self.assertEqual(self._listed({"owner": "ann"}), sorted([self.ids[0], self.ids[1], self.ids[2]]))
+        self.assertEqual(self._listed({"owner": "bob"}), [])
+        self.assertEqual(self._listed({"end": date(2019, 12, 31)}), [self.ids[1]])
+
+    def test_sort_and_cursor(self):
+        """It should sort like the database with NULL first and seek past a cursor"""
+        self.assertEqual(self._listed({}, ["owner", "-name"]), [self.ids[3], self.ids[2], self.ids[0], self.ids[1]])
+        after = self.repository.list_wishlists({}, ["-date_joined"], limit=2)[-1].sort_values(["-date_joined"])
+        rest = self.repository.list_wishlists({}, ["-date_joined"], after)
+        self.assertEqual([wishlist.id for wishlist in rest], [self.ids[3], self.ids[0]])
+        self.assertRaises(DataValidationError, self.repository.list_wishlists, {}, ["name"], [1])
+        self.assertRaises(DataValidationError, self.repository.list_wishlists, {}, ["price"])
+
+    def test_product_changes(self):
+        """It should keep the product names unique and the counters right"""
+        wishlist = self.repository.find_wishlist(self.ids[0])
+        novel, atlas = wishlist.products
+        novel.name, atlas.name = "atlas", "novel"  # a swap only clashes half way
+        wishlist.products.append(Product(name="map", quantity=5))  # pylint: disable=unexpected-keyword-arg
+        self.repository.update_wishlist(wishlist)
+        names = [product.name for product in self.repository.list_products(wishlist.id, sort=["name"])]
+        self.assertEqual(names, ["atlas", "map", "novel"])
+        self.assertEqual(self.repository.list_products(wishlist.id, name="novel")[0].id, atlas.id)
+
+        wishlist.products.remove(novel)
+        self.repository.update_wishlist(wishlist)
+        summary = self.repository.summarize_wishlist(wishlist.id)
+        self.assertEqual((summary["product_count"], summary["total_quantity"]), (2, 7))
+
+        atlas.name = "map"
+        self.assertRaises(DataConflictError, self.repository.update_product, atlas)
+        self.assertIsNone(self.repository.adjust_quantity(wishlist.id, atlas.id, -3))
+        self.assertEqual(self.repository.upsert_product(wishlist.id, "map", 1)["quantity"], 6)
+        self.assertIsNone(self.repository.upsert_product(0, "map", 1))
+
+    def test_search_and_delete(self):
+        """It should search product names and forget deleted Wishlists"""
+        results = self.repository.search_products("ATL")
+        self.assertEqual([(r["name"], r["wishlist_name"], r["owner"]) for r in results], [("atlas", "books", "ann")])
+        self.assertEqual(self.repository.delete_wishlists({"owner": "ann"}), 2)
+        self.assertEqual(self.repository.search_products("atlas"), [])
+        self.assertEqual(self.repository.summarize_owner("ann")["wishlist_count"], 0)
+        self.assertEqual(self._listed({"name_prefix": "b"}), [self.ids[1]])
+
+    def test_create_repository(self):
+        """It should build the repository of a storage backend"""
+        self.assertIsInstance(create_repository("memory"), MemoryRepository)
+        self.assertRaises(ValueError, create_repository, "tape")
+
+
+class TestMemoryRoutes(RepositoryRoutesMixin, test_routes.TestWishlistServer):
+    """REST API Server Tests on the in-memory repository"""
+
+    repository_class = MemoryRepository
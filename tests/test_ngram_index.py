@@ -0,0 +1,66 @@
+"""
+Test cases for the in-process trigram index
+"""
+from unittest import TestCase
+from service.common.ngram_index import NGramIndex, trigrams, similarity
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestNGramIndex(TestCase):
+    """N-Gram Index Tests"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.index = NGramIndex()
+        self.index.build([(1, "Coffee Mug"), (2, "coffee beans"), (3, "Tea Pot")])
+
+    def test_trigrams(self):
+        """It should pad every word like pg_trgm"""
+        self.assertEqual(trigrams("Cat"), {"  c", " ca", "cat", "at "})
+        self.assertEqual(trigrams(""), set())
+        self.assertEqual(similarity(trigrams("cat"), trigrams("cat")), 1.0)
+        self.assertEqual(similarity(set(), trigrams("cat")), 0.0)
+
+    def test_substring(self):
+        """It should find names containing a substring ignoring case"""
+        self.assertEqual(self.index.substring("COFFEE"), [1, 2])
+        self.assertEqual(self.index.substring("ffee m"), [1])
+        self.assertEqual(self.index.substring("po"), [3])
+        self.assertEqual(self.index.substring("juice"), [])
+
+    def test_fuzzy(self):
+        """It should rank similar names best first"""
+        matches = self.index.fuzzy("cofee", 0.3)
+        self.assertEqual([key for key, _ in matches], [1, 2])
+        self.assertTrue(all(score >= 0.3 for _, score in matches))
+        self.assertEqual(self.index.fuzzy("zzzz", 0.3), [])
+        self.assertEqual(self.index.fuzzy("", 0.3), [])
+
+    def test_add_and_remove(self):
+        """It should follow renames and deletes"""
+        self.index.add(3, "Coffee Pot")
+        self.assertEqual(self.index.substring("coffee"), [1, 2, 3])
+        self.assertEqual(self.index.substring("tea"), [])
+        self.index.remove(1)
+        self.index.remove(99)
+        self.assertEqual(self.index.substring("coffee"), [2, 3])
+        self.assertEqual(len(self.index), 2)
+
+    def test_apply(self):
+        """It should take in changes past its position only"""
+        self.index.apply([(1, None), (3, "Coffee Pot"), (4, "Iced Tea")], [0, 5])
+        self.assertEqual(self.index.substring("coffee"), [2, 3])
+        self.assertEqual(self.index.substring("tea"), [4])
+        self.assertEqual(self.index.position, [0, 5])
+        self.index.apply([(4, None)], [0, 4])
+        self.assertEqual(self.index.substring("tea"), [4])
+        self.assertEqual(self.index.position, [0, 5])
+
+    def test_compaction(self):
+        """It should purge stale postings after many updates"""
+        for _ in range(10):
+            self.index.add(1, "Coffee Mug")
+        self.assertEqual(self.index.substring("mug"), [1])
+        self.assertEqual(len(self.index), 3)
@@ -0,0 +1,137 @@
+"""
+Test cases for the readiness probe
+"""
+import logging
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from service import app
+from service.common import status
+from service.common.readiness import ReadinessProbe, probe, warm_product_names
+from service.models import Product, db
+from tests.factories import ProductFactory, WishlistFactory
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestReadiness(TestCase):
+    """Readiness Probe Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+        probe.join()
+
+    def setUp(self):
+        """This runs before each test"""
+        self.client = app.test_client()
+        self.probe = ReadinessProbe(app, interval=60)
+        self.pings = []
+        event.listen(db.engine, "before_cursor_execute", self._record)
+
+    def tearDown(self):
+        """This runs after each test"""
+        event.remove(db.engine, "before_cursor_execute", self._record)
+
+    def _record(self, conn, cursor, statement, *args):  # pylint: disable=unused-argument
+        if statement == "SELECT 1":
+            self.pings.append(statement)
+
+    def test_ready(self):
+        """It should report ready once the caches are warm"""
+        resp = self.client.get("/health/ready")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data["status"], "READY")
+        self.assertTrue(data["database"]["ok"])
+        self.assertNotIn("pending", data["warmup"].values())
+        self.assertIn("product name index", data["warmup"])
+
+    def test_cached_ping(self):
+        """It should ping the database once per interval"""
+        for _ in range(5):
+            self.assertTrue(self.probe.check()[0])
+        self.assertEqual(len(self.pings), 1)
+        self.probe.interval = 0
+        self.probe.check()
+        self.assertEqual(len(self.pings), 2)
+
+    def test_ping_running(self):
+        """It should not wait for the ping of another probe"""
+        with self.probe._lock:  # pylint: disable=protected-access
+            ready, details = self.probe.check()
+        self.assertFalse(ready)
+        self.assertEqual(details["reasons"], ["database unavailable"])
+        self.assertEqual(self.pings, [])
+
+    def test_database_down(self):
+        """It should not be ready when the database does not answer"""
+        error = OperationalError("SELECT 1", {}, Exception("connection refused"))
+        with patch.object(db.engine, "connect", side_effect=error):
+            ready, details = self.probe.check()
+        self.assertFalse(ready)
+        self.assertEqual(details["database"]["error"], "connection refused")
+
+    def test_pool_saturated(self):
+        """It should not be ready when the pool is nearly used up"""
+        with patch.object(self.probe, "pool", return_value={"checked_out": 9, "capacity": 10}):
+            ready, details = self.probe.check()
+        self.assertFalse(ready)
+        self.assertEqual(details["reasons"], ["connection pool saturated"])
+        self.assertEqual(self.pings, [])
+
+        self.probe.max_pool_wait = -1
+        ready, details = self.probe.check()
+        self.assertEqual(details["reasons"], ["connection pool wait too long"])
+
+    def test_warming_up(self):
+        """It should not be ready until the caches are warm"""
+        release = threading.Event()
+        self.probe.warmup("slow")(release.wait)
+        self.probe.warmup("broken")(lambda: 1 / 0)
+        self.probe.start_warmup()
+        try:
+            ready, details = self.probe.check()
+            self.assertFalse(ready)
+            self.assertEqual(details["reasons"], ["caches warming up"])
+        finally:
+            release.set()
+            self.probe.join()
+        ready, details = self.probe.check()
+        self.assertTrue(ready)
+        self.assertEqual(details["warmup"]["slow"], "done")
+        self.assertTrue(details["warmup"]["broken"].startswith("failed"))
+
+    def test_warm_up_too_long(self):
+        """It should not hold traffic back longer than max_warmup"""
+        release = threading.Event()
+        self.probe.warmup("slow")(release.wait)
+        self.probe.max_warmup = 0
+        self.probe.start_warmup()
+        try:
+            ready, details = self.probe.check()
+            self.assertTrue(ready)
+            self.assertEqual(details["warmup"]["slow"], "pending")
+        finally:
+            release.set()
+            self.probe.join()
+
+    def test_too_many_products(self):
+        """It should leave the product name index to the first search on a large table"""
+        wishlist = WishlistFactory()
+        ProductFactory(wishlist=wishlist)
+        wishlist.create()
+        try:
+            with app.app_context(), patch.object(Product, "build_search_index") as build:
+                with patch.dict(app.config, {"READY_WARM_MAX_PRODUCTS": 0}):
+                    self.assertEqual(warm_product_names(), "skipped: more than 0 products")
+                build.assert_not_called()
+                self.assertIsNone(warm_product_names())
+                build.assert_called_once()
+        finally:
+            wishlist.delete()
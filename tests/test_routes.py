@@ -8,9 +8,13 @@ Test cases can be run with the following:
 # import os
 import logging
 from unittest import TestCase
+from unittest.mock import patch
 from datetime import date
+from sqlalchemy import event
 from service import app, routes
-from service.models import db, Wishlist, Product
+from service.common.job_runner import runner
+from service.models import db, DataValidationError, Job, Wishlist
+from service.repository import SqlRepository
 from service.common import status  # HTTP Status Codes
 from tests.factories import WishlistFactory, ProductFactory
 
@@ -33,6 +37,7 @@ class TestWishlistServer(TestCase):
         api_key = routes.generate_apikey()
         app.config["API_KEY"] = api_key
         app.logger.setLevel(logging.CRITICAL)
+        runner.stop()  # jobs are run by the tests with run_pending
 
     @classmethod
     def tearDownClass(cls):
@@ -42,8 +47,8 @@ class TestWishlistServer(TestCase):
         """This runs before each test"""
         self.app = app.test_client()
         self.headers = {"X-Api-Key": app.config["API_KEY"]}
-        db.session.query(Wishlist).delete()  # clean up the last tests
-        db.session.query(Product).delete()  # clean up the last tests
+        routes.repository.clear()  # clean up the last tests
+        db.session.query(Job).delete()
         db.session.commit()
         self.client = app.test_client()
 
@@ -71,7 +76,7 @@ class TestWishlistServer(TestCase):
                 "Could not create test wishlist",
             )
             new_wishlist_id = resp.get_json()["id"]
-            new_wishlist = Wishlist.find(new_wishlist_id)
+            new_wishlist = routes.repository.find_wishlist(new_wishlist_id)
             wishlists.append(new_wishlist)
         return wishlists
 
@@ -91,10 +96,15 @@ class TestWishlistServer(TestCase):
                 "Could not create test product",
             )
             new_product_id = resp.get_json()["id"]
-            new_product = Product.find(new_product_id)
+            new_product = routes.repository.find_product(new_product_id)
             products.append(new_product)
         return products
 
+    def _require_sql(self):
+        """Skips a test of the model writes outside SqlRepository"""
+        if not isinstance(routes.repository, SqlRepository):
+            self.skipTest("the test is about the writes of the models")
+
     ######################################################################
     #  P L A C E   T E S T   C A S E S   H E R E
     ######################################################################
@@ -102,6 +112,7 @@ class TestWishlistServer(TestCase):
         """It should return"""
         resp = self.client.get("/health")
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertIn("coalesced", resp.get_json()["single_flight"])
 
     def test_index(self):
         """It should call the home page"""
@@ -151,9 +162,8 @@ class TestWishlistServer(TestCase):
 
         # check if the product is in the wishlist
         product_id = resp["id"]
-        product = Product.find(product_id)
-        products = test_wishlist.products
-        self.assertIn(product, products)
+        products = routes.repository.find_wishlist(test_wishlist.id).products
+        self.assertIn(product_id, [product.id for product in products])
 
     def test_create_product_wishlist_not_exist(self):
         """It should report 404 error: wishlist not exist when creating products"""
@@ -187,6 +197,7 @@ class TestWishlistServer(TestCase):
         self.assertEqual(len(data), 2)
 
         # test get products by name
+        wishlist = routes.repository.find_wishlist(wishlist.id)
         resp = self.client.get(
             f"{BASE_URL}/{wishlist.id}/products?name={wishlist.products[0].name}"
         )
@@ -246,6 +257,7 @@ class TestWishlistServer(TestCase):
         )
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
         data = resp.get_json()
+        test_product = routes.repository.find_product(test_product.id)
         self.assertEqual(test_product.name, data["name"])
         self.assertEqual(test_product.quantity, data["quantity"])
 
@@ -268,7 +280,7 @@ class TestWishlistServer(TestCase):
             f"{BASE_URL}/{test_wishlists[1].id}/products/{test_product.id}",
             json=info,
         )
-        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
     def test_update_product_not_exist(self):
         """It should update the product that not exist"""
@@ -305,6 +317,19 @@ class TestWishlistServer(TestCase):
         )
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
 
+    def test_product_in_other_wishlist(self):
+        """It should not reach a product through another wishlist"""
+        test_wishlists = self._create_wishlists(2)
+        test_product = self._create_products(test_wishlists[0].id, 1)[0]
+        url = f"{BASE_URL}/{test_wishlists[1].id}/products/{test_product.id}"
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.client.delete(url)
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertIsNotNone(routes.repository.find_product(test_product.id))
+        resp = self.client.get(f"{BASE_URL}/0/products/{test_product.id}")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_delete_product_wishlist_not_exist(self):
         """It should report 404 error: wishlist not exist when deleting a product"""
         test_wishlist = self._create_wishlists(1)[0]
@@ -369,7 +394,8 @@ class TestWishlistServer(TestCase):
         wishlists[0].date_joined = date(2000, 1, 1)
         wishlists[1].date_joined = date(2001, 1, 1)
         wishlists[2].date_joined = date(2002, 1, 1)
-        wishlists[0].update()
+        for wishlist in wishlists:
+            routes.repository.update_wishlist(wishlist)
 
         resp = self.client.get(f"{BASE_URL}?start=2000-12-30&end=2001-12-30")
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
@@ -388,6 +414,136 @@ class TestWishlistServer(TestCase):
         self.assertEqual(data[0]["id"], wishlists[0].id)
         self.assertEqual(data[1]["id"], wishlists[1].id)
 
+    def test_list_wishlist_with_many_filters(self):
+        """It should apply every filter given together"""
+        wishlists = self._create_wishlists(3)
+        for wishlist, owner, joined in zip(wishlists, ["ann", "ann", "bob"], [2000, 2002, 2002]):
+            wishlist.owner = owner
+            wishlist.date_joined = date(joined, 1, 1)
+            wishlist.name = f"{owner} {joined}"
+            routes.repository.update_wishlist(wishlist)
+
+        resp = self.client.get(BASE_URL, query_string="owner=ann&start=2001-01-01")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([item["id"] for item in resp.get_json()], [wishlists[1].id])
+        resp = self.client.get(BASE_URL, query_string="name_prefix=ann&end=2001-01-01")
+        self.assertEqual([item["id"] for item in resp.get_json()], [wishlists[0].id])
+        resp = self.client.get(BASE_URL, query_string="start=2003-01-01&end=2001-01-01")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(BASE_URL, query_string="start=yesterday")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_wishlists_sorted_in_pages(self):
+        """It should sort Wishlists and page through them with the Link header"""
+        wishlists = self._create_wishlists(5)
+        expected = sorted(wishlists, key=lambda wishlist: (-wishlist.date_joined.toordinal(), wishlist.name, wishlist.id))
+        seen, url = [], f"{BASE_URL}?sort=-date_joined,name&limit=2"
+        while url:
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(resp.get_json()), 2)
+            seen.extend(item["id"] for item in resp.get_json())
+            link = resp.headers.get("Link")
+            url = link[1:link.index(">")] if link else None
+        self.assertEqual(seen, [wishlist.id for wishlist in expected])
+
+        resp = self.client.get(BASE_URL, query_string="sort=name&limit=2")
+        link = resp.headers["Link"]
+        cursor = link[link.index("cursor=") + 7:link.index(">")]
+        resp = self.client.get(BASE_URL, query_string=f"sort=owner&limit=2&cursor={cursor}")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(BASE_URL, query_string="cursor=garbage")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(BASE_URL, query_string="sort=total_quantity")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_wishlists_streamed(self):
+        """It should stream the same JSON array as the buffered listing"""
+        self._create_wishlists(5)
+        for query in ("", "sort=-date_joined,name", "min_items=1&count=exact"):
+            buffered = self.client.get(BASE_URL, query_string=query)
+            with patch.dict(app.config, {"STREAM_CHUNK_SIZE": 100}):
+                resp = self.client.get(BASE_URL, query_string=f"{query}&stream=true")
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertTrue(resp.is_streamed)
+            self.assertEqual(resp.data, buffered.data)
+            self.assertEqual(resp.headers.get("X-Total-Count"), buffered.headers.get("X-Total-Count"))
+
+        routes.repository.clear()
+        resp = self.client.get(BASE_URL, query_string="stream=true")
+        self.assertEqual(resp.get_json(), [])
+        resp = self.client.get(BASE_URL, query_string="stream=true&limit=2")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_changes(self):
+        """It should list the records created, updated and deleted since a cursor"""
+        if not isinstance(routes.repository, SqlRepository):
+            resp = self.client.get(f"{BASE_URL}/changes")
+            self.assertEqual(resp.status_code, status.HTTP_501_NOT_IMPLEMENTED)
+            return
+        kept, dropped = self._create_wishlists(2)  # pylint: disable=unbalanced-tuple-unpacking
+        seen, url = [], f"{BASE_URL}/changes?limit=1"
+        for _ in range(3):
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            seen.extend((change["kind"], change["id"]) for change in resp.get_json())
+            link = resp.headers["Link"]
+            url = link[1:link.index(">")]
+        self.assertEqual(seen, [("wishlist", kept.id), ("wishlist", dropped.id)])
+        self.assertEqual(resp.get_json(), [])
+
+        product = self._create_products(kept.id, 1)[0]
+        self.client.delete(f"{BASE_URL}/{dropped.id}", headers=self.headers)
+        resp = self.client.get(url.replace("limit=1", "limit=10"))
+        changes = {(change["kind"], change["id"]): change for change in resp.get_json()}
+        # the product and the counters of its wishlist were written by one request, the delete by a later one
+        self.assertCountEqual(list(changes)[:2], [("product", product.id), ("wishlist", kept.id)])
+        self.assertEqual(list(changes)[2:], [("wishlist", dropped.id)])
+        self.assertEqual(changes["product", product.id]["product"]["name"], product.name)
+        self.assertEqual(changes["wishlist", kept.id]["wishlist"]["product_count"], 1)
+        self.assertTrue(changes["wishlist", dropped.id]["deleted"])
+        self.assertIsNone(changes["wishlist", dropped.id]["wishlist"])
+
+        resp = self.client.get(f"{BASE_URL}/changes", query_string="since=garbage")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_count_wishlists(self):
+        """It should count Wishlists in X-Total-Count"""
+        wishlists = self._create_wishlists(3)
+        owner = wishlists[0].owner
+        matching = len([wishlist for wishlist in wishlists if wishlist.owner == owner])
+
+        resp = self.client.head(BASE_URL, query_string=f"owner={owner}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["X-Total-Count"], str(matching))
+        self.assertEqual(resp.data, b"")
+        resp = self.client.head(BASE_URL, query_string="count=estimated")
+        self.assertEqual(resp.headers["X-Total-Count"], "3")
+
+        resp = self.client.get(BASE_URL, query_string="limit=1&count=exact")
+        self.assertEqual(len(resp.get_json()), 1)
+        self.assertEqual(resp.headers["X-Total-Count"], "3")
+        resp = self.client.get(BASE_URL)
+        self.assertNotIn("X-Total-Count", resp.headers)
+        resp = self.client.head(BASE_URL, query_string="count=none")
+        self.assertNotIn("X-Total-Count", resp.headers)
+        resp = self.client.get(BASE_URL, query_string="count=roughly")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_products_sorted_in_pages(self):
+        """It should sort the Products of a Wishlist and page through them"""
+        wishlist = self._create_wishlists(1)[0]
+        products = self._create_products(wishlist.id, 3)
+        names = sorted((product.name for product in products), reverse=True)
+        resp = self.client.get(f"{BASE_URL}/{wishlist.id}/products", query_string="sort=-name&limit=2")
+        self.assertEqual([item["name"] for item in resp.get_json()], names[:2])
+        link = resp.headers["Link"]
+        resp = self.client.get(link[1:link.index(">")])
+        self.assertEqual([item["name"] for item in resp.get_json()], names[2:])
+        self.assertNotIn("Link", resp.headers)
+        resp = self.client.get(f"{BASE_URL}/{wishlist.id}/products", query_string="sort=quantity")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
     # def test_update_wishlist_by_name(self):
     #     """It should Update an existing Wishlist"""
     #     # create an Wishlist to update
@@ -425,6 +581,22 @@ class TestWishlistServer(TestCase):
         resp = self.client.put(f"{BASE_URL}/0", json=new_wishlist)
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_update_wishlist_round_trip(self):
+        """It should Update a Wishlist with what was read from it"""
+        wishlist = self._create_wishlists(1)[0]
+        self._create_products(wishlist.id, 2)
+        data = self.client.get(f"{BASE_URL}/{wishlist.id}").get_json()
+        data["name"] = "renamed"
+        data["products"][0]["quantity"] = 7
+        data["products"].append({"name": "new one", "quantity": 1})
+        resp = self.client.put(f"{BASE_URL}/{wishlist.id}", json=data)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        updated = self.client.get(f"{BASE_URL}/{wishlist.id}").get_json()
+        self.assertEqual(updated["name"], "renamed")
+        self.assertEqual(updated["product_count"], 3)
+        self.assertEqual(updated["products"][0]["id"], data["products"][0]["id"])
+        self.assertEqual(updated["products"][0]["quantity"], 7)
+
     def test_copy_a_wishlist(self):
         """It should copy an existing Wishlist"""
         wishlists = self._create_wishlists(1)
@@ -442,11 +614,326 @@ class TestWishlistServer(TestCase):
         self.assertNotEqual(data["id"], old_wishlist.id)
         self.assertEqual(data["name"], old_wishlist.name + " COPY")
         self.assertEqual(len(data["products"]), 2)
+        self.assertEqual(data["product_count"], 2)
 
         # if old wishlist does not exist
         resp = self.client.post(f"{BASE_URL}/0/copy")
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_one_commit_per_request(self):
+        """It should commit the changes of a request once"""
+        self._require_sql()
+        wishlist = self._create_wishlists(1)[0]
+        self._create_products(wishlist.id, 3)
+        product = ProductFactory()
+        commits = []
+
+        def record(conn):
+            commits.append(conn)
+
+        event.listen(db.engine, "commit", record)
+        try:
+            resp = self.client.post(
+                f"{BASE_URL}/{wishlist.id}/products",
+                json={"name": product.name, "wishlist_id": wishlist.id, "quantity": 1},
+                headers=self.headers,
+            )
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(len(commits), 1)
+            resp = self.client.post(f"{BASE_URL}/{wishlist.id}/copy")
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(resp.get_json()["product_count"], 4)
+            self.assertEqual(len(commits), 2)
+        finally:
+            event.remove(db.engine, "commit", record)
+
+    def test_failed_request_rolls_back(self):
+        """It should keep nothing of a request that fails"""
+        self._require_sql()
+        wishlist = self._create_wishlists(1)[0]
+        product = ProductFactory()
+        # the product is flushed before the update of the wishlist fails
+        with patch.object(Wishlist, "update", side_effect=DataValidationError("boom")):
+            resp = self.client.post(
+                f"{BASE_URL}/{wishlist.id}/products",
+                json={"name": product.name, "wishlist_id": wishlist.id, "quantity": 1},
+                headers=self.headers,
+            )
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(f"{BASE_URL}/{wishlist.id}/products")
+        self.assertEqual(resp.get_json(), [])
+
+    def test_copy_a_wishlist_in_background(self):
+        """It should copy a large Wishlist in a background Job"""
+        old_wishlist = self._create_wishlists(1)[0]
+        self._create_products(old_wishlist.id, 3)
+
+        resp = self.client.post(f"{BASE_URL}/{old_wishlist.id}/copy", query_string="async=true")
+        self.assertEqual(resp.status_code, status.HTTP_202_ACCEPTED)
+        job = resp.get_json()
+        self.assertEqual((job["kind"], job["status"], job["total"]), ("copy_wishlist", "queued", 3))
+        job_url = resp.headers["Location"]
+        self.assertTrue(job_url.endswith(f"/api/jobs/{job['id']}"))
+
+        self.assertEqual(runner.run_pending(), 1)
+        resp = self.client.get(job_url)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        job = resp.get_json()
+        self.assertEqual((job["status"], job["progress"]), ("succeeded", 3))
+        resp = self.client.get(f"{BASE_URL}/{job['result']['wishlist_id']}")
+        self.assertEqual(resp.get_json()["name"], old_wishlist.name + " COPY")
+        self.assertEqual(resp.get_json()["product_count"], 3)
+
+        # past the threshold the copy goes to the background by itself
+        app.config["COPY_ASYNC_THRESHOLD"] = 2
+        try:
+            resp = self.client.post(f"{BASE_URL}/{old_wishlist.id}/copy")
+        finally:
+            app.config["COPY_ASYNC_THRESHOLD"] = 1000
+        self.assertEqual(resp.status_code, status.HTTP_202_ACCEPTED)
+
+    def test_import_wishlists(self):
+        """It should import Wishlists in a background Job"""
+        wishlists = [WishlistFactory().serialize() for _ in range(3)]
+        resp = self.client.post(
+            f"{BASE_URL}/import", json={"wishlists": wishlists}, headers=self.headers
+        )
+        self.assertEqual(resp.status_code, status.HTTP_202_ACCEPTED)
+        runner.run_pending()
+        job = self.client.get(resp.headers["Location"]).get_json()
+        self.assertEqual(job["result"], {"imported": 3})
+        self.assertEqual(len(self.client.get(BASE_URL).get_json()), 3)
+
+        del wishlists[1]["owner"]
+        resp = self.client.post(
+            f"{BASE_URL}/import", json={"wishlists": wishlists}, headers=self.headers
+        )
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Wishlist 1", resp.get_json()["message"])
+        resp = self.client.post(f"{BASE_URL}/import", json={}, headers=self.headers)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cancel_job(self):
+        """It should cancel a queued Job"""
+        wishlist = self._create_wishlists(1)[0]
+        resp = self.client.post(f"{BASE_URL}/{wishlist.id}/copy", query_string="async=true")
+        job_url = resp.headers["Location"]
+
+        resp = self.client.delete(job_url, headers=self.headers)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["status"], "cancelled")
+        self.assertEqual(runner.run_pending(), 0)
+        resp = self.client.delete(job_url, headers=self.headers)
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        resp = self.client.get("/api/jobs/0")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_change_logging(self):
+        """It should change the logging settings without a restart"""
+        resp = self.client.get("/api/logging")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertIn("service.models", resp.get_json()["levels"])
+        sampling = dict(resp.get_json()["sampling"])
+
+        resp = self.client.put(
+            "/api/logging",
+            json={"levels": {"service.models": "debug"}, "sampling": {"service.models": 0.5}},
+            headers=self.headers,
+        )
+        try:
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(resp.get_json()["levels"]["service.models"], "DEBUG")
+            self.assertEqual(resp.get_json()["sampling"]["service.models"], 0.5)
+            self.assertEqual(logging.getLogger("service.models").level, logging.DEBUG)
+        finally:
+            logging.getLogger("service.models").setLevel(logging.NOTSET)
+            self.client.put("/api/logging", json={"sampling": {"service.models": sampling.get("service.models", 1)}})
+
+        resp = self.client.put("/api/logging", json={"levels": {"service": "LOUD"}})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.put("/api/logging", json={"levels": ["DEBUG"]})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_wishlist_by_size(self):
+        """It should List Wishlists with a minimum number of products"""
+        wishlists = self._create_wishlists(3)
+        self._create_products(wishlists[0].id, 1)
+        self._create_products(wishlists[2].id, 2)
+        resp = self.client.get(BASE_URL, query_string="min_items=1")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual([wishlist["id"] for wishlist in data], [wishlists[2].id, wishlists[0].id])
+        self.assertEqual(data[0]["product_count"], 2)
+        self.assertEqual(data[0]["total_quantity"], sum(p["quantity"] for p in data[0]["products"]))
+
+        resp = self.client.get(BASE_URL, query_string="max_items=0")
+        self.assertEqual([wishlist["id"] for wishlist in resp.get_json()], [wishlists[1].id])
+
+        resp = self.client.get(BASE_URL, query_string="min_items=many")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_products(self):
+        """It should Search products by name across all Wishlists"""
+        wishlists = self._create_wishlists(2)
+        for wishlist in wishlists:
+            for name in ["Coffee Mug", "Tea Pot"]:
+                resp = self.client.post(
+                    f"{BASE_URL}/{wishlist.id}/products",
+                    json={"name": name, "wishlist_id": wishlist.id, "quantity": 1},
+                )
+                self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+
+        resp = self.client.get("/api/products/search", query_string="q=mug&per_page=1")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]["wishlist_id"], wishlists[0].id)
+        self.assertEqual(data[0]["wishlist_name"], wishlists[0].name)
+        self.assertIn('rel="next"', resp.headers["Link"])
+
+        resp = self.client.get("/api/products/search", query_string="q=mug&per_page=1&page=2")
+        data = resp.get_json()
+        self.assertEqual(data[0]["wishlist_id"], wishlists[1].id)
+        self.assertNotIn("Link", resp.headers)
+
+        resp = self.client.get("/api/products/search", query_string="q=tea+pott&fuzzy=true")
+        self.assertEqual(len(resp.get_json()), 2)
+
+        resp = self.client.get("/api/products/search")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get("/api/products/search", query_string="q=mug&per_page=1000")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_wishlist_summary(self):
+        """It should return the aggregate figures of a Wishlist"""
+        wishlist = self._create_wishlists(1)[0]
+        products = self._create_products(wishlist.id, 3)
+        resp = self.client.get(f"{BASE_URL}/{wishlist.id}/summary")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data["id"], wishlist.id)
+        self.assertEqual(data["product_count"], 3)
+        self.assertEqual(
+            data["total_quantity"], sum(product.quantity for product in products)
+        )
+        self.assertIsNotNone(data["last_modified"])
+
+        resp = self.client.get(f"{BASE_URL}/0/summary")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_owner_summary(self):
+        """It should return the aggregate figures of an owner"""
+        wishlists = self._create_wishlists(2)
+        self._create_products(wishlists[0].id, 2)
+        resp = self.client.get(f"{BASE_URL}/summary", query_string={"owner": wishlists[0].owner})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data["owner"], wishlists[0].owner)
+        self.assertEqual(data["wishlist_count"], 1)
+        self.assertEqual(data["product_count"], 2)
+
+        resp = self.client.get(f"{BASE_URL}/summary")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_delete_wishlists_by_filter(self):
+        """It should Delete the Wishlists matching a filter"""
+        wishlists = self._create_wishlists(3)
+        product_ids = [product.id for product in self._create_products(wishlists[0].id, 2)]
+        resp = self.client.delete(BASE_URL, query_string={"owner": wishlists[0].owner})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["deleted"], 1)
+        self.assertEqual([routes.repository.find_product(key) for key in product_ids], [None, None])
+
+        resp = self.client.delete(f"{BASE_URL}?id={wishlists[1].id}&id=0")
+        self.assertEqual(resp.get_json()["deleted"], 1)
+        resp = self.client.delete(BASE_URL)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.delete(BASE_URL, query_string={"all": "true"})
+        self.assertEqual(resp.get_json()["deleted"], 1)
+        self.assertEqual(routes.repository.list_wishlists({}), [])
+
+    def test_patch_wishlist(self):
+        """It should Patch some fields of a Wishlist"""
+        wishlist = self._create_wishlists(1)[0]
+        product = self._create_products(wishlist.id, 1)[0]
+        product_id = product.id
+        resp = self.client.patch(
+            f"{BASE_URL}/{wishlist.id}",
+            json={"name": "renamed", "products": [{"id": product_id, "quantity": 7}]},
+            headers={"Content-Type": "application/merge-patch+json"},
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data["name"], "renamed")
+        self.assertEqual(data["owner"], wishlist.owner)
+        self.assertEqual(data["products"][0]["id"], product_id)
+        self.assertEqual(data["products"][0]["quantity"], 7)
+
+        resp = self.client.patch(f"{BASE_URL}/{wishlist.id}", json={"date_joined": None})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.patch(f"{BASE_URL}/0", json={"name": "x"})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_patch_product(self):
+        """It should Patch some fields of a Product"""
+        wishlist = self._create_wishlists(1)[0]
+        product = self._create_products(wishlist.id, 1)[0]
+        url = f"{BASE_URL}/{wishlist.id}/products/{product.id}"
+        resp = self.client.patch(url, json={"name": "renamed"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["name"], "renamed")
+        self.assertEqual(resp.get_json()["quantity"], product.quantity)
+
+        resp = self.client.patch(url, json={"wishlist_id": 0})
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        resp = self.client.patch(url, json={"quantity": "many"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.patch(f"{BASE_URL}/0/products/{product.id}", json={"name": "x"})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_upsert_product(self):
+        """It should add a product by name or add to its quantity"""
+        wishlist = self._create_wishlists(1)[0]
+        url = f"{BASE_URL}/{wishlist.id}/products/upsert"
+        resp = self.client.post(url, json={"name": "pen", "quantity": 2})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        product_id = resp.get_json()["id"]
+        self.assertIn(f"/products/{product_id}", resp.headers["Location"])
+        resp = self.client.post(url, json={"name": "pen", "quantity": 3})
+        self.assertEqual(resp.get_json()["id"], product_id)
+        self.assertEqual(resp.get_json()["quantity"], 5)
+
+        resp = self.client.post(url, json={"name": "pen", "quantity": 0})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.post(f"{BASE_URL}/0/products/upsert", json={"name": "pen", "quantity": 1})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_create_duplicate_product(self):
+        """It should not create two products with the same name"""
+        wishlist = self._create_wishlists(1)[0]
+        product = self._create_products(wishlist.id, 1)[0]
+        resp = self.client.post(
+            f"{BASE_URL}/{wishlist.id}/products", json=product.serialize()
+        )
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+
+    def test_change_product_quantity(self):
+        """It should add to and take away from the quantity of a product"""
+        wishlist = self._create_wishlists(1)[0]
+        product = self._create_products(wishlist.id, 1)[0]
+        quantity = product.quantity
+        url = f"{BASE_URL}/{wishlist.id}/products/{product.id}/quantity"
+        resp = self.client.post(url, json={"amount": 4})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["quantity"], quantity + 4)
+        resp = self.client.post(url, json={"amount": -(quantity + 4)})
+        self.assertEqual(resp.get_json()["quantity"], 0)
+
+        resp = self.client.post(url, json={"amount": -1})
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        resp = self.client.post(f"{BASE_URL}/0/products/{product.id}/quantity", json={"amount": 1})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
     ######################################################################
     #  E R R O R    H A N D L E R   T E S T
     ######################################################################
@@ -459,6 +946,40 @@ class TestWishlistServer(TestCase):
         )
         self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_errors_without_propagation(self):
+        """It should answer conflicts and bad data when exceptions do not propagate"""
+        wishlist = self._create_wishlists(1)[0]
+        product = self._create_products(wishlist.id, 1)[0]
+        with patch.dict(app.config, {"TESTING": False, "PROPAGATE_EXCEPTIONS": False}):
+            resp = self.client.post(f"{BASE_URL}/{wishlist.id}/products", json=product.serialize())
+            self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+            self.assertEqual(resp.get_json()["error"], "Conflict")
+            resp = self.client.post(BASE_URL, json={"name": "not enough data"}, headers=self.headers)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(resp.get_json()["error"], "Bad Request")
+
+    def test_bad_listings_without_propagation(self):
+        """It should answer bad sorts, cursors and patches with 400 when exceptions do not propagate"""
+        wishlist = self._create_wishlists(1)[0]
+        product = self._create_products(wishlist.id, 1)[0]
+        tampered = routes.encode_cursor({"sort": "date_joined", "after": ["never", 1]})
+        urls = [
+            f"{BASE_URL}?sort=price",
+            f"{BASE_URL}?sort=price&stream=true",
+            f"{BASE_URL}?sort=date_joined&cursor={tampered}",
+            f"{BASE_URL}/{wishlist.id}/products?sort=price",
+        ]
+        if isinstance(routes.repository, SqlRepository):
+            urls.append(f"{BASE_URL}/changes?since={routes.encode_cursor({'after': [1]})}")
+        with patch.dict(app.config, {"TESTING": False, "PROPAGATE_EXCEPTIONS": False}):
+            for url in urls:
+                resp = self.client.get(url)
+                self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, url)
+            resp = self.client.patch(f"{BASE_URL}/{wishlist.id}", json={"name": 5})
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+            resp = self.client.patch(f"{BASE_URL}/{wishlist.id}/products/{product.id}", json={"quantity": "x"})
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_unsupported_media_type(self):
         """It should not Create when sending wrong media type"""
         wishlist = WishlistFactory()
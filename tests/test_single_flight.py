@@ -0,0 +1,69 @@
+"""
+Test cases for request coalescing
+"""
+import threading
+from unittest import TestCase
+from service.common.single_flight import SingleFlight
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestSingleFlight(TestCase):
+    """Single Flight Tests"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.flight = SingleFlight()
+        self.release = threading.Event()
+        self.calls = []
+
+    def _run(self, count, function):
+        """Runs count concurrent calls of one key and returns their outcomes"""
+        outcomes = []
+
+        def call():
+            try:
+                outcomes.append(self.flight.do("key", function))
+            except ValueError as error:
+                outcomes.append(error)
+
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        # wait until every follower has joined the call in flight
+        while self.flight.stats()["coalesced"] < count - 1:
+            threading.Event().wait(0.01)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return outcomes
+
+    def test_shares_result(self):
+        """It should run concurrent identical calls once"""
+
+        def work():
+            self.calls.append(1)
+            self.release.wait()
+            return 42
+
+        self.assertEqual(self._run(5, work), [42] * 5)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(self.flight.stats(), {"executed": 1, "coalesced": 4, "in_flight": 0})
+
+    def test_shares_error(self):
+        """It should raise the error of the call in every caller"""
+
+        def fail():
+            self.release.wait()
+            raise ValueError("boom")
+
+        outcomes = self._run(3, fail)
+        self.assertEqual(len(outcomes), 3)
+        self.assertTrue(all(isinstance(outcome, ValueError) for outcome in outcomes))
+
+    def test_runs_again_afterwards(self):
+        """It should not cache a result once the call is over"""
+        self.assertEqual(self.flight.do("key", lambda: 1), 1)
+        self.assertEqual(self.flight.do("key", lambda: 2), 2)
+        self.assertEqual(self.flight.stats()["executed"], 2)